@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+"""Time the csv tools on synthetic inputs and compare the results between commits.
+
+The run command generates inputs for each size with generate.py, runs every tool on them end-to-end in a separate
+process, and reports seconds, rows/sec and peak resident memory per tool and size. The pipeline tool runs filter,
+regex_modify_rows, time_format and remove_columns in one process and also reports the time spent in each stage. Results
+are written to a JSON file named after the current git commit, so two runs can be compared with the compare command.
+
+usage: bench.py run [--sizes 10000 1000000 10000000] [--tools filter split_rows ...]
+       bench.py compare old.json new.json
+
+The run command takes the following optional arguments:
+sizes=Numbers of input rows to benchmark. Defaults to 10000 1000000. 10000000 is supported but takes a long time.
+tools=Tools to benchmark. Defaults to all of them.
+rules=Number of regexes in the generated filter.py rule file. Defaults to 200.
+work_dir=Directory to write the generated files into, created if it does not exist. The files are kept after the run.
+         Defaults to a temporary directory that is removed at exit.
+results=Path of the JSON results file. Defaults to bench_<commit>.json.
+
+The compare command takes the following optional arguments:
+threshold=Fractional drop in rows/sec reported as a regression. Defaults to 0.1. The command exits with status 1 when
+          any tool regressed.
+"""
+import csv
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+import generate
+
+author = 'brian.k.smith@gmail.com'
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def script(name):
+    return [sys.executable, os.path.join(repo_dir, name)]
+
+
+# Command line of each tool, given the generated file paths and the output path
+TOOLS = OrderedDict([
+    ('filter', lambda p, out: script('filter.py') + [p['rules.csv'], '--input', p['bank.csv'], '--output', out]),
+    ('regex_modify_rows', lambda p, out: script('regex_modify_rows.py') + [p['modify.csv'], '--input', p['bank.csv'],
+                                                                            '--output', out]),
+    ('regex_match_to_column', lambda p, out: script('regex_match_to_column.py') + [p['match.csv'], '--input',
+                                                                                    p['bank.csv'], '--output', out]),
+    ('time_format', lambda p, out: script('time_format.py') + [p['dates.csv'], '--input', p['bank.csv'], '--output',
+                                                                out]),
+    ('edit_headers', lambda p, out: script('edit_headers.py') + [p['headers.csv'], '--input', p['bank.csv'],
+                                                                  '--output', out]),
+    ('remove_columns', lambda p, out: script('remove_columns.py') + ['3', '4', '--input', p['bank.csv'], '--output',
+                                                                      out]),
+    ('split_rows', lambda p, out: script('split_rows.py') + [p['split_filter.csv'], p['split.csv'], '--input',
+                                                              p['orders.csv'], '--output', out]),
+    ('collate', lambda p, out: script('collate.py') + [p['bank.csv'], p['stripe.csv'], '5', '8', '1', '6',
+                                                        '--output', out]),
+    ('concatenate', lambda p, out: script('concatenate.py') + [p['bank.csv'], p['stripe.csv'], '--output', out]),
+    ('gnucash_import_prep', lambda p, out: script('gnucash_import_prep.py') + ['--input', p['ledger.csv'],
+                                                                              '--output', out]),
+    ('pipeline', lambda p, out: [sys.executable, os.path.abspath(__file__), 'stages', p['pipeline.json']]),
+])
+
+parser = argparse.ArgumentParser(description='Benchmark the csv tools on synthetic inputs.')
+subparsers = parser.add_subparsers(dest='command')
+run_parser = subparsers.add_parser('run', help='Generate inputs and time each tool.')
+run_parser.add_argument('--sizes', help='Numbers of input rows to benchmark.', nargs='+', type=int,
+                        default=[10000, 1000000])
+run_parser.add_argument('--tools', help='Tools to benchmark. Defaults to all of them.', nargs='+', choices=TOOLS,
+                        default=list(TOOLS))
+run_parser.add_argument('--rules', help='Number of regexes in the generated rule file.', default=200, type=int)
+run_parser.add_argument('--work_dir', help='Directory to write generated files into, created if it does not exist.'
+                                           ' The files are kept after the run. Defaults to a temporary directory'
+                                           ' that is removed at exit.')
+run_parser.add_argument('--results', help='Path of the JSON results file. Defaults to bench_<commit>.json.')
+compare_parser = subparsers.add_parser('compare', help='Compare two JSON results files.')
+compare_parser.add_argument('old', help='Path to the JSON results of the baseline run.')
+compare_parser.add_argument('new', help='Path to the JSON results of the run to check.')
+compare_parser.add_argument('--threshold', help='Fractional drop in rows/sec reported as a regression.', default=0.1,
+                            type=float)
+stages_parser = subparsers.add_parser('stages', help='Run a pipeline file in process, timing each stage.')
+stages_parser.add_argument('pipeline', help='Path to a JSON pipeline file with an additional timings key.')
+
+
+def git_commit():
+    """Return [commit hash, whether the working tree has changes], or [None, False] outside of git."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_dir, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, check=True, universal_newlines=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repo_dir,
+                                stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return [None, False]
+    return [commit, bool(status.strip())]
+
+
+def timed_rows(rows, totals, index):
+    """Yield rows, adding the time spent waiting for each row to totals[index]."""
+    rows = iter(rows)
+    clock = time.perf_counter
+    while True:
+        start = clock()
+        row = next(rows, None)
+        totals[index] += clock() - start
+        if row is None:
+            return
+        yield row
+
+
+def run_stages(pipeline_path):
+    """Run a pipeline in this process and write the seconds spent reading, in each stage and writing as JSON."""
+    sys.path.insert(0, repo_dir)
+    import pyaccounting
+
+    config = pyaccounting.load_pipeline(pipeline_path)
+    stages = pyaccounting.build_stages(config)
+    # Each total includes the time of everything upstream, the difference between neighbours is the stage's own time
+    totals = [0.0] * (len(stages) + 1)
+    start = time.perf_counter()
+    with open(config['input'], newline='', encoding='UTF-8') as input_file,\
+            open(config['output'], mode='w', newline='') as output_file,\
+            open(os.devnull, mode='w') as devnull, contextlib.redirect_stdout(devnull):
+        rows = timed_rows(csv.reader(input_file), totals, 0)
+        for i, stage in enumerate(stages):
+            rows = timed_rows(stage[1](rows, stage[2]), totals, i + 1)
+        csv.writer(output_file).writerows(rows)
+    elapsed = time.perf_counter() - start
+    timings = OrderedDict([('read', totals[0])])
+    for i, stage in enumerate(stages):
+        timings['{:d}_{}'.format(i + 1, stage[0])] = totals[i + 1] - totals[i]
+    timings['write'] = elapsed - totals[-1]
+    with open(config['timings'], mode='w') as timings_file:
+        json.dump(timings, timings_file, indent=2)
+
+
+def measure(argv):
+    """Run argv to completion and return [seconds, peak resident memory in KiB].
+
+    Raises CalledProcessError when argv fails.
+    """
+    start = time.perf_counter()
+    with open(os.devnull, mode='w') as devnull:
+        process = subprocess.Popen(argv, stdout=devnull, stderr=devnull)
+        # wait4 returns the resource usage of this child alone
+        status, usage = os.wait4(process.pid, 0)[1:]
+    elapsed = time.perf_counter() - start
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, argv)
+    return [elapsed, usage.ru_maxrss]
+
+
+def run_sizes(args, work_dir, results):
+    """Generate the input files of every size into work_dir, time every tool on them and add to results['results']."""
+    out_path = os.path.join(work_dir, 'output.csv')
+    for size in args.sizes:
+        paths = generate.generate(work_dir, size, args.rules)
+        paths['pipeline.json'] = os.path.join(work_dir, 'pipeline.json')
+        timings_path = os.path.join(work_dir, 'timings.json')
+        with open(paths['pipeline.json'], mode='w') as pipeline_file:
+            json.dump({'input': paths['bank.csv'], 'output': out_path, 'timings': timings_path,
+                       'stages': [{'filter': [paths['rules.csv']]}, {'regex_modify_rows': [paths['modify.csv']]},
+                                  {'time_format': [paths['dates.csv']]}, {'remove_columns': ['3', '4']}]},
+                      pipeline_file)
+        for tool in args.tools:
+            seconds, peak_rss = measure(TOOLS[tool](paths, out_path))
+            result = OrderedDict([('tool', tool), ('rows', size), ('seconds', round(seconds, 4)),
+                                  ('rows_per_sec', round(size / seconds, 1)), ('peak_rss_kb', peak_rss)])
+            print('{:<22} {:>10d} {:>10.2f} {:>12.0f} {:>10.1f}'.format(tool, size, seconds, size / seconds,
+                                                                        peak_rss / 1024))
+            if tool == 'pipeline':
+                with open(timings_path) as timings_file:
+                    result['stages'] = json.load(timings_file, object_pairs_hook=OrderedDict)
+                for stage, stage_seconds in result['stages'].items():
+                    print('  {:<20} {:>21.2f}'.format(stage, stage_seconds))
+            results['results'].append(result)
+
+
+def run(args):
+    commit, dirty = git_commit()
+    results = {
+        'commit': commit,
+        'dirty': dirty,
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'rules': args.rules,
+        'results': [],
+    }
+    print('{:<22} {:>10} {:>10} {:>12} {:>10}'.format('tool', 'rows', 'seconds', 'rows/sec', 'peak MiB'))
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+        run_sizes(args, args.work_dir, results)
+    else:
+        with tempfile.TemporaryDirectory(prefix='bench_') as work_dir:
+            run_sizes(args, work_dir, results)
+    results_path = args.results or 'bench_{}.json'.format((commit or 'nogit')[:12] + ('-dirty' if dirty else ''))
+    with open(results_path, mode='w') as results_file:
+        json.dump(results, results_file, indent=2)
+    print('Results written to {}'.format(results_path))
+
+
+def compare(args):
+    """Print the change in rows/sec and peak memory for every tool and size found in both results files."""
+    with open(args.old) as old_file, open(args.new) as new_file:
+        old = json.load(old_file)
+        new = json.load(new_file)
+    old_results = {(result['tool'], result['rows']): result for result in old['results']}
+    print('{} -> {}'.format(old.get('commit'), new.get('commit')))
+    print('{:<22} {:>10} {:>12} {:>12} {:>8} {:>10}'.format('tool', 'rows', 'old rows/s', 'new rows/s', 'change',
+                                                           'mem change'))
+    regressions = 0
+    for result in new['results']:
+        before = old_results.get((result['tool'], result['rows']))
+        if before is None:
+            continue
+        change = result['rows_per_sec'] / before['rows_per_sec'] - 1
+        memory_change = result['peak_rss_kb'] / before['peak_rss_kb'] - 1
+        flag = ''
+        if change < -args.threshold:
+            flag = ' REGRESSION'
+            regressions += 1
+        print('{:<22} {:>10d} {:>12.0f} {:>12.0f} {:>+7.1%} {:>+9.1%}{}'.format(
+            result['tool'], result['rows'], before['rows_per_sec'], result['rows_per_sec'], change, memory_change,
+            flag))
+    if regressions:
+        sys.exit(1)
+
+
+def main():
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'compare':
+        compare(args)
+    elif args.command == 'stages':
+        run_stages(args.pipeline)
+    else:
+        parser.print_help(sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+"""Write synthetic inputs for benchmarking the csv tools.
+
+Every file is generated from a fixed seed, so the same size always produces the same data. The generated files are:
+bank.csv=Bank export with date, payee, amount, category, subcategory, memo columns. Payees look like real card
+         transactions, with store numbers and cities appended, and most of them match a rule in rules.csv. Some memos
+         hold the source id of a row in stripe.csv.
+rules.csv=Rules for filter.py, one regex per merchant.
+modify.csv=Rules for regex_modify_rows.py.
+match.csv=Rules for regex_match_to_column.py.
+dates.csv=Rules for time_format.py.
+headers.csv=Rules for edit_headers.py.
+ledger.csv=Categorized transactions for gnucash_import_prep.py.
+orders.csv, split_filter.csv, split.csv=Bank rows that refer to orders, the rules for split_rows.py and the line items
+                                        of every order.
+stripe.csv=Stripe balance transactions, as written by stripe_transactions_list.py.
+
+usage: generate.py size work_dir
+
+The script takes the following optional arguments:
+rules=Number of regexes in rules.csv. Defaults to 200.
+"""
+import csv
+import argparse
+import os
+import random
+import re
+
+author = 'brian.k.smith@gmail.com'
+
+MERCHANTS = ['WALMART', 'AMAZON MKTPLACE PMTS', 'SHELL OIL', 'STARBUCKS', 'COSTCO WHSE', 'TARGET', 'NETFLIX.COM',
+             'UBER TRIP', 'CHEVRON', 'KROGER', 'HOME DEPOT', 'SAFEWAY', 'SPOTIFY', 'COMCAST', 'CVS PHARMACY',
+             'WHOLE FOODS', 'TRADER JOES', 'APPLE.COM/BILL', 'PAYPAL', 'LYFT RIDE']
+NAME_WORDS = ['ACME', 'BLUE', 'CEDAR', 'DELTA', 'EAGLE', 'FIRST', 'GOLDEN', 'HARBOR', 'IRON', 'JADE', 'KEY', 'LAKE',
+              'MAPLE', 'NORTH', 'OAK', 'PINE', 'QUICK', 'RIVER', 'SUMMIT', 'TOWN']
+NAME_KINDS = ['MARKET', 'CAFE', 'GRILL', 'HARDWARE', 'AUTO', 'DENTAL', 'BOOKS', 'FITNESS', 'PHARMACY', 'DELI']
+CITIES = ['SEATTLE WA', 'PORTLAND OR', 'DENVER CO', 'AUSTIN TX', 'CHICAGO IL', 'BOSTON MA', 'ATLANTA GA', 'NEW YORK NY']
+CATEGORIES = [['Food', 'Groceries'], ['Food', 'Dining'], ['Auto', 'Fuel'], ['Auto', 'Rideshare'], ['Home', 'Supplies'],
+              ['Bills', 'Subscriptions'], ['Health', 'Pharmacy'], ['Shopping', 'General']]
+
+parser = argparse.ArgumentParser(description='Write synthetic benchmark inputs.')
+parser.add_argument('size', help='Number of rows in the generated input files.', type=int)
+parser.add_argument('work_dir', help='Directory to write the generated files into.')
+parser.add_argument('--rules', help='Number of regexes in rules.csv. Defaults to 200.', default=200, type=int)
+
+
+def merchant_names(count):
+    """Return count distinct merchant names, starting with well known ones."""
+    names = MERCHANTS[:count]
+    for i in range(count - len(names)):
+        word = NAME_WORDS[i % len(NAME_WORDS)]
+        kind = NAME_KINDS[(i // len(NAME_WORDS)) % len(NAME_KINDS)]
+        names.append('{} {} {:d}'.format(word, kind, i // (len(NAME_WORDS) * len(NAME_KINDS))))
+    return names
+
+
+def stripe_source(index):
+    """Return the Stripe source id used for stripe.csv row index."""
+    return 'ch_{:016x}'.format(index * 2654435761 % (1 << 64))
+
+
+def date_string(rng):
+    return '2018-{:02d}-{:02d}'.format(rng.randint(1, 12), rng.randint(1, 28))
+
+
+def write_rules(path, count):
+    """Write a filter.py rule file with one regex per merchant, in a mix of the styles people write by hand."""
+    with open(path, mode='w', newline='') as rule_file:
+        writer = csv.writer(rule_file)
+        writer.writerow(['regex', 'payee', 'category', 'subcategory'])
+        for i, name in enumerate(merchant_names(count)):
+            words = name.split(' ')
+            style = i % 4
+            if style == 0:
+                regex = '^' + re.escape(name)
+            elif style == 1:
+                regex = re.escape(words[0]) + '.*' + re.escape(words[-1])
+            elif style == 2:
+                regex = '(?i)' + re.escape(name.lower())
+            else:
+                regex = r'\b' + r'\s+'.join(re.escape(word) for word in words)
+            category = CATEGORIES[i % len(CATEGORIES)]
+            writer.writerow([regex, name.title(), category[0], category[1]])
+
+
+def write_bank(path, size, rule_count):
+    """Write a bank export of size rows where about four in five payees match a rule."""
+    rng = random.Random(size)
+    names = merchant_names(rule_count + rule_count // 4)
+    with open(path, mode='w', newline='') as bank_file:
+        writer = csv.writer(bank_file)
+        writer.writerow(['date', 'payee', 'amount', 'category', 'subcategory', 'memo'])
+        for i in range(size):
+            payee = '{} #{:05d} {}'.format(rng.choice(names), rng.randint(1, 99999), rng.choice(CITIES))
+            amount = '{:.2f}'.format(rng.randint(-50000, 5000) / 100)
+            memo = stripe_source(rng.randrange(size)) if rng.random() < 0.3 else ''
+            writer.writerow([date_string(rng), payee, amount, '', '', memo])
+
+
+def write_ledger(path, size):
+    """Write size categorized transactions in the layout gnucash_import_prep.py reads."""
+    rng = random.Random(size + 1)
+    names = merchant_names(len(MERCHANTS))
+    with open(path, mode='w', newline='') as ledger_file:
+        writer = csv.writer(ledger_file)
+        writer.writerow(['description', 'date', 'account', 'debit', 'credit'])
+        for i in range(size):
+            category = CATEGORIES[i % len(CATEGORIES)]
+            amount = '{:.2f}'.format(rng.randint(100, 50000) / 100)
+            debit, credit = (amount, '') if rng.random() < 0.9 else ('', amount)
+            writer.writerow([rng.choice(names).title(), date_string(rng),
+                             'Expenses:{}:{}'.format(category[0], category[1]), debit, credit])
+
+
+def write_orders(input_path, filter_path, split_path, size):
+    """Write size bank rows, half of which refer to an order, and a split file with two line items per order."""
+    rng = random.Random(size + 2)
+    with open(filter_path, mode='w', newline='') as filter_file:
+        writer = csv.writer(filter_file)
+        writer.writerow(['a_match_col', 'a_match_regex', 'a_comp_col', 'b_comp_col', 'a_dest_col', 'b_source_col',
+                         'a_currency_col'])
+        writer.writerow([1, '^ORDER', 2, 0, '1;3;4', '1;2;3', 3])
+    with open(input_path, mode='w', newline='') as input_file, open(split_path, mode='w', newline='') as split_file:
+        in_writer = csv.writer(input_file)
+        split_writer = csv.writer(split_file)
+        in_writer.writerow(['date', 'description', 'order', 'amount', 'category'])
+        split_writer.writerow(['order', 'item', 'amount', 'category'])
+        for i in range(size):
+            date = date_string(rng)
+            if i % 2:
+                in_writer.writerow([date, 'GROCERY STORE #{:d}'.format(rng.randint(1, 999)), '',
+                                    '{:.2f}'.format(rng.randint(100, 20000) / 100), 'Groceries'])
+                continue
+            order = 'O{:09d}'.format(i)
+            first = rng.randint(100, 10000)
+            second = rng.randint(100, 10000)
+            in_writer.writerow([date, 'ORDER {}'.format(order), order, '{:.2f}'.format((first + second) / 100), ''])
+            split_writer.writerow([order, 'Widget {:d}'.format(first), '${:.2f}'.format(first / 100), 'Supplies'])
+            split_writer.writerow([order, 'Gadget {:d}'.format(second), '${:.2f}'.format(second / 100), 'Hobbies'])
+
+
+def write_stripe(path, size):
+    """Write size Stripe balance transactions in the layout stripe_transactions_list.py writes."""
+    rng = random.Random(size + 3)
+    created = 1514764800
+    with open(path, mode='w', newline='') as stripe_file:
+        writer = csv.writer(stripe_file)
+        writer.writerow(["id", "amount", "available_on", "created", "currency", "description", "fee", "net", "source",
+                         "status", "type"])
+        for i in range(size):
+            created += rng.randint(1, 120)
+            kind = 'charge' if rng.random() < 0.95 else 'refund'
+            amount = rng.randint(500, 50000) * (1 if kind == 'charge' else -1)
+            fee = (30 + abs(amount) * 29 // 1000) if kind == 'charge' else 0
+            writer.writerow(['txn_{:016x}'.format(i), "${:6.2f}".format(amount / 100), created + 172800, created,
+                             'usd', 'Order {:d}'.format(i), "${:6.2f}".format(fee / 100),
+                             "${:6.2f}".format((amount - fee) / 100), stripe_source(i),
+                             'available' if rng.random() < 0.9 else 'pending', kind])
+
+
+def write_small_rules(work_dir):
+    """Write the rule files of the tools whose rules do not depend on the input size."""
+    def write(name, rows):
+        with open(os.path.join(work_dir, name), mode='w', newline='') as rule_file:
+            csv.writer(rule_file).writerows(rows)
+
+    write('modify.csv', [['input column name', 'regex', 'operation', 'operation column name', 'operation data'],
+                         ['payee', '^NETFLIX', 'drop', 'payee', ''],
+                         ['amount', '^-', 'modify', 'subcategory', 'debit'],
+                         ['memo', '^ch_', 'append', 'stripe', 'yes'],
+                         ['payee', 'SEATTLE WA$', 'modify', 'category', 'Local']])
+    write('match.csv', [['column', 'regex', 'headers'], [1, r'(.+?) #(\d+)', 'merchant store']])
+    write('dates.csv', [['input column', 'input format', 'output format', 'output header'],
+                        [0, 'YYYY-MM-DD', 'MM/DD/YYYY', 'us_date']])
+    write('headers.csv', [['input column', 'output column header'], [0, 'Date'], [1, 'Description']])
+
+
+def generate(work_dir, size, rule_count=200):
+    """Write every benchmark input for size rows into work_dir and return a dict of file name to path."""
+    paths = {}
+    for name in ['bank.csv', 'rules.csv', 'modify.csv', 'match.csv', 'dates.csv', 'headers.csv', 'ledger.csv',
+                 'orders.csv', 'split_filter.csv', 'split.csv', 'stripe.csv']:
+        paths[name] = os.path.join(work_dir, name)
+    write_rules(paths['rules.csv'], rule_count)
+    write_bank(paths['bank.csv'], size, rule_count)
+    write_small_rules(work_dir)
+    write_ledger(paths['ledger.csv'], size)
+    write_orders(paths['orders.csv'], paths['split_filter.csv'], paths['split.csv'], size)
+    write_stripe(paths['stripe.csv'], size)
+    return paths
+
+
+def main():
+    args = parser.parse_args()
+    os.makedirs(args.work_dir, exist_ok=True)
+    generate(args.work_dir, args.size, args.rules)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+"""Serve a stand-in for the parts of the Stripe API the stripe scripts use, for testing and benchmarking.
+
+The stub holds a synthetic ledger of balance transactions, one a minute from the start of 2018. All but the newest 5%
+have been paid out, spread round-robin over a number of payouts. GET /v1/balance/history lists them newest first like
+Stripe does, with the limit, starting_after, payout and created[gt|gte|lt|lte] parameters. Payouts named po_missing...
+are reported as not found. Point a script at the stub by passing --api_base http://127.0.0.1:<port>; any api key is
+accepted.
+
+The script takes the following optional arguments:
+port=Port to listen on. Defaults to 12111.
+transactions=Number of balance transactions in the ledger. Defaults to 10000.
+payouts=Number of payouts the transactions are spread over, named po_000000 upwards. Defaults to 100.
+latency=Seconds to wait before answering each request, to imitate the network. Defaults to 0.
+rate_limit=Answer with 429 once more than this many requests arrive in one second. Defaults to no limit.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+author = 'brian.k.smith@gmail.com'
+
+START = 1514764800
+
+parser = argparse.ArgumentParser(description='Serve a stand-in for the Stripe API.')
+parser.add_argument('--port', help='Port to listen on. Defaults to 12111.', default=12111, type=int)
+parser.add_argument('--transactions', help='Number of balance transactions in the ledger.', default=10000, type=int)
+parser.add_argument('--payouts', help='Number of payouts the transactions are spread over.', default=100, type=int)
+parser.add_argument('--latency', help='Seconds to wait before answering each request.', default=0.0, type=float)
+parser.add_argument('--rate_limit', help='Requests per second allowed before answering with 429.', type=int)
+
+
+def settled_count(transactions):
+    """Return the number of transactions that have been paid out; the newest ones are still pending."""
+    return transactions - transactions // 20
+
+
+def balance_transaction(index, transactions, payouts):
+    """Return the balance transaction at ledger position index."""
+    settled = index < settled_count(transactions)
+    amount = 500 + index * 7919 % 49500
+    fee = 30 + amount * 29 // 1000
+    created = START + index * 60
+    return {
+        'id': 'txn_{:08d}'.format(index),
+        'object': 'balance_transaction',
+        'amount': amount,
+        'available_on': created + 172800,
+        'created': created,
+        'currency': 'usd',
+        'description': 'Order {:d}'.format(index),
+        'fee': fee,
+        'net': amount - fee,
+        'payout': 'po_{:06d}'.format(index % payouts) if settled else None,
+        'source': 'ch_{:08d}'.format(index),
+        'status': 'available' if settled else 'pending',
+        'type': 'charge',
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep connections alive between requests, like Stripe
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('UTF-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Request-Id', 'req_stub')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status, error_type, message):
+        self.send_json(status, {'error': {'type': error_type, 'message': message}})
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        if server.rate_limit is not None and not server.allow_request():
+            self.send_error_json(429, 'rate_limit_error', 'Too many requests hit the API too quickly.')
+            return
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path != '/v1/balance/history':
+            self.send_error_json(404, 'invalid_request_error', 'Unrecognized request URL (GET: {}).'.format(url.path))
+            return
+        payout = params.get('payout')
+        first = 0
+        step = 1
+        if payout is not None:
+            if not payout.startswith('po_') or payout.startswith('po_missing'):
+                self.send_error_json(404, 'invalid_request_error', 'No such payout: {}'.format(payout))
+                return
+            first = int(payout[3:])
+            step = server.payouts
+        # Transaction ids hold their ledger position, so starting_after just lowers the end of the range
+        stop = server.transactions if payout is None else settled_count(server.transactions)
+        if 'starting_after' in params:
+            stop = min(stop, int(params['starting_after'][4:]))
+        newer = [('created[lt]', lambda created, bound: created < bound),
+                 ('created[lte]', lambda created, bound: created <= bound)]
+        older = [('created[gt]', lambda created, bound: created > bound),
+                 ('created[gte]', lambda created, bound: created >= bound)]
+        newer = [[test, int(params[key])] for key, test in newer if key in params]
+        older = [[test, int(params[key])] for key, test in older if key in params]
+        limit = min(int(params.get('limit', 10)), 100)
+        data = []
+        has_more = False
+        # Newest first, like Stripe
+        for index in reversed(range(first, stop, step)):
+            transaction = balance_transaction(index, server.transactions, server.payouts)
+            if not all(test(transaction['created'], bound) for test, bound in newer):
+                continue
+            if not all(test(transaction['created'], bound) for test, bound in older):
+                break
+            if len(data) == limit:
+                has_more = True
+                break
+            data.append(transaction)
+        self.send_json(200, {'object': 'list', 'url': '/v1/balance/history', 'has_more': has_more, 'data': data})
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, transactions, payouts, latency=0.0, rate_limit=None):
+        HTTPServer.__init__(self, address, StubHandler)
+        self.transactions = transactions
+        self.payouts = payouts
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self._lock = threading.Lock()
+        self._window = [0, 0]
+
+    def allow_request(self):
+        """Return whether another request fits in the rate limit of the current second."""
+        with self._lock:
+            second = int(time.time())
+            if self._window[0] != second:
+                self._window = [second, 0]
+            self._window[1] += 1
+            return self._window[1] <= self.rate_limit
+
+
+def main():
+    args = parser.parse_args()
+    server = StubServer(('127.0.0.1', args.port), args.transactions, args.payouts, args.latency, args.rate_limit)
+    print('Stripe stub listening on http://127.0.0.1:{:d}'.format(args.port))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,15 +2,37 @@
 """This script combines columns from multiple csv files into a single output based on a user-supplied set of rules.
 
 The author encountered a recurring need to combine information from multiple sources to properly categorize financial
-transacations."""
+transacations.
+
+By default the secondary file is loaded into memory. For secondary files too large for that, --mode grace spills both
+files to temporary partitions on disk, and --mode merge walks two files that are already sorted by their key columns.
+
+--filter_regex runs on the engine chosen with --regex_engine and --regex_budget, like the rule regexes of the other
+scripts; see regex_engine.py.
+"""
 
 import csv
 import argparse
-import re
 import sys
 
+import csv_io
+import regex_engine
+from join_engine import join_rows, JOIN_TYPES, DUPLICATE_POLICIES, MODES
+
 author = 'brian.k.smith@gmail.com'
 
+
+def partitions_arg(value):
+    """Return a --partitions value, which must be a whole number of at least 1."""
+    try:
+        partitions = int(value)
+    except ValueError:
+        partitions = 0
+    if partitions < 1:
+        raise argparse.ArgumentTypeError('expected a whole number of at least 1, got {}'.format(value))
+    return partitions
+
+
 parser = argparse.ArgumentParser(description='Merge columns of two csv files based on settings file.')
 parser.add_argument('primary', help='Path to csv input file to which columns will be added.')
 parser.add_argument('secondary', help='Path to csv input file from which columns will be duplicated.')
@@ -25,6 +47,17 @@ parser.add_argument('--output', help='Path to csv output file. This file will be
                                      ' to stdout.')
 parser.add_argument('--filter_column', help='Column in primary to look for a regex match before attempting collation.')
 parser.add_argument('--filter_regex', help='Regex used before attempting collation.')
+parser.add_argument('--mode', help='Join strategy: hash (secondary file in memory), grace (partitioned on disk), or'
+                                   ' merge (both files sorted by key). Defaults to hash.', choices=MODES,
+                    default='hash')
+parser.add_argument('--join', help='left keeps primary rows without a match, inner drops them. Defaults to left.',
+                    choices=JOIN_TYPES, default='left')
+parser.add_argument('--duplicates', help='Which secondary rows to use when a key appears more than once: first, last,'
+                                         ' or all (one output row per match). Defaults to last.',
+                    choices=DUPLICATE_POLICIES, default='last')
+parser.add_argument('--partitions', help='Number of partitions used by --mode grace. Defaults to 64.', default=64,
+                    type=partitions_arg)
+regex_engine.add_arguments(parser)
 
 args = parser.parse_args()
 
@@ -36,9 +69,9 @@ if args.output is None:
 
 # Open required files
 # noinspection PyTypeChecker
-with open(args.primary, newline='', encoding='UTF-8') as primary_file,\
-        open(args.output, mode='w', newline='', closefd=close_output) as output_file,\
-        open(args.secondary, mode='r', newline='') as secondary_file:
+with csv_io.open_input(args.primary) as primary_file,\
+        csv_io.open_output(args.output, close_output) as output_file,\
+        csv_io.open_input(args.secondary, encoding=None) as secondary_file:
     primary_reader = csv.reader(primary_file)
     secondary_reader = csv.reader(secondary_file)
     # Deal with headers
@@ -47,32 +80,26 @@ with open(args.primary, newline='', encoding='UTF-8') as primary_file,\
     output_headers = primary_headers
     for i in args.merge_columns:
         output_headers.append(secondary_headers[i])
-    # Turn secondary file into dict indexed by the column to check for matches
-    secondary_dict = {}
-    for row in secondary_reader:
-        key = row[args.secondary_column]
-        # if key in secondary_dict:
-            # print("Row: {} will overwrite existing row {} from secondary file."
-            #       .format(str(row), secondary_dict[key]))
-        secondary_dict[key] = [row[i] for i in args.merge_columns]
-    # Iterate through primary file and see if there are any matches
+    # Skip primary rows that do not match the filter before attempting collation
+    if args.filter_column and args.filter_regex:
+        filter_column = int(args.filter_column)
+        filter_regex = regex_engine.compile(args.filter_regex, 0, args)
+
+        def filtered_rows(rows):
+            for row in rows:
+                if not filter_regex.search(row[filter_column]):
+                    print("Skipping {} because {} does not match {}."
+                          .format(",".join(row), row[filter_column], args.filter_regex), file=sys.stderr)
+                    continue
+                yield row
+            regex_engine.report_budget([filter_regex])
+        primary_reader = filtered_rows(primary_reader)
+    # Iterate through primary file and add the columns of any matching secondary rows
     out_writer = csv.writer(output_file)
     out_writer.writerow(output_headers)
-    for row in primary_reader:
-        if args.filter_column and args.filter_regex:
-            match = re.search(args.filter_regex, row[int(args.filter_column)])
-            if not match:
-                print("Skipping {} because {} does not match {}."
-                      .format(",".join(row), row[int(args.filter_column)], args.filter_regex), file=sys.stderr)
-                continue
-        try:
-            to_match = row[args.primary_column]
-            # print("Trying to find match for {}.".format(str(to_match)))
-            match = secondary_dict[to_match]
-            for col in match:
-                row.append(col)
-        except KeyError:
-            # print("No match for {}.".format(row[int(args.primary_column)]))
-            for i in args.merge_columns:
-                row.append("")
-        out_writer.writerow(row)
+    try:
+        out_writer.writerows(join_rows(primary_reader, secondary_reader, args.primary_column, args.secondary_column,
+                                       args.merge_columns, args.mode, args.join, args.duplicates, args.partitions))
+    except ValueError as error:
+        print("ERROR: {}".format(error), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,59 @@
+"""Apply per-cell functions to whole columns of a batch of rows at once.
+
+Row at a time processing calls a regex or a date parser for every cell, even though bank exports repeat the same
+dates and descriptions over and over. Here rows are read in batches, each column of interest is pulled out of the
+batch, and the function is called once per distinct value in the column. The results are then spread back over the
+rows of the batch, so the output is identical to processing each row in turn.
+"""
+author = 'brian.k.smith@gmail.com'
+
+
+class ColumnFunction:
+    """Apply func to lists of column values, calling it once per distinct value.
+
+    func takes a cell value and returns the list of cells to add to the row. Results are remembered across batches
+    until more than max_entries distinct values have been seen, then the remembered results are dropped.
+    """
+
+    def __init__(self, func, max_entries=65536):
+        self.func = func
+        self.max_entries = max_entries
+        self.results = {}
+
+    def __call__(self, values):
+        """Return the list of results of func for each value in values."""
+        results = self.results
+        unique = dict.fromkeys(values)
+        missing = [value for value in unique if value not in results]
+        if len(results) + len(missing) > self.max_entries:
+            results.clear()
+            missing = list(unique)
+        func = self.func
+        for value in missing:
+            results[value] = func(value)
+        return list(map(results.__getitem__, values))
+
+
+def batches(rows, batch_size):
+    """Yield lists of up to batch_size rows taken from rows in order."""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def columnar_rows(rows, columns, batch_size=10000):
+    """Yield each row of rows extended with the cells computed for it by each column function.
+
+    columns is a list of [column number, ColumnFunction], applied in order.
+    """
+    for batch in batches(rows, batch_size):
+        results = [function([row[column] for row in batch]) for column, function in columns]
+        for i, row in enumerate(batch):
+            for column_results in results:
+                row.extend(column_results[i])
+            yield row
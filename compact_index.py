@@ -0,0 +1,183 @@
+"""Keep the rows of an in-memory join index in a few flat arrays instead of a Python object per value.
+
+A dict of lists of strings costs several hundred bytes per secondary row: a dict entry, a key string, a list per row
+and a string object per column. A CompactIndex encodes every column value as UTF-8 into one growing byte arena and
+records where each value ends in an array of offsets. Keys are interned: each distinct key is encoded once into a
+second arena with its own offsets, however many records share it, and is looked up in an open addressing hash table
+that is itself an array of key numbers. The arrays hold 4 byte integers, so a record costs its encoded bytes plus 4
+bytes per value, and a distinct key its encoded bytes plus about 20 bytes of offset, hash, latest record and hash
+table. Offsets switch to 8 byte integers once an arena outgrows 4 GiB.
+
+Looking up a key returns RecordViews, which decode a record's values from the arena only when they are read.
+"""
+from array import array
+
+author = 'brian.k.smith@gmail.com'
+
+
+class RecordView:
+    """Read-only sequence of the values of one record in a CompactIndex."""
+
+    __slots__ = ('index', 'record')
+
+    def __init__(self, index, record):
+        self.index = index
+        self.record = record
+
+    def __len__(self):
+        return self.index.width
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return list(self)[position]
+        index = self.index
+        if position < 0:
+            position += index.width
+        if not 0 <= position < index.width:
+            raise IndexError('record index out of range')
+        return index.field(self.record, position)
+
+    def __iter__(self):
+        index = self.index
+        arena = index._arena
+        offsets = index._offsets
+        start = self.record * index.width
+        for field in range(start, start + index.width):
+            yield arena[offsets[field]:offsets[field + 1]].decode('UTF-8')
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return 'RecordView({!r})'.format(list(self))
+
+
+class CompactIndex:
+    """Map keys to records of width string values, stored in flat arrays.
+
+    duplicates decides what happens when a key is added again: 'first' keeps the record added first, 'last' replaces
+    it (the replaced values stay in the arena), and 'all' keeps every record in the order they were added.
+    """
+
+    def __init__(self, width, duplicates='last'):
+        self.width = width
+        self.duplicates = duplicates
+        self._records = 0
+        self._arena = bytearray()
+        # The values of each record follow each other, offsets holds the end of every value
+        self._offsets = array('I', [0])
+        self._key_arena = bytearray()
+        # The end of each distinct key in the key arena
+        self._key_offsets = array('I', [0])
+        # The low 32 bits of the hash of each distinct key
+        self._hashes = array('I')
+        # The latest record of each distinct key. With duplicates 'first' a key only ever has one record, whose number
+        # is the key's number, so this stays empty.
+        self._latest = array('I')
+        # For duplicates 'all', the previous record with the same key, or -1
+        self._previous = array('i')
+        # Key number + 1 of the key in each slot, 0 for an empty slot
+        self._table = array('I', [0]) * 8
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __contains__(self, key):
+        key_bytes = key.encode('UTF-8')
+        return self._find(key_bytes, hash(key_bytes) & 0xFFFFFFFF)[1] >= 0
+
+    def field(self, record, position):
+        """Return value position of record."""
+        start = record * self.width + position
+        return self._arena[self._offsets[start]:self._offsets[start + 1]].decode('UTF-8')
+
+    def _find(self, key_bytes, key_hash):
+        """Return [table slot, key number] for a key, the number being -1 and the slot empty when it is missing."""
+        table = self._table
+        mask = len(table) - 1
+        hashes = self._hashes
+        key_offsets = self._key_offsets
+        slot = key_hash & mask
+        while True:
+            entry = table[slot]
+            if entry == 0:
+                return [slot, -1]
+            number = entry - 1
+            if hashes[number] == key_hash and \
+                    self._key_arena[key_offsets[number]:key_offsets[number + 1]] == key_bytes:
+                return [slot, number]
+            slot = (slot + 1) & mask
+
+    def _grow(self):
+        """Double the hash table, placing every key again."""
+        old_table = self._table
+        table = array('I', [0]) * (len(old_table) * 2)
+        mask = len(table) - 1
+        hashes = self._hashes
+        for entry in old_table:
+            if entry:
+                slot = hashes[entry - 1] & mask
+                while table[slot]:
+                    slot = (slot + 1) & mask
+                table[slot] = entry
+        self._table = table
+
+    def add(self, key, values):
+        """Add a record of values (a sequence of width strings) under key."""
+        key_bytes = key.encode('UTF-8')
+        key_hash = hash(key_bytes) & 0xFFFFFFFF
+        slot, number = self._find(key_bytes, key_hash)
+        if number >= 0 and self.duplicates == 'first':
+            return
+        arena = self._arena
+        offsets = self._offsets
+        # A character takes at most 4 bytes in UTF-8
+        if offsets.typecode == 'I' and len(arena) + 4 * sum(map(len, values)) > 0xFFFFFFFF:
+            offsets = self._offsets = array('Q', offsets)
+        for value in values:
+            arena += value.encode('UTF-8')
+            offsets.append(len(arena))
+        record = self._records
+        self._records += 1
+        if number >= 0:
+            if self.duplicates == 'all':
+                self._previous.append(self._latest[number])
+            self._latest[number] = record
+            return
+        key_arena = self._key_arena
+        if self._key_offsets.typecode == 'I' and len(key_arena) + len(key_bytes) > 0xFFFFFFFF:
+            self._key_offsets = array('Q', self._key_offsets)
+        key_arena += key_bytes
+        self._key_offsets.append(len(key_arena))
+        self._hashes.append(key_hash)
+        if self.duplicates != 'first':
+            self._latest.append(record)
+        if self.duplicates == 'all':
+            self._previous.append(-1)
+        self._table[slot] = len(self._hashes)
+        if len(self._hashes) * 2 > len(self._table):
+            self._grow()
+
+    def get(self, key, default=None):
+        """Return the list of RecordViews kept for key, oldest first, or default when there are none."""
+        key_bytes = key.encode('UTF-8')
+        number = self._find(key_bytes, hash(key_bytes) & 0xFFFFFFFF)[1]
+        if number < 0:
+            return default
+        if self.duplicates == 'first':
+            return [RecordView(self, number)]
+        record = self._latest[number]
+        if self.duplicates != 'all':
+            return [RecordView(self, record)]
+        records = []
+        previous = self._previous
+        while record >= 0:
+            records.append(RecordView(self, record))
+            record = previous[record]
+        records.reverse()
+        return records
+
+    def nbytes(self):
+        """Return the number of bytes held by the arenas and arrays."""
+        return len(self._arena) + len(self._key_arena) + sum(len(a) * a.itemsize for a in [
+            self._offsets, self._key_offsets, self._hashes, self._latest, self._previous, self._table])
@@ -7,9 +7,21 @@ file=Path to a csv file. This argument may be present more than once.
 The script takes the following optional arguments:
 header_row_count=Number of header rows in all input files after the first. Header rows will not be appended. Default 1
 output=Path to write the output csv file. This file will be overwritten without warning if it exists.
+raw=Copy the bytes of the input files instead of parsing and rewriting every row. Header rows are still skipped, taking
+    quoted line breaks into account. Only used when all files have the same encoding and csv dialect, otherwise every
+    row is parsed as usual. The output then keeps the line endings and quoting of the input files. A warning is
+    printed for files whose header row differs from the first file's.
 """
+import codecs
 import csv
 import argparse
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import csv_io
+from parallel import read_record
 
 author = 'brian.k.smith@gmail.com'
 
@@ -19,29 +31,142 @@ parser.add_argument('--header_row_count', help='Num rows to skip at start of fil
                     default=1, type=int)
 parser.add_argument('--output', help='Path to csv output file. This file will be overwritten if it exists. Defaults'
                                      ' to stdout.')
+parser.add_argument('--raw', help='Copy input bytes instead of parsing rows when all files share encoding and dialect.',
+                    action='store_true')
 
-args = parser.parse_args()
-
-# Take care of any default setup needed
-close_output = True
-if args.output is None:
-    close_output = False
-    args.output = 1
+# Bytes read from the start of each file to detect its encoding and dialect
+probe_size = 1 << 16
 
-# Open required files
-input_file_counter = 0
 
-# noinspection PyTypeChecker
-with open(args.output, mode='w', newline='', closefd=close_output) as output_file:
-    out_writer = csv.writer(output_file)
-    while input_file_counter < len(args.file):
-        with open(args.file[input_file_counter], mode='r', newline='') as input_file:
+def concatenate_rows(paths, header_row_count=1):
+    """Yield every row of the csv files at paths, skipping the first header_row_count rows of all but the first."""
+    input_file_counter = 0
+    while input_file_counter < len(paths):
+        with csv_io.open_input(paths[input_file_counter], encoding=None) as input_file:
             in_reader = csv.reader(input_file)
             if input_file_counter > 0:
                 headers_removed = 0
-                while headers_removed < args.header_row_count:
-                    next(in_reader)
+                while headers_removed < header_row_count:
+                    next(in_reader, None)
                     headers_removed += 1
             for row in in_reader:
-                out_writer.writerow(row)
+                yield row
         input_file_counter += 1
+
+
+def probe_file(path, header_row_count):
+    """Return a dict describing the encoding, dialect, header and data offset of the csv file at path.
+
+    data_offset is where the rows to copy start, after any byte order mark and header_row_count records.
+    """
+    with open(path, mode='rb') as input_file:
+        sample = input_file.read(probe_size)
+        bom = b''
+        if sample.startswith(codecs.BOM_UTF8):
+            bom = codecs.BOM_UTF8
+        elif sample.startswith(codecs.BOM_UTF16_LE) or sample.startswith(codecs.BOM_UTF16_BE):
+            return {'path': path, 'encoding': 'utf-16'}
+        try:
+            # The sample may end part way through a character
+            text = codecs.getincrementaldecoder('utf-8')().decode(sample[len(bom):], final=False)
+        except UnicodeDecodeError:
+            return {'path': path, 'encoding': 'unknown'}
+        try:
+            dialect = csv.Sniffer().sniff(text, delimiters=',;\t|')
+            delimiter, quotechar = dialect.delimiter, dialect.quotechar
+        except csv.Error:
+            delimiter, quotechar = ',', '"'
+        input_file.seek(len(bom))
+        header = read_record(input_file)
+        # The first raw line break may be inside a quoted header field, the one ending the header record is not
+        line_terminator = '\r\n' if header.endswith(b'\r\n') else '\n'
+        input_file.seek(len(bom))
+        for i in range(header_row_count):
+            read_record(input_file)
+        data_offset = input_file.tell()
+        input_file.seek(0, os.SEEK_END)
+        size = input_file.tell()
+        last_byte = b''
+        if size > data_offset:
+            input_file.seek(-1, os.SEEK_END)
+            last_byte = input_file.read(1)
+    return {
+        'path': path,
+        'encoding': 'utf-8',
+        'dialect': [delimiter, quotechar, line_terminator],
+        'header': next(csv.reader([header.decode('UTF-8', errors='replace')], delimiter=delimiter,
+                                  quotechar=quotechar), []),
+        'data_offset': data_offset,
+        'size': size,
+        'ends_with_newline': last_byte in (b'', b'\n', b'\r'),
+    }
+
+
+def raw_compatible(probes):
+    """Return whether the probed files can be joined by copying bytes."""
+    first = probes[0]
+    for probe in probes:
+        if probe['encoding'] != 'utf-8' or probe['dialect'] != first['dialect'] or probe['dialect'][1] != '"':
+            return False
+    return True
+
+
+def copy_bytes(input_file, output_file, offset, size):
+    """Copy the bytes of input_file from offset to size to output_file, in the kernel where possible."""
+    output_file.flush()
+    try:
+        while offset < size:
+            sent = os.sendfile(output_file.fileno(), input_file.fileno(), offset, min(size - offset, 1 << 30))
+            if sent == 0:
+                break
+            offset += sent
+    except (AttributeError, OSError):
+        # No sendfile for this platform or pair of files
+        input_file.seek(offset)
+        shutil.copyfileobj(input_file, output_file, 1 << 20)
+
+
+def concatenate_raw(probes, output_file):
+    """Write the files described by probes to the binary output_file, copying the bytes of each file's rows."""
+    line_terminator = probes[0]['dialect'][2].encode('ascii')
+    for i, probe in enumerate(probes):
+        with open(probe['path'], mode='rb') as input_file:
+            # The first file keeps its header rows
+            copy_bytes(input_file, output_file, 0 if i == 0 else probe['data_offset'], probe['size'])
+        # A last row without a line break would run into the next file's first row
+        if not probe['ends_with_newline']:
+            output_file.write(line_terminator)
+
+
+def main():
+    args = parser.parse_args()
+
+    # Take care of any default setup needed
+    close_output = True
+    if args.output is None:
+        close_output = False
+        args.output = 1
+
+    if args.raw:
+        # Probe every file at once, the work is mostly waiting on the disk
+        with ThreadPoolExecutor(min(len(args.file), 8)) as executor:
+            probes = list(executor.map(lambda path: probe_file(path, args.header_row_count), args.file))
+        for probe in probes[1:] if args.header_row_count > 0 else []:
+            if 'header' in probe and probe['header'] != probes[0].get('header'):
+                print("WARN: Header of {} does not match header of {}.".format(probe['path'], args.file[0]),
+                      file=sys.stderr)
+        if raw_compatible(probes):
+            # noinspection PyTypeChecker
+            with open(args.output, mode='wb', closefd=close_output) as output_file:
+                concatenate_raw(probes, output_file)
+            return
+        print("WARN: Input files differ in encoding or csv dialect, parsing every row.", file=sys.stderr)
+
+    # noinspection PyTypeChecker
+    with csv_io.open_output(args.output, close_output) as output_file:
+        out_writer = csv.writer(output_file)
+        out_writer.writerows(concatenate_rows(args.file, args.header_row_count))
+
+
+if __name__ == '__main__':
+    main()
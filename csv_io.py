@@ -0,0 +1,116 @@
+"""Open the csv files the scripts read and write with large buffers, so big files take fewer system calls.
+
+Python's default buffers are 8 KiB for the file and 8 KiB for the text layer on top of it. On files of hundreds of
+megabytes that means a read or write system call every few dozen rows and many small decode and encode calls. These
+functions use much larger buffers instead. All output is written in large batches, and only when a buffer fills or the
+file is closed.
+
+Environment variables tune the buffers without changing any script's arguments:
+PYACCOUNTING_BUFFER_SIZE=Bytes buffered per file. Defaults to 1 MiB.
+PYACCOUNTING_MMAP=Set to 1 to read regular input files through a memory map instead of read calls. Pipes and other
+                  special files are always read normally.
+"""
+import csv
+import io
+import mmap
+import os
+import stat
+
+author = 'brian.k.smith@gmail.com'
+
+buffer_size = int(os.environ.get('PYACCOUNTING_BUFFER_SIZE', 1 << 20))
+use_mmap = os.environ.get('PYACCOUNTING_MMAP', '') not in ('', '0')
+# Bytes the text layer decodes or encodes at a time. The attribute is not part of the documented API, but both the C
+# and the pure Python implementations use it.
+chunk_size = 1 << 18
+
+
+class MappedFile(io.RawIOBase):
+    """Read-only raw file backed by a memory map of a regular file."""
+
+    def __init__(self, file, closefd=True):
+        self.file = file
+        self.closefd = closefd
+        self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.map[self.position:self.position + len(buffer)]
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def read(self, size=-1):
+        end = len(self.map) if size is None or size < 0 else self.position + size
+        data = self.map[self.position:end]
+        self.position += len(data)
+        return data
+
+    read1 = read
+
+    def close(self):
+        if not self.closed:
+            self.map.close()
+            if self.closefd:
+                self.file.close()
+        super().close()
+
+
+def _mapped(path, closefd):
+    """Return a MappedFile of path when it is a regular, non-empty file, otherwise None."""
+    file = open(path, mode='rb', buffering=0, closefd=closefd)
+    info = os.fstat(file.fileno())
+    if not stat.S_ISREG(info.st_mode) or info.st_size == 0:
+        file.close()
+        return None
+    return MappedFile(file, closefd)
+
+
+def open_input(path, closefd=True, encoding='UTF-8', binary=False):
+    """Return the csv file at path (a path or a file descriptor) opened for reading with large buffers.
+
+    The file is opened as text with newline='' for the csv module, or as bytes when binary is set.
+    """
+    if binary:
+        return open(path, mode='rb', buffering=buffer_size, closefd=closefd)
+    raw = _mapped(path, closefd) if use_mmap else None
+    if raw is None:
+        input_file = open(path, newline='', encoding=encoding, buffering=buffer_size, closefd=closefd)
+    else:
+        input_file = io.TextIOWrapper(raw, encoding=encoding, newline='')
+    input_file._CHUNK_SIZE = chunk_size
+    return input_file
+
+
+def open_output(path, closefd=True):
+    """Return the csv file at path (a path or a file descriptor) opened for writing with large buffers."""
+    output_file = open(path, mode='w', newline='', buffering=buffer_size, closefd=closefd)
+    output_file._CHUNK_SIZE = chunk_size
+    return output_file
+
+
+def read_columns(path, columns):
+    """Yield a tuple of the values in columns, by header name, for each row after the header of the csv file at path.
+
+    This reads the same values as csv.DictReader without building a dict per row. Blank rows are skipped, missing
+    values are None, and when a header appears more than once its last column is used.
+    Raises KeyError when a column is not in the header of a file with rows.
+    """
+    with open(path, newline='') as csv_file:
+        reader = csv.reader(csv_file)
+        header = next(reader, [])
+        indexes = None
+        for row in reader:
+            if not row:
+                continue
+            if indexes is None:
+                indexes = [len(header) - 1 - header[::-1].index(column) if column in header else None
+                           for column in columns]
+                if None in indexes:
+                    raise KeyError(columns[indexes.index(None)])
+            if len(row) < len(header):
+                row = row + [None] * (len(header) - len(row))
+            yield tuple(row[i] for i in indexes)
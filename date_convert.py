@@ -0,0 +1,186 @@
+"""Convert date/time strings between arrow token formats without calling arrow for every value.
+
+arrow re-tokenizes its format strings on every call and builds several objects per conversion, which dominates the run
+time of scripts that convert a date on every row. Here each input and output format is compiled once into a parser or
+formatter that follows arrow 0.12.1 exactly for the tokens it understands, and finished conversions are kept in a
+bounded cache, since statements only contain a few hundred distinct dates. Formats using tokens that are not compiled
+here, and values the compiled parser cannot handle, are passed to arrow so the result or error is always arrow's own.
+"""
+import calendar
+import datetime
+import re
+from functools import lru_cache
+
+import arrow
+
+author = 'brian.k.smith@gmail.com'
+
+# Tokens and escapes as recognized by arrow's parser
+_PARSE_TOKEN_RE = re.compile(r'(YYY?Y?|MM?M?M?|Do|DD?D?D?|d?d?d?d|HH?|hh?|mm?|ss?|S+|ZZ?Z?|a|A|X)')
+_ESCAPE_RE = re.compile(r'\[[^\[\]]*\]')
+_PARSE_PATTERNS = {
+    'YYYY': r'\d{4}',
+    'YY': r'\d{2}',
+    'MM': r'\d{2}',
+    'M': r'\d{1,2}',
+    'DD': r'\d{2}',
+    'D': r'\d{1,2}',
+    'HH': r'\d{2}',
+    'H': r'\d{1,2}',
+    'hh': r'\d{2}',
+    'h': r'\d{1,2}',
+    'mm': r'\d{2}',
+    'm': r'\d{1,2}',
+    'ss': r'\d{2}',
+    's': r'\d{1,2}',
+}
+_PARSE_PARTS = {
+    'YYYY': 'year',
+    'YY': 'year',
+    'MM': 'month',
+    'M': 'month',
+    'DD': 'day',
+    'D': 'day',
+    'HH': 'hour',
+    'H': 'hour',
+    'hh': 'hour',
+    'h': 'hour',
+    'mm': 'minute',
+    'm': 'minute',
+    'ss': 'second',
+    's': 'second',
+}
+
+# Tokens as recognized by arrow's formatter, using its default en_us locale
+_FORMAT_TOKEN_RE = re.compile(r'(YYY?Y?|MM?M?M?|Do|DD?D?D?|d?dd?d?|HH?|hh?|mm?|ss?|SS?S?S?S?S?|ZZ?|a|A|X)')
+_MONTH_NAMES = ['', 'January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October',
+                'November', 'December']
+_MONTH_ABBREVIATIONS = ['', 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+_DAY_NAMES = ['', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+_DAY_ABBREVIATIONS = ['', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+
+def _twelve_hour(dt):
+    return dt.hour if 0 < dt.hour < 13 else abs(dt.hour - 12)
+
+
+def _ordinal(n):
+    if n % 100 not in (11, 12, 13):
+        remainder = abs(n) % 10
+        if remainder == 1:
+            return '{0}st'.format(n)
+        elif remainder == 2:
+            return '{0}nd'.format(n)
+        elif remainder == 3:
+            return '{0}rd'.format(n)
+    return '{0}th'.format(n)
+
+
+# Compiled values are always naive datetimes in UTC, as arrow.get would return for these tokens
+_FORMAT_FUNCTIONS = {
+    'YYYY': lambda dt: '{0:04d}'.format(dt.year),
+    'YY': lambda dt: '{0:04d}'.format(dt.year)[2:],
+    'MMMM': lambda dt: _MONTH_NAMES[dt.month],
+    'MMM': lambda dt: _MONTH_ABBREVIATIONS[dt.month],
+    'MM': lambda dt: '{0:02d}'.format(dt.month),
+    'M': lambda dt: str(dt.month),
+    'DDDD': lambda dt: '{0:03d}'.format(dt.timetuple().tm_yday),
+    'DDD': lambda dt: str(dt.timetuple().tm_yday),
+    'DD': lambda dt: '{0:02d}'.format(dt.day),
+    'D': lambda dt: str(dt.day),
+    'Do': lambda dt: _ordinal(dt.day),
+    'dddd': lambda dt: _DAY_NAMES[dt.isoweekday()],
+    'ddd': lambda dt: _DAY_ABBREVIATIONS[dt.isoweekday()],
+    'd': lambda dt: str(dt.isoweekday()),
+    'HH': lambda dt: '{0:02d}'.format(dt.hour),
+    'H': lambda dt: str(dt.hour),
+    'hh': lambda dt: '{0:02d}'.format(_twelve_hour(dt)),
+    'h': lambda dt: str(_twelve_hour(dt)),
+    'mm': lambda dt: '{0:02d}'.format(dt.minute),
+    'm': lambda dt: str(dt.minute),
+    'ss': lambda dt: '{0:02d}'.format(dt.second),
+    's': lambda dt: str(dt.second),
+    'X': lambda dt: str(calendar.timegm(dt.utctimetuple())),
+    'ZZ': lambda dt: '+00:00',
+    'Z': lambda dt: '+0000',
+    'a': lambda dt: 'am' if dt.hour < 12 else 'pm',
+    'A': lambda dt: 'AM' if dt.hour < 12 else 'PM',
+}
+
+
+@lru_cache(maxsize=256)
+def compile_parser(in_format):
+    """Return [tokens, compiled regex] for in_format, or None when it uses tokens that are left to arrow."""
+    tokens = []
+
+    def token_pattern(match):
+        token = match.group(0)
+        if token not in _PARSE_PATTERNS:
+            raise KeyError(token)
+        tokens.append(token)
+        return '(?P<{0}>{1})'.format(token, _PARSE_PATTERNS[token])
+
+    # Like arrow, text outside of tokens and inside [] escapes is used as a regex as it is
+    escaped_format = re.sub('S+', 'S', _ESCAPE_RE.sub('#', in_format))
+    escaped_data = _ESCAPE_RE.findall(in_format)
+    try:
+        pieces = _PARSE_TOKEN_RE.sub(token_pattern, escaped_format).split('#')
+        pattern = ''
+        for i in range(len(pieces)):
+            pattern += pieces[i]
+            if i < len(escaped_data):
+                pattern += escaped_data[i][1:-1]
+        return [tokens, re.compile(pattern, flags=re.IGNORECASE)]
+    except (KeyError, re.error):
+        return None
+
+
+@lru_cache(maxsize=256)
+def compile_formatter(out_format):
+    """Return a list of literal strings and token functions for out_format, or None when it is left to arrow."""
+    parts = []
+    position = 0
+    for match in _FORMAT_TOKEN_RE.finditer(out_format):
+        token = match.group(0)
+        if token not in _FORMAT_FUNCTIONS:
+            return None
+        parts.append(out_format[position:match.start()])
+        parts.append(_FORMAT_FUNCTIONS[token])
+        position = match.end()
+    parts.append(out_format[position:])
+    return parts
+
+
+def parse(value, in_format):
+    """Return the naive datetime for value in in_format using the compiled parser, or None if it cannot be used."""
+    parser = compile_parser(in_format)
+    if parser is None:
+        return None
+    match = parser[1].search(value)
+    if match is None:
+        return None
+    parts = {}
+    for token in parser[0]:
+        number = int(match.group(token))
+        if token == 'YY':
+            number = 1900 + number if number > 68 else 2000 + number
+        parts[_PARSE_PARTS[token]] = number
+    try:
+        return datetime.datetime(year=parts.get('year', 1), month=parts.get('month', 1), day=parts.get('day', 1),
+                                 hour=parts.get('hour', 0), minute=parts.get('minute', 0),
+                                 second=parts.get('second', 0))
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=65536)
+def convert(value, in_format, out_format):
+    """Return the date/time string value, written in arrow's in_format tokens, written in arrow's out_format tokens.
+
+    Raises whatever arrow raises when value does not match in_format.
+    """
+    formatter = compile_formatter(out_format)
+    dt = parse(value, in_format) if formatter is not None else None
+    if dt is None:
+        return arrow.get(value, in_format).format(out_format)
+    return ''.join(part if isinstance(part, str) else part(dt) for part in formatter)
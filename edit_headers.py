@@ -7,10 +7,15 @@ filter=Path to a csv file containing the columns input column (zero-based index)
 The script takes the following optional arguments:
 input=Path to a csv file containing the designated input columns.
 output=Path to write the output csv file. This file will be overwritten without warning if it exists.
+profile=Print rows and time per phase to stderr once the output is written.
+stats_json=Path to write rows and time per phase to as JSON.
 """
 import csv
 import argparse
 
+import csv_io
+import stats
+
 author = 'brian.k.smith@gmail.com'
 
 parser = argparse.ArgumentParser(description='Set headers in a csv to the specified values.')
@@ -19,36 +24,59 @@ parser.add_argument('--input', help='Path to csv input file with header(s) to mo
                                     ' Defaults to stdin.')
 parser.add_argument('--output', help='Path to csv output file. This file will be overwritten if it exists. Defaults'
                                      ' to stdout.')
+stats.add_arguments(parser)
+
 
-args = parser.parse_args()
-
-# Take care of any default setup needed
-close_input = True
-if args.input is None:
-    close_input = False
-    args.input = 0
-close_output = True
-if args.output is None:
-    close_output = False
-    args.output = 1
-
-# Open required files
-# noinspection PyTypeChecker
-with open(args.input, newline='', encoding='UTF-8', closefd=close_input) as input_file, open(args.filter, newline='')\
-        as filter_file, open(args.output, mode='w', newline='', closefd=close_output) as output_file:
-    in_reader = csv.reader(input_file)
-    filter_reader = csv.reader(filter_file)
-    out_writer = csv.writer(output_file)
-    # Set up filters array
+def load_filters(filter_path):
+    """Return the filters in the filter file as a list of [column number, new header]."""
     filters = []
-    filter_headers = next(filter_reader)
-    for filter_row in filter_reader:
-        filters.append([int(filter_row[0]), filter_row[1]])
+    with open(filter_path, newline='') as filter_file:
+        filter_reader = csv.reader(filter_file)
+        filter_headers = next(filter_reader)
+        for filter_row in filter_reader:
+            filters.append([int(filter_row[0]), filter_row[1]])
+    return filters
+
+
+def stage(rows, args):
+    """Yield the header row with the headers named in the filter file replaced, then every other row unchanged.
+
+    rows is an iterator of csv rows whose first row contains the column headers.
+    """
+    rows = iter(rows)
+    filters = load_filters(args.filter)
     # Set up output file with input headers
-    output_headers = next(in_reader)
+    output_headers = next(rows, None)
+    if output_headers is None:
+        return
     for filt in filters:
         output_headers[filt[0]] = filt[1]
-    out_writer.writerow(output_headers)
+    yield output_headers
     # Iterate through input
-    for row in in_reader:
-        out_writer.writerow(row)
+    for row in rows:
+        yield row
+
+
+def main():
+    args = parser.parse_args()
+    stats.setup(parser, args, 'edit_headers')
+
+    # Take care of any default setup needed
+    close_input = True
+    if args.input is None:
+        close_input = False
+        args.input = 0
+    close_output = True
+    if args.output is None:
+        close_output = False
+        args.output = 1
+
+    # Open required files
+    # noinspection PyTypeChecker
+    with csv_io.open_input(args.input, close_input) as input_file,\
+            csv_io.open_output(args.output, close_output) as output_file:
+        stats.run_stage(stage, args, input_file, output_file)
+
+
+if __name__ == '__main__':
+    main()
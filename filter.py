@@ -16,10 +16,34 @@ The script takes the following optional arguments:
 input=Path to a csv file containing at minimum the columns payee, category, subcategory. The first row should contain
 column headers.
 output=Path to write the output csv file. This file will be overwritten without warning if it exists.
+cache_size=Number of distinct payees whose matching rules are remembered in memory. 0 disables the cache.
+cache_file=Path to a sqlite file where matching results are kept between runs. Results are discarded automatically when
+           the filter file changes.
+workers=Number of worker processes to split the input between. Defaults to 1.
+unmatched_report=Path to write a csv summary of the payees no filter matched to, instead of printing every unmatched
+                 row. Payees are grouped once digits, # and * are removed, and the top_k most frequent are written with
+                 their row count, total amount and first and last dates. Memory use does not grow with the input; see
+                 unmatched_report.py for how far the counts can be off.
+top_k=Number of payees written to the unmatched_report. Defaults to 100.
+regex_engine=Engine running the filter regexes: re, auto or re2, see regex_engine.py. Defaults to re.
+regex_budget=Seconds of searching allowed per filter regex before a warning names it. Defaults to no budget.
+profile=Print rows, time per phase and the slowest rules to stderr once the output is written.
+stats_json=Path to write rows, time per phase and the hits and search time of every rule to as JSON.
 """
 import csv
 import argparse
+import functools
+import itertools
 import re
+import sys
+
+import csv_io
+import regex_engine
+import stats
+from match_cache import MatchCache
+from parallel import run_chunked
+from rule_matcher import RuleMatcher
+from unmatched_report import HEADERS as REPORT_HEADERS, UnmatchedReport
 
 author = 'brian.k.smith@gmail.com'
 
@@ -30,47 +54,125 @@ parser.add_argument('--input', help='Path to csv input file with minimum columns
                                     ' Defaults to stdin.')
 parser.add_argument('--output', help='Path to csv output file. This file will be overwritten if it exists. Defaults'
                                      ' to stdout.')
+parser.add_argument('--cache_size', help='Number of distinct payees to remember matching rules for. 0 disables the'
+                                         ' cache. Defaults to 65536.', default=65536, type=int)
+parser.add_argument('--cache_file', help='Path to sqlite file used to remember matching rules between runs.')
+parser.add_argument('--workers', help='Number of worker processes to split the input between. Defaults to 1.',
+                    default=1, type=int)
+parser.add_argument('--unmatched_report', help='Path to csv file summarizing the most frequent unmatched payees,'
+                                               ' instead of printing every unmatched row.')
+parser.add_argument('--top_k', help='Number of payees in the unmatched report. Defaults to 100.', default=100, type=int)
+regex_engine.add_arguments(parser)
+stats.add_arguments(parser)
+
+# Payees kept per top_k payee reported, more makes the counts of the reported payees more accurate
+report_capacity_factor = 10
+
 
-args = parser.parse_args()
-
-# Take care of any default setup needed
-close_input = True
-if args.input is None:
-    close_input = False
-    args.input = 0
-close_output = True
-if args.output is None:
-    close_output = False
-    args.output = 1
-
-# Open required files
-# noinspection PyTypeChecker
-with open(args.input, newline='', encoding='UTF-8', closefd=close_input) as input_file, open(args.filter, newline='')\
-        as filter_file, open(args.output, mode='w', newline='', closefd=close_output) as output_file:
-    in_reader = csv.DictReader(input_file)
-    filter_reader = csv.DictReader(filter_file)
-    # Set up filters array
+def load_filters(filter_path, args=None):
+    """Return the rules in the filter file as a list of [compiled regex, payee, category, subcategory].
+
+    The regexes are compiled with the engine and budget chosen by args, see regex_engine.compile.
+    """
     filters = []
-    for filter_row in filter_reader:
-        filters.append([re.compile(filter_row['regex'], re.I), filter_row['payee'],
-                        filter_row['category'], filter_row['subcategory']])
-    # Set up output file with input headers
-    out_writer = csv.DictWriter(output_file, in_reader.fieldnames)
-    out_writer.writeheader()
-    # Iterate through input file
-    unmatched = []
-    for row in in_reader:
-        original_payee = row['payee']
-        # Iterate through all the regular expressions, case insensitive
-        match = None
-        payee = ''
-        category = ''
-        subcategory = ''
-        for fil in filters:
-            # print('Seeing if {} matches regex {}'.format(original_payee, str(filter[0])))
-            result = fil[0].search(original_payee)
-            if result is not None:
-                # print(result)
+    for regex, payee, category, subcategory in csv_io.read_columns(filter_path,
+                                                                   ['regex', 'payee', 'category', 'subcategory']):
+        filters.append([regex_engine.compile(regex, re.I, args), payee, category, subcategory])
+    return filters
+
+
+def load_rules(args):
+    """Return [filters, matcher, cache], the compiled form of the filter file used by stage."""
+    filters = load_filters(args.filter, args)
+    patterns = [fil[0] for fil in filters]
+    if getattr(args, 'stats', None) is not None:
+        patterns = args.stats.add_rules(patterns)
+    # Index all the regular expressions so each payee is only tried against the ones that could match it
+    matcher = RuleMatcher(patterns)
+    cache = MatchCache(args.filter, args.cache_size, args.cache_file, getattr(args, 'regex_engine', 're'))
+    return [filters, matcher, cache]
+
+
+def report_unmatched(unmatched):
+    """Print the [payee, date, amount] of each unmatched row so the user can add them to the filter."""
+    for unmatch in unmatched:
+        print('{}|{}|{}'.format(unmatch[0], unmatch[1], unmatch[2]))
+
+
+def unmatched_collector(args):
+    """Return a function making the collector of unmatched rows for args: a list, or an UnmatchedReport when
+    --unmatched_report is given."""
+    if getattr(args, 'unmatched_report', None) is None:
+        return list
+    return functools.partial(UnmatchedReport, max(args.top_k, 1) * report_capacity_factor)
+
+
+def write_unmatched_report(args, report):
+    """Write the top payees of an UnmatchedReport to args.unmatched_report."""
+    with csv_io.open_output(args.unmatched_report) as report_file:
+        writer = csv.writer(report_file)
+        writer.writerow(REPORT_HEADERS)
+        writer.writerows(report.top(args.top_k))
+    if report.rows:
+        print('WARN: {:d} rows matched no filter, the most frequent payees are in {}.'
+              .format(report.rows, args.unmatched_report), file=sys.stderr)
+
+
+def finish_unmatched(args, collected):
+    """Report the unmatched rows held by collected, the collector made by unmatched_collector(args)."""
+    if getattr(args, 'unmatched_report', None) is None:
+        report_unmatched(collected)
+    else:
+        write_unmatched_report(args, collected)
+
+
+def stage(rows, args, rules=None, unmatched=None):
+    """Yield the header row and then each row with payee, category, subcategory set by the first matching filter.
+
+    rows is an iterator of csv rows whose first row contains the column headers. rules is the result of
+    load_rules(args), built here when not given. Rows that matched no filter are added to the unmatched list when one
+    is given, otherwise they are reported once all rows have been processed.
+    """
+    rows = iter(rows)
+    if rules is None:
+        rules = load_rules(args)
+    filters, matcher, cache = rules
+    run_stats = getattr(args, 'stats', None)
+    lookup = cache.lookup if run_stats is None else run_stats.timed(cache.lookup)
+    report = unmatched is None
+    if report:
+        unmatched = unmatched_collector(args)()
+    try:
+        fieldnames = next(rows, None)
+        if fieldnames is None:
+            return
+        width = len(fieldnames)
+        payee_col = fieldnames.index('payee')
+        category_col = fieldnames.index('category')
+        subcategory_col = fieldnames.index('subcategory')
+        # Only the report of unmatched rows uses the date and amount, so files without them can still be filtered
+        date_col = fieldnames.index('date') if 'date' in fieldnames else -1
+        amount_col = fieldnames.index('amount') if 'amount' in fieldnames else -1
+        # Set up output file with input headers
+        yield fieldnames
+        # Iterate through input file
+        for row in rows:
+            # Blank lines are skipped, short rows are padded and long rows are trimmed to the headers
+            if not row:
+                continue
+            if len(row) != width:
+                row = (row + [''] * width)[:width]
+            original_payee = row[payee_col]
+            # Find all the regular expressions that match, case insensitive
+            match = None
+            payee = ''
+            category = ''
+            subcategory = ''
+            indexes = lookup(original_payee, matcher.matches)
+            if run_stats is not None:
+                run_stats.hit(indexes)
+            for index in indexes:
+                fil = filters[index]
                 if match:
                     print('Payee {} previously matched {}, matched {} as well.'
                           .format(original_payee, match, str(fil[0])))
@@ -79,34 +181,56 @@ with open(args.input, newline='', encoding='UTF-8', closefd=close_input) as inpu
                     payee = fil[1]
                     category = fil[2]
                     subcategory = fil[3]
-                # else:
-                #     print('No match')
-        if not match:
-            unmatched.append([original_payee, row['date'], row['amount']])
-        # Prepare the modified row
-        out_dict = {}
-        for field in in_reader.fieldnames:
-            # Modify anything we need to modify
-            if field == 'payee':
-                if match:
-                    out_dict['payee'] = payee
-                else:
-                    out_dict['payee'] = row['payee']
-            elif field == 'category':
-                if match:
-                    out_dict['category'] = category
-                else:
-                    out_dict['category'] = row['category']
-            elif field == 'subcategory':
-                if match:
-                    out_dict['subcategory'] = subcategory
-                else:
-                    out_dict['subcategory'] = row['subcategory']
-            # Pass everything else through unchanged
+            if not match:
+                unmatched.append([original_payee, row[date_col] if date_col >= 0 else '',
+                                  row[amount_col] if amount_col >= 0 else ''])
+            # Modify anything we need to modify and pass everything else through unchanged
             else:
-                out_dict[field] = row[field]
-        # Write out the row
-        out_writer.writerow(out_dict)
-    # Report things that were unmatched so user can add them to the filter
-    for unmatch in unmatched:
-        print('{}|{}|{}'.format(unmatch[0], unmatch[1], unmatch[2]))
+                row[payee_col] = payee
+                row[category_col] = category
+                row[subcategory_col] = subcategory
+            yield row
+        # Report things that were unmatched so user can add them to the filter
+        if report:
+            finish_unmatched(args, unmatched)
+        regex_engine.report_budget(filters)
+    finally:
+        cache.close()
+
+
+def main():
+    args = parser.parse_args()
+    stats.setup(parser, args, 'filter')
+
+    # Take care of any default setup needed
+    close_input = True
+    if args.input is None:
+        close_input = False
+        args.input = 0
+    close_output = True
+    if args.output is None:
+        close_output = False
+        args.output = 1
+
+    if args.workers > 1:
+        # noinspection PyTypeChecker
+        with csv_io.open_input(args.input, close_input, binary=True) as input_file,\
+                csv_io.open_output(args.output, close_output) as output_file:
+            if args.unmatched_report is None:
+                run_chunked(stage, args, load_rules(args), input_file, output_file, args.workers, list,
+                            lambda collected: report_unmatched(itertools.chain.from_iterable(collected)))
+            else:
+                run_chunked(stage, args, load_rules(args), input_file, output_file, args.workers,
+                            unmatched_collector(args), lambda collected: write_unmatched_report(args, collected[0]),
+                            combine=UnmatchedReport.merge)
+        return
+
+    # Open required files
+    # noinspection PyTypeChecker
+    with csv_io.open_input(args.input, close_input) as input_file,\
+            csv_io.open_output(args.output, close_output) as output_file:
+        stats.run_stage(stage, args, input_file, output_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,31 +4,78 @@
 The script takes the following optional arguments:
 input=Path to a csv file containing the designated input columns.
 output=Path to write the output csv file. This file will be overwritten without warning if it exists.
+book=Path to a GnuCash sqlite book, or a postgres:// URI of a GnuCash database, to write the transactions straight
+     into instead of writing csv. Transactions already in the book are skipped. Needs piecash.
+batch_size=Transactions written to the book per database commit. Defaults to 1000.
+account=Full name of the account the input was exported from. Defaults to Assets:Current Assets:Advantis Checking.
+columns=Zero-based indexes of the description, date, other account, debit and credit columns, separated by commas.
+        Defaults to 0,1,2,3,4.
+account_input=path=account, an input file and the full name of the account it was exported from. Repeat it to import
+              many accounts in one run; the transactions of all files are written to the same output, file by file.
+              A path without =account uses --account. Cannot be combined with --input.
+workers=Number of worker processes converting --account_input files at the same time. Defaults to 1.
+profile=Print rows and time per phase to stderr once the output is written.
+stats_json=Path to write rows and time per phase to as JSON.
 """
 import csv
 import argparse
-import re
-import arrow
+import datetime
+import io
 import sys
-from decimal import *
+from concurrent.futures import ProcessPoolExecutor
+
+from arrow.parser import ParserError
+
+import csv_io
+import money
+import stats
+from date_convert import convert
 
 author = 'brian.k.smith@gmail.com'
 
+
+def columns_arg(value):
+    """Return the five column indexes of a --columns value."""
+    try:
+        columns = [int(column) for column in value.split(',')]
+    except ValueError:
+        columns = []
+    if len(columns) != 5:
+        raise argparse.ArgumentTypeError('expected five comma separated column indexes, got {}'.format(value))
+    return columns
+
+
+def account_input_arg(value):
+    """Return [path, account] of an --account_input value, account being None when it is left out."""
+    path, sep, account = value.partition('=')
+    return [path, account if sep else None]
+
+
 parser = argparse.ArgumentParser(description='Convert imput transactions into GnuCash import format.')
 parser.add_argument('--input', help='Path to csv input file with transactions.'
                                     ' Defaults to stdin.')
 parser.add_argument('--output', help='Path to csv output file. This file will be overwritten if it exists. Defaults'
                                      ' to stdout.')
-
-args = parser.parse_args()
+parser.add_argument('--book', help='Path to a GnuCash sqlite book, or a postgres:// URI, to write the transactions'
+                                   ' into instead of writing csv.')
+parser.add_argument('--batch_size', help='Transactions written to the book per database commit. Defaults to 1000.',
+                    default=1000, type=int)
+parser.add_argument('--account', help='Full name of the account the input was exported from. Defaults to'
+                                      ' Assets:Current Assets:Advantis Checking.',
+                    default="Assets:Current Assets:Advantis Checking")
+parser.add_argument('--columns', help='Zero-based indexes of the description, date, other account, debit and credit'
+                                      ' columns, separated by commas. Defaults to 0,1,2,3,4.',
+                    default='0,1,2,3,4', type=columns_arg)
+parser.add_argument('--account_input', help='path=account, an input file and the account it was exported from. May be'
+                                            ' repeated.', action='append', type=account_input_arg)
+parser.add_argument('--workers', help='Number of worker processes converting --account_input files at the same time.'
+                                      ' Defaults to 1.', default=1, type=int)
+stats.add_arguments(parser)
 
 
-currency_regex = re.compile('\$?\s*(-?\d+\.\d+)')
 out_columns = ["Date","Transaction Type","Second Date","Account Name", "Number", "Description", "Notes", "Memo",
                "Full Category Path", "Category","Row Type","Action","Reconcile", "Amount With Sym",
                "Commodity Mnemonic","Commodity Name","Amount Num.","Rate/Price"]
-account_full_name = "Assets:Current Assets:Advantis Checking"
-account_name = "Advantis Checking"
 out_date_col = 0
 out_account_name_col = 3
 out_desc_col = 5
@@ -42,48 +89,247 @@ out_commodity_name_col = 15
 out_amount_col = 16
 out_rate_col = 17
 
-# Take care of any default setup needed
-close_input = True
-if args.input is None:
-    close_input = False
-    args.input = 0
-close_output = True
-if args.output is None:
-    close_output = False
-    args.output = 1
-
-# Open required files
-# noinspection PyTypeChecker
-with open(args.input, newline='', encoding='UTF-8', closefd=close_input) as input_file,\
-        open(args.output, mode='w', newline='', closefd=close_output) as output_file:
-    in_reader = csv.reader(input_file)
-    out_writer = csv.writer(output_file)
+
+def amount(debit, credit):
+    """Return the amount of a debit and credit pair of values in cents, negative for a debit."""
+    cents = money.parse_like_decimal(debit or credit)
+    return -cents if debit else cents
+
+
+def amount_strings(debit, credit):
+    """Return the amount of a debit and credit pair of values and its negation, formatted for GnuCash."""
+    text = debit or credit
+    return [money.format_like_decimal(text, bool(debit)), money.format_like_decimal(text, not debit)]
+
+
+def row_templates(account_full):
+    """Return the transaction row and the two split rows that the rows of each transaction into account_full are
+    copied from."""
+    short = account_full.split(":")[-1]
+    # "{:-$.2f}".format(currency) for the Amount Num. of the splits
+    return [["", "", "", short, "", "", "", "", "", "", "T", "", "n", "", "USD", "CURRENCY", "", ""],
+            ["", "", "", "", "", "", "", "", account_full, short, "S", "", "n", "", "USD", "CURRENCY", "", 1],
+            ["", "", "", "", "", "", "", "", "", "", "S", "", "n", "", "USD", "CURRENCY", "", 1]]
+
+
+def report_errors(account, errors):
+    """Print the [row number, reason, row] of each input row of account that could not be imported, and their count."""
+    for row_number, reason, row in errors:
+        print("ERROR: {} row {:d}: {}: {}.".format(account, row_number, reason, ", ".join(row)), file=sys.stderr)
+    if errors:
+        print("ERROR: {}: {:d} rows were not imported.".format(account, len(errors)), file=sys.stderr)
+
+
+def stage(rows, args, errors=None):
+    """Yield the GnuCash header row and then a transaction row and two split rows for each input row.
+
+    rows is an iterator of csv rows whose first row contains the column headers, exported from args.account. Rows that
+    cannot be converted are added to errors as [row number, reason, row] when it is given, and are otherwise reported
+    once all rows are done.
+    """
+    report = errors is None
+    if report:
+        errors = []
+    desc_col, date_col, dest_col, debit_col, credit_col = args.columns
+    template_a, template_b, template_c = row_templates(args.account)
+    rows = iter(rows)
     # Deal with headers
-    in_headers = next(in_reader)
-    out_writer.writerow(out_columns)
-    for row in in_reader:
+    in_headers = next(rows, None)
+    if in_headers is None:
+        return
+    yield out_columns
+    row_number = 0
+    for row in rows:
+        row_number += 1
+        try:
+            out_date = convert(row[date_col], 'YYYY-MM-DD', 'MM/DD/YYYY')
+            desc = row[desc_col]
+            dest_account_full = row[dest_col]
+            amounts = amount_strings(row[debit_col], row[credit_col])
+        except (ValueError, IndexError, ArithmeticError, ParserError):
+            errors.append([row_number, "could not process row", row])
+            continue
+        dest_account_short = dest_account_full.split(":")[-1]
+        out_row_a = template_a.copy()
+        out_row_a[out_date_col] = out_date
+        out_row_a[out_desc_col] = desc
+        out_row_a[out_full_cat_col] = dest_account_full
+        out_row_a[out_cat_col] = dest_account_short
+        out_row_b = template_b.copy()
+        out_row_b[out_amount_col] = amounts[0]
+        out_row_c = template_c.copy()
+        out_row_c[out_full_cat_col] = dest_account_full
+        out_row_c[out_cat_col] = dest_account_short
+        out_row_c[out_amount_col] = amounts[1]
+        yield out_row_a
+        yield out_row_b
+        yield out_row_c
+    if report:
+        report_errors(args.account, errors)
+
+
+def convert_file(path, args, output_file):
+    """Write the GnuCash rows of the csv file at path, without the header row, to output_file.
+
+    Returns the rows that could not be converted as [row number, reason, row].
+    """
+    errors = []
+    with csv_io.open_input(path) as input_file:
+        rows = csv.reader(input_file)
+        run_stats = getattr(args, 'stats', None)
+        if run_stats is None:
+            out_rows = stage(rows, args, errors)
+        else:
+            out_rows = run_stats.count_out(stage(run_stats.count_in(rows), args, errors))
+        out_rows = iter(out_rows)
+        next(out_rows, None)
+        csv.writer(output_file).writerows(out_rows)
+    return errors
+
+
+def _convert_task(task):
+    """Return [csv text, errors] of convert_file for task [path, args], in a worker process."""
+    output = io.StringIO(newline='')
+    errors = convert_file(task[0], task[1], output)
+    return [output.getvalue(), errors]
+
+
+def account_args(args, account):
+    """Return a copy of args importing from account."""
+    account_args = argparse.Namespace(**vars(args))
+    account_args.account = account
+    return account_args
+
+
+def convert_accounts(args, output_file):
+    """Write the GnuCash rows of every --account_input file to output_file, file by file, with a single header row.
+
+    With more than one worker the files are converted in worker processes; their output is still written in the order
+    the files were given.
+    """
+    csv.writer(output_file).writerow(out_columns)
+    tasks = [[path, account_args(args, account)] for path, account in args.account_input]
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            for task, result in zip(tasks, executor.map(_convert_task, tasks)):
+                output_file.write(result[0])
+                report_errors(task[1].account, result[1])
+        return
+    start = stats.clock()
+    for task in tasks:
+        report_errors(task[1].account, convert_file(task[0], task[1], output_file))
+    if args.stats is not None:
+        output_file.flush()
+        total = stats.clock() - start
+        args.stats.finish(total)
+        stats.emit(args, [args.stats], total)
+
+
+def write_book(rows, writer, args, errors):
+    """Add a transaction to the book of writer, a gnucash_book.BookWriter, for each input row.
+
+    rows is an iterator of csv rows whose first row contains the column headers. Rows that cannot be added are added to
+    errors as [row number, reason, row].
+    """
+    desc_col, date_col, dest_col, debit_col, credit_col = args.columns
+    rows = iter(rows)
+    if next(rows, None) is None:
+        return
+    row_number = 0
+    for row in rows:
+        row_number += 1
         try:
-            in_date = arrow.get(row[1], 'YYYY-MM-DD')
-            out_date = in_date.format('MM/DD/YYYY')
-            desc = row[0]
-            dest_account_full = row[2]
-            acct_parts = dest_account_full.split(":")
-            dest_account_short = acct_parts[len(acct_parts) - 1]
-            if row[3]:
-                currency = Decimal(row[3]) * -1
-            else:
-                currency = Decimal(row[4])
-            out_row_a = [out_date,"","", account_name,"", desc,"","", dest_account_full,dest_account_short,"T","","n",
-                         "","USD","CURRENCY","",""]
-            # "{:-$.2f}".format(currency)
-            out_row_b = ["","","","","","","","",account_full_name,account_name,"S","","n","",
-                         "USD","CURRENCY","{:.2f}".format(currency),1]
-            # "{:-$.2f}".format(-1 * currency)
-            out_row_c = ["", "", "", "", "", "", "", "", dest_account_full, dest_account_short, "S", "", "n",
-                         "",
-                         "USD", "CURRENCY", "{:.2f}".format(-1 * currency), 1]
-            out_writer.writerow(out_row_a)
-            out_writer.writerow(out_row_b)
-            out_writer.writerow(out_row_c)
-        except:
-            print("ERROR: Could not process row {}.".format(", ".join(row)), file=sys.stderr)
+            day = datetime.datetime.strptime(row[date_col], '%Y-%m-%d').date()
+            writer.add(day, row[desc_col], row[dest_col], money.to_decimal(amount(row[debit_col], row[credit_col])))
+        except KeyError as e:
+            errors.append([row_number, "no account {} in the book".format(e), row])
+        except (ValueError, IndexError, ArithmeticError):
+            errors.append([row_number, "could not process row", row])
+    writer.flush()
+
+
+def import_book(args, inputs):
+    """Write the transactions of each [path, account, closefd] in inputs into the GnuCash book at args.book."""
+    try:
+        import gnucash_book
+    except ImportError:
+        print("ERROR: --book needs piecash, install it with pip install piecash.", file=sys.stderr)
+        sys.exit(1)
+    try:
+        book = gnucash_book.open_book(args.book)
+    except gnucash_book.GnucashException as e:
+        print("ERROR: Could not open book {}: {}".format(args.book, e), file=sys.stderr)
+        sys.exit(1)
+    written = 0
+    start = stats.clock()
+    with book:
+        for path, account, closefd in inputs:
+            try:
+                writer = gnucash_book.BookWriter(book, account, args.batch_size)
+            except KeyError:
+                print("ERROR: No account {} in book {}.".format(account, args.book), file=sys.stderr)
+                sys.exit(1)
+            errors = []
+            with csv_io.open_input(path, closefd) as input_file:
+                rows = csv.reader(input_file)
+                if args.stats is not None:
+                    rows = args.stats.count_in(rows)
+                write_book(rows, writer, account_args(args, account), errors)
+            report_errors(account, errors)
+            print("{}: {}".format(account, writer.report()), file=sys.stderr)
+            written += writer.written
+    total = stats.clock() - start
+    if args.stats is not None:
+        args.stats.rows_out = written
+        args.stats.finish()
+        # Everything but reading the input was spent adding and committing transactions
+        args.stats.seconds['write'] = max(total - args.stats.seconds['parse'], 0.0)
+        stats.emit(args, [args.stats], total)
+
+
+def main():
+    args = parser.parse_args()
+    stats.setup(parser, args, 'gnucash_import_prep')
+    if args.book is not None and args.output is not None:
+        parser.error('--book and --output cannot be used together')
+    if args.account_input is not None and args.input is not None:
+        parser.error('--account_input and --input cannot be used together')
+    if args.workers > 1 and args.account_input is None:
+        parser.error('--workers only applies to --account_input files')
+    if args.workers > 1 and args.book is not None:
+        parser.error('--workers cannot be used with --book, a book is written by a single process')
+    if args.account_input is not None:
+        args.account_input = [[path, args.account if account is None else account]
+                              for path, account in args.account_input]
+
+    # Take care of any default setup needed
+    close_input = True
+    if args.input is None:
+        close_input = False
+        args.input = 0
+    close_output = True
+    if args.output is None:
+        close_output = False
+        args.output = 1
+
+    # Open required files
+    if args.book is not None:
+        if args.account_input is None:
+            import_book(args, [[args.input, args.account, close_input]])
+        else:
+            import_book(args, [[path, account, True] for path, account in args.account_input])
+        return
+
+    if args.account_input is not None:
+        with csv_io.open_output(args.output, close_output) as output_file:
+            convert_accounts(args, output_file)
+        return
+
+    # noinspection PyTypeChecker
+    with csv_io.open_input(args.input, close_input) as input_file,\
+            csv_io.open_output(args.output, close_output) as output_file:
+        stats.run_stage(stage, args, input_file, output_file)
+
+
+if __name__ == '__main__':
+    main()
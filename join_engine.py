@@ -0,0 +1,152 @@
+"""Join the rows of a primary csv file with matching rows of a secondary csv file.
+
+Three join strategies are available, all producing the primary rows in their original order:
+hash  - Load the secondary rows into an in-memory index, then stream the primary rows past it. Fastest, but memory grows
+        with the size of the secondary file.
+grace - Partition both inputs by key into temporary files, join one partition at a time, then merge the partition
+        results back into primary order. Memory is bounded by the largest partition instead of the secondary file.
+merge - Walk both inputs side by side. Both must already be sorted by their key column. Memory is bounded by the number
+        of secondary rows sharing a single key.
+
+Every strategy supports the same join types and duplicate key policies:
+join       - 'left' keeps primary rows without a match (merged columns left blank), 'inner' drops them.
+duplicates - 'first' or 'last' keeps only the first or last secondary row for a key, 'all' emits one output row per
+             matching secondary row.
+"""
+import csv
+import heapq
+import os
+import tempfile
+
+from compact_index import CompactIndex
+
+author = 'brian.k.smith@gmail.com'
+
+JOIN_TYPES = ['left', 'inner']
+DUPLICATE_POLICIES = ['first', 'last', 'all']
+MODES = ['hash', 'grace', 'merge']
+
+
+def build_index(secondary_rows, secondary_column, merge_columns, duplicates):
+    """Return a CompactIndex mapping each secondary key to the merged column values kept for it."""
+    index = CompactIndex(len(merge_columns), duplicates)
+    for row in secondary_rows:
+        index.add(row[secondary_column], [row[i] for i in merge_columns])
+    return index
+
+
+def _joined(row, matches, width, join):
+    """Return the output rows for one primary row and the merged column values that matched it."""
+    if matches:
+        return [row + list(values) for values in matches]
+    if join == 'left':
+        return [row + [''] * width]
+    return []
+
+
+def hash_join(primary_rows, secondary_rows, primary_column, secondary_column, merge_columns, join='left',
+              duplicates='last'):
+    """Yield joined rows using an in-memory index of the secondary rows."""
+    index = build_index(secondary_rows, secondary_column, merge_columns, duplicates)
+    width = len(merge_columns)
+    for row in primary_rows:
+        for out_row in _joined(row, index.get(row[primary_column]), width, join):
+            yield out_row
+
+
+def grace_join(primary_rows, secondary_rows, primary_column, secondary_column, merge_columns, join='left',
+               duplicates='last', partitions=64, temp_dir=None):
+    """Yield joined rows by partitioning both inputs into temporary files and joining one partition at a time."""
+    width = len(merge_columns)
+    with tempfile.TemporaryDirectory(prefix='collate_', dir=temp_dir) as work_dir:
+        def partition_files(name):
+            files = [open(os.path.join(work_dir, '{}_{:d}.csv'.format(name, i)), mode='w', newline='',
+                          encoding='UTF-8') for i in range(partitions)]
+            return files, [csv.writer(f) for f in files]
+
+        # Spill the secondary rows, keeping only the key and merged columns
+        secondary_files, writers = partition_files('secondary')
+        for row in secondary_rows:
+            key = row[secondary_column]
+            writers[hash(key) % partitions].writerow([key] + [row[i] for i in merge_columns])
+        for f in secondary_files:
+            f.close()
+        # Spill the primary rows, tagged with their position so the original order can be restored
+        primary_files, writers = partition_files('primary')
+        for position, row in enumerate(primary_rows):
+            writers[hash(row[primary_column]) % partitions].writerow([position] + row)
+        for f in primary_files:
+            f.close()
+        # Join each partition with only its own slice of the secondary rows in memory
+        result_files, writers = partition_files('result')
+        for i in range(partitions):
+            with open(secondary_files[i].name, newline='', encoding='UTF-8') as secondary_file:
+                index = build_index(csv.reader(secondary_file), 0, range(1, width + 1), duplicates)
+            with open(primary_files[i].name, newline='', encoding='UTF-8') as primary_file:
+                for tagged in csv.reader(primary_file):
+                    row = tagged[1:]
+                    for out_row in _joined(row, index.get(row[primary_column]), width, join):
+                        writers[i].writerow([tagged[0]] + out_row)
+            os.remove(secondary_files[i].name)
+            os.remove(primary_files[i].name)
+        for f in result_files:
+            f.close()
+        # Each result file is already in primary order, so a k-way merge restores the overall order
+        readers = []
+        try:
+            for f in result_files:
+                readers.append(open(f.name, newline='', encoding='UTF-8'))
+            for tagged in heapq.merge(*[csv.reader(r) for r in readers], key=lambda tagged_row: int(tagged_row[0])):
+                yield tagged[1:]
+        finally:
+            for r in readers:
+                r.close()
+
+
+def merge_join(primary_rows, secondary_rows, primary_column, secondary_column, merge_columns, join='left',
+               duplicates='last'):
+    """Yield joined rows by walking two inputs that are both sorted by their key columns.
+
+    Raises ValueError when either input turns out not to be sorted.
+    """
+    width = len(merge_columns)
+    secondary = iter(secondary_rows)
+    secondary_row = next(secondary, None)
+    secondary_key = None
+    previous_key = None
+    matches = []
+    for row in primary_rows:
+        key = row[primary_column]
+        if previous_key is not None and key < previous_key:
+            raise ValueError('Primary file is not sorted: {} follows {}.'.format(key, previous_key))
+        if previous_key is None or key != previous_key:
+            matches = []
+            while secondary_row is not None:
+                next_key = secondary_row[secondary_column]
+                if secondary_key is not None and next_key < secondary_key:
+                    raise ValueError('Secondary file is not sorted: {} follows {}.'.format(next_key, secondary_key))
+                if next_key > key:
+                    break
+                secondary_key = next_key
+                if next_key == key:
+                    values = [secondary_row[i] for i in merge_columns]
+                    if duplicates == 'all' or not matches:
+                        matches.append(values)
+                    elif duplicates == 'last':
+                        matches[0] = values
+                secondary_row = next(secondary, None)
+            previous_key = key
+        for out_row in _joined(row, matches, width, join):
+            yield out_row
+
+
+def join_rows(primary_rows, secondary_rows, primary_column, secondary_column, merge_columns, mode='hash', join='left',
+              duplicates='last', partitions=64):
+    """Yield the rows of primary_rows joined with secondary_rows using the requested strategy."""
+    if mode == 'grace':
+        return grace_join(primary_rows, secondary_rows, primary_column, secondary_column, merge_columns, join,
+                          duplicates, partitions)
+    if mode == 'merge':
+        return merge_join(primary_rows, secondary_rows, primary_column, secondary_column, merge_columns, join,
+                          duplicates)
+    return hash_join(primary_rows, secondary_rows, primary_column, secondary_column, merge_columns, join, duplicates)
@@ -0,0 +1,121 @@
+"""Remember which rules matched a value so repeated values skip regex matching.
+
+Bank feeds repeat the same payee strings over and over, so the result of matching a value against a rule file is
+cached in a bounded least recently used cache. The cache is keyed on a hash of the rule file, so editing the rules
+invalidates everything that was cached for them. Results can optionally be kept in a sqlite file so later runs over
+overlapping statement periods start with a warm cache.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+from collections import OrderedDict
+
+author = 'brian.k.smith@gmail.com'
+
+
+def file_hash(path):
+    """Return the sha256 hex digest of the contents of the file at path."""
+    digest = hashlib.sha256()
+    with open(path, mode='rb') as hash_file:
+        for block in iter(lambda: hash_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class MatchCache:
+    """Bounded LRU cache of rule matching results for one rule file, optionally persisted to a sqlite file.
+
+    rule_path is the rule file the cached results were computed from. max_entries bounds the number of results kept
+    in memory; 0 disables caching entirely. store_path, when given, is a sqlite file results are read from and saved
+    to. Results are lists of rule indexes and are stored per namespace, so one rule file can cache several columns.
+    engine is the regex engine the rules run on, see regex_engine.py. re2 can match differently from re, so the results
+    of each engine are kept apart.
+
+    The sqlite file is opened when it is first needed and reopened after close(), so a cache can be copied into worker
+    processes and each copy keeps its own connection.
+    """
+
+    flush_every = 1000
+
+    def __init__(self, rule_path, max_entries=65536, store_path=None, engine='re'):
+        # re keeps the plain hash, so files cached before engines could be chosen stay valid
+        engine_key = '' if engine == 're' else ':' + engine
+        self.rule_hash = file_hash(rule_path) + engine_key
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pending = []
+        self._db = None
+        self.store_path = store_path if max_entries > 0 else None
+        if self.store_path:
+            db = self._connect()
+            db.execute('CREATE TABLE IF NOT EXISTS rule_files (path TEXT PRIMARY KEY, hash TEXT)')
+            db.execute('CREATE TABLE IF NOT EXISTS matches (rule_hash TEXT, namespace TEXT, value TEXT,'
+                       ' result TEXT, PRIMARY KEY (rule_hash, namespace, value))')
+            # Throw away anything cached for an older version of this rule file
+            rule_key = os.path.abspath(rule_path) + engine_key
+            known = db.execute('SELECT hash FROM rule_files WHERE path = ?', (rule_key,)).fetchone()
+            if known is not None and known[0] != self.rule_hash:
+                db.execute('DELETE FROM matches WHERE rule_hash = ?', (known[0],))
+            db.execute('INSERT OR REPLACE INTO rule_files (path, hash) VALUES (?, ?)', (rule_key, self.rule_hash))
+            db.commit()
+            self.close()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_db'] = None
+        state['_pending'] = []
+        return state
+
+    def _connect(self):
+        """Return the connection to the sqlite file, opening it if needed."""
+        if self._db is None:
+            # Several worker processes may share the file, so wait for their writes rather than failing
+            self._db = sqlite3.connect(self.store_path, timeout=60)
+        return self._db
+
+    def lookup(self, value, compute, namespace=''):
+        """Return the cached result for value, calling compute(value) and caching its result on a miss."""
+        if self.max_entries <= 0:
+            return compute(value)
+        key = (namespace, value)
+        entries = self._entries
+        result = entries.get(key)
+        if result is not None:
+            entries.move_to_end(key)
+            self.hits += 1
+            return result
+        if self.store_path:
+            stored = self._connect().execute('SELECT result FROM matches WHERE rule_hash = ? AND namespace = ?'
+                                             ' AND value = ?', (self.rule_hash, namespace, value)).fetchone()
+            if stored is not None:
+                result = json.loads(stored[0])
+                self.hits += 1
+        if result is None:
+            self.misses += 1
+            result = compute(value)
+            if self.store_path:
+                self._pending.append((self.rule_hash, namespace, value, json.dumps(result)))
+                if len(self._pending) >= self.flush_every:
+                    self.flush()
+        entries[key] = result
+        if len(entries) > self.max_entries:
+            entries.popitem(last=False)
+        return result
+
+    def flush(self):
+        """Write newly computed results to the sqlite file, if there is one."""
+        if self.store_path and self._pending:
+            self._connect().executemany('INSERT OR REPLACE INTO matches (rule_hash, namespace, value, result)'
+                                        ' VALUES (?, ?, ?, ?)', self._pending)
+            self._db.commit()
+            self._pending = []
+
+    def close(self):
+        """Flush pending results and close the sqlite file. The cache can still be used afterwards."""
+        self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,114 @@
+"""Parse and format amounts of money as integer numbers of cents.
+
+float cannot hold most amounts exactly, so sums of many rows drift and have to be compared with a tolerance, and
+Decimal is exact but slow to build and format. Here an amount is an int counting minor units, such as cents, which
+sums and compares exactly. parse reads the text of an amount with string methods and one int() call, and format writes
+it back with integer division.
+
+parse accepts an optional + or - sign before or after an optional $, spaces around them, and digits with an optional
+decimal point, such as 12, -3.5, $ 1.25, -$40.00 or $-40.00. Digits beyond places are rounded half to even, like
+"{:.2f}".format does for a Decimal, or rejected when exact is set. Anything else, such as thousands separators or
+exponents, raises ValueError.
+
+Tools that used to read amounts with Decimal use parse_like_decimal and format_like_decimal instead, which also read
+what Decimal reads, such as 1e3, and keep the sign of -0.00 the way "{:.2f}".format does. Decimal is only used for the
+amounts parse does not read, and for those that format would write differently.
+"""
+from decimal import Decimal
+
+author = 'brian.k.smith@gmail.com'
+
+# Digits after the decimal point in the amounts of every currency the tools handle
+PLACES = 2
+
+
+def _sign(text):
+    """Return [whether text starts with a minus sign, text without its sign and the spaces after it]."""
+    if text.startswith('-'):
+        return [True, text[1:].lstrip()]
+    if text.startswith('+'):
+        return [False, text[1:].lstrip()]
+    return [False, text]
+
+
+def parse(text, places=PLACES, exact=False):
+    """Return the amount in text as an int number of minor units, 1/10**places of a unit. Raises ValueError when text
+    is not an amount, or when exact is set and it has more than places decimals."""
+    # Fast path for amounts written with exactly places decimals, such as -12.34 or $12.34, which int reads once the
+    # point is removed. int also accepts _ between digits, which is not an amount.
+    whole, point, fraction = text.partition('.')
+    if len(fraction) == places and fraction.isdigit() and '_' not in whole:
+        try:
+            return int((whole[1:] if whole[:1] == '$' else whole) + fraction)
+        except ValueError:
+            pass
+    negative, value = _sign(text.strip())
+    if value.startswith('$'):
+        value = value[1:].lstrip()
+        if not negative:
+            negative, value = _sign(value)
+    whole, point, fraction = value.partition('.')
+    if not (whole or fraction) or (whole and not whole.isdigit()) or (fraction and not fraction.isdigit()):
+        raise ValueError('not an amount: {!r}'.format(text))
+    if len(fraction) <= places:
+        units = int(whole + fraction + '0' * (places - len(fraction)))
+    elif exact:
+        raise ValueError('more than {:d} decimal places: {!r}'.format(places, text))
+    else:
+        units = int(whole + fraction[:places] or '0')
+        rest = fraction[places:]
+        # Round half to even
+        if rest[0] > '5' or (rest[0] == '5' and (rest[1:].strip('0') or units % 2)):
+            units += 1
+    return -units if negative else units
+
+
+def format(units, places=PLACES):
+    """Return the text of an amount of units minor units, with places digits after the decimal point."""
+    digits = str(-units if units < 0 else units)
+    if not places:
+        return '-' + digits if units < 0 else digits
+    digits = digits.rjust(places + 1, '0')
+    return ('-' if units < 0 else '') + digits[:-places] + '.' + digits[-places:]
+
+
+def is_formatted(text, places=PLACES):
+    """Return whether text is an amount written exactly the way format writes it, such as -12.34."""
+    whole, point, fraction = text.partition('.')
+    digits = whole[1:] if whole[:1] == '-' else whole
+    return len(fraction) == places and text.isascii() and fraction.isdigit() and digits.isdigit() and \
+        (digits[0] != '0' or whole == '0')
+
+
+def to_decimal(units, places=PLACES):
+    """Return an amount of units minor units as an exact Decimal, for libraries such as piecash that expect one."""
+    return Decimal(units).scaleb(-places)
+
+
+def parse_like_decimal(text, places=PLACES):
+    """Return the amount in text as an int number of minor units, reading it like parse or, when parse cannot, like
+    Decimal, such as 1e3. Digits beyond places are rounded half to even. Raises ValueError or ArithmeticError when
+    neither reads text."""
+    try:
+        return parse(text, places)
+    except ValueError:
+        return int((Decimal(text) * 10 ** places).to_integral_value())
+
+
+def format_like_decimal(text, negate=False, places=PLACES):
+    """Return the amount in text, negated when negate is set, written the way "{:.2f}".format writes a Decimal.
+
+    Text is read like Decimal reads it, such as 1e3 or -0.00, whose sign is kept, or like parse when Decimal cannot
+    read it, such as $12.34. Raises ValueError when neither reads text.
+    """
+    if is_formatted(text, places):
+        if not negate:
+            return text
+        return text[1:] if text.startswith('-') else '-' + text
+    try:
+        value = Decimal(text)
+    except ArithmeticError:
+        value = to_decimal(parse(text, places), places)
+    if negate:
+        value = value * -1
+    return '{:.{:d}f}'.format(value, places)
@@ -0,0 +1,198 @@
+"""Run a stage that transforms each row independently over a csv file with several worker processes.
+
+The input is split into chunks of whole csv records. Splits only happen at line breaks outside quoted fields, so records
+with embedded line breaks stay together. Lines without quotes, and lines whose quotes only wrap whole fields, are
+complete records as they are; any other line with a quote is checked with csv.reader. A quote in the middle of an
+unquoted field, as in 12" PIZZA, is therefore kept as text, the way the workers read it, whether or not a quoted field
+follows on the same line. The header is read once by the parent process. The stage's compiled rules are handed to each
+worker once, when the worker starts. Every chunk is then parsed, transformed and serialized by a worker, and the parent
+writes the results back in input order. Anything a stage prints while working on a chunk is captured and replayed in
+chunk order too, including when the stage raises or exits, before the parent raises the same error.
+
+Stages used this way must accept the rules built by their module's load_rules(args), and must not depend on rows
+other than the header. args.row_offset is set to the number of data rows before each chunk for stages that report
+row numbers. Stages that print a report once all rows are processed can instead add to a collector passed as their
+fourth argument; the collectors of all chunks are handed to a finish function in the parent, in input order, or are
+merged into one as they arrive.
+"""
+import csv
+import contextlib
+import copy
+import io
+import itertools
+import pickle
+import re
+import sys
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import regex_engine
+
+author = 'brian.k.smith@gmail.com'
+
+_worker = {}
+
+# A line of fields that are either unquoted and free of quotes, or quoted as a whole, which csv.reader reads as one
+# complete record
+_QUOTED_FIELDS = re.compile(rb'(?:[^",\r\n]*|"(?:[^"]|"")*")(?:,(?:[^",\r\n]*|"(?:[^"]|"")*"))*\r?\n?')
+
+
+def ends_in_quotes(record):
+    """Return whether csv.reader reads the bytes of record, one or more lines, as ending inside a quoted field."""
+    # A record left open swallows the blank line after it, so both come back as one row
+    return sum(1 for row in csv.reader([record.decode('UTF-8', 'replace'), '\n'])) == 1
+
+
+def _in_quotes(lines, in_quotes):
+    """Return whether the record made of lines ends inside a quoted field, given whether it did before its last line."""
+    line = lines[-1]
+    if b'"' not in line:
+        return in_quotes
+    if not in_quotes and _QUOTED_FIELDS.fullmatch(line):
+        return False
+    return ends_in_quotes(b''.join(lines))
+
+
+def read_record(binary_file):
+    """Return the bytes of the next csv record in binary_file, including its line break, or b'' at the end."""
+    lines = []
+    in_quotes = False
+    for line in binary_file:
+        lines.append(line)
+        in_quotes = _in_quotes(lines, in_quotes)
+        if not in_quotes:
+            break
+    return b''.join(lines)
+
+
+def split_records(binary_file, chunk_bytes):
+    """Yield [number of records before the chunk, chunk bytes] for chunks of about chunk_bytes of whole records."""
+    lines = []
+    size = 0
+    records = 0
+    chunk_records = 0
+    # Lines of the record being read
+    record = []
+    in_quotes = False
+    for line in binary_file:
+        lines.append(line)
+        size += len(line)
+        if in_quotes:
+            record.append(line)
+        else:
+            record = [line]
+        in_quotes = _in_quotes(record, in_quotes)
+        if not in_quotes:
+            chunk_records += 1
+            if size >= chunk_bytes:
+                yield [records, b''.join(lines)]
+                records += chunk_records
+                lines = []
+                size = 0
+                chunk_records = 0
+    if lines:
+        yield [records, b''.join(lines)]
+
+
+def _init_worker(stage, args, rules, header, collector):
+    # The parent adds up the time of the searches of every chunk and reports the rules over their budget once
+    for pattern in regex_engine.budgeted(rules):
+        pattern.report = False
+    _worker['stage'] = stage
+    _worker['args'] = args
+    _worker['rules'] = rules
+    _worker['header'] = header
+    _worker['collector'] = collector
+
+
+def _run_chunk(row_offset, data):
+    """Return the csv text, stdout, stderr, collector, regex budget totals and error produced by running the worker's
+    stage over one chunk.
+
+    error is None unless the stage raised, in which case the output printed until then is still returned, so the parent
+    can write it before raising error itself.
+    """
+    args = copy.copy(_worker['args'])
+    args.row_offset = row_offset
+    # The stage may modify the header it is given, so every chunk gets its own copy
+    rows = itertools.chain([list(_worker['header'])], csv.reader(io.StringIO(data.decode('UTF-8'), newline='')))
+    output = io.StringIO(newline='')
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    collected = None
+    error = None
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        # Stages report bad input with sys.exit, which is a BaseException
+        try:
+            if _worker['collector'] is None:
+                out_rows = _worker['stage'](rows, args, _worker['rules'])
+            else:
+                collected = _worker['collector']()
+                out_rows = _worker['stage'](rows, args, _worker['rules'], collected)
+            # Drop the header row, the parent writes it once
+            next(out_rows, None)
+            csv.writer(output).writerows(out_rows)
+        except BaseException as raised:
+            error = raised
+            if not isinstance(error, SystemExit):
+                traceback.print_exc()
+    if error is not None:
+        try:
+            pickle.dumps(error)
+        except Exception:
+            error = RuntimeError(repr(error))
+    budget = regex_engine.take_budget(_worker['rules'])
+    return output.getvalue(), stdout.getvalue(), stderr.getvalue(), collected, budget, error
+
+
+def run_chunked(stage, args, rules, input_file, output_file, workers, collector=None, finish=None,
+                chunk_bytes=1 << 20, combine=None):
+    """Run stage over the binary input_file using workers processes and write the csv result to output_file.
+
+    rules are the stage's compiled rules, built once by the caller. output_file is a text file opened with
+    newline=''. When collector is given, it is called to make a new collector for each chunk, and finish is called
+    with the list of all the chunks' collectors once every chunk has been written. When combine is also given, each
+    chunk's collector is merged into the first one with combine(first, collector) as soon as the chunk is written, so
+    only that one is kept and handed to finish.
+    The rule regexes of rules that went over their --regex_budget, counting the searches of every chunk, are reported
+    last.
+    """
+    header = csv.reader(io.StringIO(read_record(input_file).decode('UTF-8'), newline=''))
+    header = next(header, None)
+    if header is None:
+        return
+    # Let the stage produce the output header from the input header
+    header_rows = stage(iter([list(header)]), args, rules)
+    out_header = next(header_rows, None)
+    header_rows.close()
+    if out_header is not None:
+        csv.writer(output_file).writerow(out_header)
+    collected = []
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(stage, args, rules, header, collector)) as executor:
+        pending = deque()
+
+        def write_result(future):
+            text, stdout, stderr, chunk_collected, budget, error = future.result()
+            output_file.write(text)
+            sys.stdout.write(stdout)
+            sys.stderr.write(stderr)
+            regex_engine.add_budget(rules, budget)
+            if error is not None:
+                raise error
+            if combine is not None and collected:
+                combine(collected[0], chunk_collected)
+            else:
+                collected.append(chunk_collected)
+
+        # Keep a couple of chunks per worker in flight so memory stays bounded
+        for chunk in split_records(input_file, chunk_bytes):
+            pending.append(executor.submit(_run_chunk, chunk[0], chunk[1]))
+            if len(pending) >= workers * 2:
+                write_result(pending.popleft())
+        while pending:
+            write_result(pending.popleft())
+    if finish is not None:
+        finish(collected)
+    regex_engine.report_budget(rules)
@@ -0,0 +1,366 @@
+#!/usr/bin/python3
+"""Run several of the csv tools as one pipeline in a single process.
+
+Chaining the scripts with shell pipes parses and writes the csv once per script. A pipeline file lists the stages
+instead, and the run command parses the input once, streams the rows through every stage, and writes the output once.
+
+usage: pyaccounting.py run pipeline.yaml [--profile] [--stats_json stats.json] [--no_cache]
+       pyaccounting.py watch pipeline.yaml [--once]
+
+The run command takes the following optional arguments:
+profile=Print rows in and out, time per phase and the slowest rules of every stage to stderr once the output is
+        written.
+stats_json=Path to write the same statistics to as JSON, with the hits and search time of every rule.
+no_cache=Run every stage, neither reading nor storing cached stage outputs.
+
+The watch command keeps running and runs every csv file that appears in the pipeline's inbox directory through the
+stages, into a file of the same name in the outbox directory. The input file is then moved to the processed directory,
+or to the failed directory when the stages could not process it. The rules of each stage are loaded once and kept in
+memory; they are only loaded again when the contents of one of the stage's rule, filter or split files change, see
+warm_rules.py. A line with the rows written, the time taken and the time since the file arrived is printed for every
+file. Files whose names start with . are ignored, so a file can be written under such a name and renamed once complete.
+Stop the command with Ctrl-C.
+
+The watch command takes the following optional arguments:
+once=Process the files in the inbox and exit instead of waiting for more.
+
+The pipeline file is YAML (or JSON, when the file name ends in .json) with the following keys:
+input=Path to a csv file, or a list of paths that are concatenated as concatenate.py would. Defaults to stdin.
+header_row_count=Number of header rows to skip in each input file after the first. Defaults to 1.
+output=Path to write the output csv file. This file will be overwritten without warning if it exists. Defaults to
+       stdout, in which case anything the stages print is sent to stderr instead.
+stages=List of stages, in order. Each stage maps a script name to the arguments that script takes on the command line,
+       either as a string or as a list. --input, --output, --workers, --profile and --stats_json are not allowed, the
+       pipeline takes care of them.
+cache_dir=Directory to keep the output of every stage in, see stage_cache.py. When the pipeline is run again, the
+          stages up to the first one whose input, arguments or rule files changed are not run again. Only used when
+          the input is read from files. Defaults to ~/.cache/pyaccounting/stages.
+cache_size=Megabytes the cache directory may hold before the least recently used outputs are removed. Defaults to
+           1024.
+inbox=Directory the watch command takes input files from. input, output and the cache are not used by it.
+outbox=Directory the watch command writes the output of each input file to.
+processed_dir=Directory input files are moved to once processed. Defaults to the processed directory in the inbox.
+failed_dir=Directory input files the stages failed on are moved to. Defaults to the failed directory in the inbox.
+poll_interval=Seconds between two looks at the inbox. A file is only read once it has not been modified for this
+              long. Defaults to 1.
+
+Example pipeline file:
+input: [january.csv, february.csv]
+output: import.csv
+stages:
+  - filter: payees.csv --cache_file payees.db
+  - regex_modify_rows: cleanup.csv --warn_nomatch
+  - time_format: dates.csv
+  - remove_columns: 3 4
+  - gnucash_import_prep:
+"""
+import csv
+import argparse
+import contextlib
+import json
+import os
+import shlex
+import sys
+import time
+from collections import OrderedDict
+
+import csv_io
+import edit_headers
+import filter as payee_filter
+import gnucash_import_prep
+import regex_match_to_column
+import regex_modify_rows
+import remove_columns
+import split_rows
+import stage_cache
+import stats
+import time_format
+from concatenate import concatenate_rows
+from warm_rules import WarmRules
+
+author = 'brian.k.smith@gmail.com'
+
+STAGES = OrderedDict([
+    ('edit_headers', edit_headers),
+    ('filter', payee_filter),
+    ('gnucash_import_prep', gnucash_import_prep),
+    ('regex_match_to_column', regex_match_to_column),
+    ('regex_modify_rows', regex_modify_rows),
+    ('remove_columns', remove_columns),
+    ('split_rows', split_rows),
+    ('time_format', time_format),
+])
+
+parser = argparse.ArgumentParser(description='Run the csv tools as a single in-process pipeline.')
+subparsers = parser.add_subparsers(dest='command')
+run_parser = subparsers.add_parser('run', help='Run the stages listed in a pipeline file.')
+run_parser.add_argument('pipeline', help='Path to YAML or JSON pipeline file.')
+stats.add_arguments(run_parser)
+run_parser.add_argument('--no_cache', help='Run every stage without reading or storing cached stage outputs.',
+                        action='store_true')
+watch_parser = subparsers.add_parser('watch', help='Run the stages of a pipeline file on every file put in its inbox,'
+                                                   ' keeping their rules loaded.')
+watch_parser.add_argument('pipeline', help='Path to YAML or JSON pipeline file.')
+watch_parser.add_argument('--once', help='Process the files in the inbox and exit instead of waiting for more.',
+                          action='store_true')
+
+
+def load_pipeline(path):
+    """Return the pipeline configuration dict stored in the YAML or JSON file at path."""
+    with open(path, encoding='UTF-8') as pipeline_file:
+        if path.endswith('.json'):
+            return json.load(pipeline_file)
+        import yaml
+        return yaml.safe_load(pipeline_file)
+
+
+def stage_argv(value):
+    """Return the command line arguments for a stage given as a string, a list, or nothing at all."""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return shlex.split(value)
+    if isinstance(value, (list, tuple)):
+        return [str(arg) for arg in value]
+    return [str(value)]
+
+
+def build_stages(config):
+    """Return a list of [stage name, stage function, parsed arguments, argument list] for each stage in the pipeline
+    configuration.
+
+    Raises ValueError for unknown stages and for stages that try to choose their own input or output.
+    """
+    stages = []
+    for entry in config.get('stages') or []:
+        if isinstance(entry, str):
+            name, value = entry, None
+        elif isinstance(entry, dict) and len(entry) == 1:
+            name, value = list(entry.items())[0]
+        else:
+            raise ValueError('Each stage must name exactly one script: {}'.format(entry))
+        if name not in STAGES:
+            raise ValueError('Unknown stage {}. Known stages are: {}'.format(name, ', '.join(STAGES)))
+        module = STAGES[name]
+        argv = stage_argv(value)
+        args = module.parser.parse_args(argv)
+        if getattr(args, 'input', None) is not None or getattr(args, 'output', None) is not None:
+            raise ValueError('Stage {} may not set --input or --output.'.format(name))
+        if getattr(args, 'book', None) is not None or getattr(args, 'account_input', None) is not None:
+            raise ValueError('Stage {} may not set --book or --account_input.'.format(name))
+        if getattr(args, 'workers', 1) > 1:
+            raise ValueError('Stage {} may not set --workers, pipelines run in a single process.'.format(name))
+        if getattr(args, 'profile', False) or getattr(args, 'stats_json', None):
+            raise ValueError('Stage {} may not set --profile or --stats_json, pass them to the run command.'
+                             .format(name))
+        stages.append([name, module.stage, args, argv])
+    return stages
+
+
+def pipeline_rows(rows, stages, cache=None, keys=None, rules=None):
+    """Return an iterator of the rows produced by passing rows through each stage in turn.
+
+    Stages whose arguments hold a Stats in args.stats have their rows and time recorded. When cache is given, the
+    output of each stage is stored in it under the key at the same position in keys. When rules is given, the stage
+    function of each stage whose entry in rules is not None is passed that entry as its rules.
+    """
+    for i, stage in enumerate(stages):
+        run_stats = getattr(stage[2], 'stats', None)
+        extra = [] if rules is None or rules[i] is None else [rules[i]]
+        if run_stats is None:
+            rows = stage[1](rows, stage[2], *extra)
+        else:
+            rows = run_stats.count_out(stage[1](run_stats.count_in(rows), stage[2], *extra))
+        if cache is not None:
+            rows = cache.recording(keys[i], rows)
+    return rows
+
+
+def stage_keys(config, stages):
+    """Return the stage_cache key of the output of each stage, or None when the input is not read from files."""
+    inputs = config.get('input')
+    if inputs is None:
+        return None
+    if isinstance(inputs, (list, tuple)):
+        key = stage_cache.input_key(inputs, config.get('header_row_count', 1))
+    else:
+        key = stage_cache.input_key([inputs], None)
+    keys = []
+    for stage in stages:
+        key = stage_cache.stage_key(key, stage[0], stage[3], STAGES[stage[0]].parser, stage[2])
+        keys.append(key)
+    return keys
+
+
+def run_pipeline(config, profile=None):
+    """Read the pipeline input, stream it through all the stages, and write the pipeline output.
+
+    profile is the parsed run command, whose --profile and --stats_json options ask for statistics of every stage.
+    """
+    stages = build_stages(config)
+    cache = None
+    keys = None
+    first = 0
+    if stages and not (profile is not None and profile.no_cache):
+        keys = stage_keys(config, stages)
+    if keys is not None:
+        cache = stage_cache.StageCache(config.get('cache_dir'), int(config.get('cache_size', 1024)) << 20)
+        # Start after the last stage whose output is already cached
+        first = next((i + 1 for i in reversed(range(len(stages))) if keys[i] in cache), 0)
+        if first:
+            print('Pipeline cache: reused the output of {:d} of {:d} stages.'.format(first, len(stages)),
+                  file=sys.stderr)
+    profiling = profile is not None and (profile.profile or profile.stats_json)
+    if profiling:
+        for i, stage in enumerate(stages[first:], first):
+            stage[2].stats = stats.Stats('{:d}_{}'.format(i + 1, stage[0]))
+    start = time.perf_counter()
+    inputs = config.get('input')
+    output = config.get('output')
+    with contextlib.ExitStack() as stack:
+        # Set up the source of rows
+        if first:
+            rows = csv.reader(stack.enter_context(cache.open(keys[first - 1])))
+        elif isinstance(inputs, (list, tuple)):
+            rows = concatenate_rows(inputs, config.get('header_row_count', 1))
+        else:
+            # noinspection PyTypeChecker
+            input_file = stack.enter_context(csv_io.open_input(0 if inputs is None else inputs, inputs is not None))
+            rows = csv.reader(input_file)
+        # noinspection PyTypeChecker
+        output_file = stack.enter_context(csv_io.open_output(1 if output is None else output, output is not None))
+        if output is None:
+            # Keep anything the stages print out of the csv output
+            stack.enter_context(contextlib.redirect_stdout(sys.stderr))
+        out_writer = csv.writer(output_file)
+        out_writer.writerows(pipeline_rows(rows, stages[first:], cache, None if keys is None else keys[first:]))
+    running = stages[first:]
+    if profiling and running:
+        # Each stage waited on the one before it, only the first one's wait was spent parsing
+        total = time.perf_counter() - start
+        for i, stage in enumerate(running):
+            stage[2].stats.finish(total if i == len(running) - 1 else None, parse=i == 0)
+        stats.emit(profile, [stage[2].stats for stage in running], total)
+
+
+def warm_stage_rules(stages):
+    """Return a WarmRules for each stage whose script has a load_rules function, None for the other stages."""
+    warm = []
+    for name, _, args, _ in stages:
+        module = STAGES[name]
+        if hasattr(module, 'load_rules'):
+            warm.append(WarmRules(name, module.load_rules, args, stage_cache.positional_files(module.parser, args)))
+        else:
+            warm.append(None)
+    return warm
+
+
+def inbox_files(inbox, settle):
+    """Return the paths of the files in inbox not modified for settle seconds, oldest first, skipping names starting
+    with a dot."""
+    now = time.time()
+    entries = []
+    with os.scandir(inbox) as scan:
+        for entry in scan:
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            modified = entry.stat().st_mtime
+            if now - modified >= settle:
+                entries.append([modified, entry.name, entry.path])
+    return [entry[2] for entry in sorted(entries)]
+
+
+def process_file(path, stages, warm, directories):
+    """Run the file at path through stages into the outbox and move it to the processed or failed directory.
+
+    warm holds the WarmRules of each stage, or None, and directories the outbox, processed and failed directories.
+    Returns the seconds taken, or None when the stages failed on the file.
+    """
+    outbox, processed_dir, failed_dir = directories
+    name = os.path.basename(path)
+    arrived = os.stat(path).st_mtime
+    start = time.perf_counter()
+    # Written under a name the watch command of a pipeline reading the outbox ignores, until it is complete
+    temp_path = os.path.join(outbox, '.{}.tmp'.format(name))
+    try:
+        rules = [None if stage_rules is None else stage_rules.get() for stage_rules in warm]
+        row_count = 0
+        # noinspection PyTypeChecker
+        with csv_io.open_input(path) as input_file, csv_io.open_output(temp_path) as output_file:
+            out_writer = csv.writer(output_file)
+            for row in pipeline_rows(csv.reader(input_file), stages, rules=rules):
+                out_writer.writerow(row)
+                row_count += 1
+        os.replace(temp_path, os.path.join(outbox, name))
+    except (Exception, SystemExit) as error:
+        # Stages raise whatever their libraries raise, such as arrow's ParserError, and exit on rows they cannot
+        # handle. Either way only this file failed, so the watch goes on with the next one.
+        if isinstance(error, SystemExit):
+            error = 'a stage exited with status {}'.format(error.code)
+        print('ERROR: Could not process {}, moving it to {}: {}'.format(name, failed_dir, error), file=sys.stderr)
+        os.replace(path, os.path.join(failed_dir, name))
+        return None
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    os.replace(path, os.path.join(processed_dir, name))
+    seconds = time.perf_counter() - start
+    print('Processed {}: {:d} rows in {:.3f}s, {:.3f}s after it arrived.'
+          .format(name, max(row_count - 1, 0), seconds, time.time() - arrived), file=sys.stderr)
+    return seconds
+
+
+def watch_pipeline(config, once=False):
+    """Process the files put in the pipeline's inbox as they arrive, until interrupted, or only the files already
+    there when once is set."""
+    inbox = config.get('inbox')
+    outbox = config.get('outbox')
+    if inbox is None or outbox is None:
+        raise ValueError('The watch command needs inbox and outbox directories in the pipeline file.')
+    processed_dir = config.get('processed_dir') or os.path.join(inbox, 'processed')
+    failed_dir = config.get('failed_dir') or os.path.join(inbox, 'failed')
+    poll_interval = float(config.get('poll_interval', 1))
+    for directory in [outbox, processed_dir, failed_dir]:
+        os.makedirs(directory, exist_ok=True)
+    stages = build_stages(config)
+    warm = warm_stage_rules(stages)
+    print('Watching {} with {:d} stages.'.format(inbox, len(stages)), file=sys.stderr)
+    latencies = []
+    failed = 0
+    try:
+        while True:
+            for path in inbox_files(inbox, 0 if once else poll_interval):
+                seconds = process_file(path, stages, warm, [outbox, processed_dir, failed_dir])
+                if seconds is None:
+                    failed += 1
+                else:
+                    latencies.append(seconds)
+            if once:
+                break
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        pass
+    loads = sum(stage_rules.loads for stage_rules in warm if stage_rules is not None)
+    print('Processed {:d} files, {:d} failed, {:.3f}s per file on average. Rules were loaded {:d} times.'
+          .format(len(latencies), failed, sum(latencies) / len(latencies) if latencies else 0.0, loads),
+          file=sys.stderr)
+
+
+def main():
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help(sys.stderr)
+        sys.exit(2)
+    try:
+        config = load_pipeline(args.pipeline)
+        if args.command == 'watch':
+            watch_pipeline(config, args.once)
+        else:
+            run_pipeline(config, args)
+    except ValueError as error:
+        print('ERROR: {}'.format(error), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,447 @@
+"""Compile the regular expressions of rule files with a choice of engine, and catch the ones that could run for hours.
+
+Python's re engine backtracks, and some patterns, such as (a+)+$ or (a|a?)+$, take time exponential in the length
+of a value that almost matches. One such rule in a shared rule file can stall a nightly run. Every pattern compiled
+here is checked for the two shapes that cause this:
+- A repeated group containing another unbounded repeat, such as (a+)+ or ([a-z]+ ?)*, unless something the inner
+  repeat cannot match must appear between its repetitions, as in (\\d+,)+.
+- A repeated group with alternatives that can start with the same character, such as (a|a?)+ or (a|b|ab)*.
+A warning is printed for each pattern that has one.
+
+The engine decides how patterns are run:
+re=Python's re for every pattern, the default.
+auto=re2 for the patterns the check warns about, re for the rest. re2 runs in time linear in the length of the value.
+re2=re2 for every pattern it supports, re for the rest.
+re2 is the google-re2 package; without it, auto uses re for every pattern. re2 does not support backreferences,
+lookarounds, possessive repeats, atomic groups, \\Z or verbose patterns, so patterns using them always run with re.
+Under re2, \\d, \\w, \\s and \\b only match ASCII characters, and $ only matches at the very end of a value.
+
+A time budget in seconds can also be given per rule. A search that is already running cannot be interrupted, so the
+time of every search is added up instead. When the stage finishes, report_budget prints a warning for each rule whose
+searches took longer than its budget in total, with that total, its search count and its slowest search. With several
+workers, the totals of every chunk are added up in the parent process, which reports them once all chunks are written.
+
+Scripts take two options to choose these:
+regex_engine=re, auto or re2. Defaults to re.
+regex_budget=Seconds of searching allowed per rule before a warning is printed. Defaults to no budget.
+"""
+import argparse
+import re
+import sys
+import time
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+author = 'brian.k.smith@gmail.com'
+
+ENGINES = ['re', 'auto', 're2']
+
+clock = time.perf_counter
+
+_BACKTRACKING_REPEATS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+# Only parsed by Python 3.11 and later
+_POSSESSIVE_REPEAT = getattr(sre_parse, 'POSSESSIVE_REPEAT', None)
+_ATOMIC_GROUP = getattr(sre_parse, 'ATOMIC_GROUP', None)
+_NO_BACKTRACKING = tuple(op for op in (_POSSESSIVE_REPEAT, _ATOMIC_GROUP) if op is not None)
+_ASSERTS = (sre_parse.ASSERT, sre_parse.ASSERT_NOT)
+# Repeats with a higher bound than this backtrack like unbounded ones
+_LONG_REPEAT = 20
+# Character ranges wider than this are treated as matching anything
+_WIDE_RANGE = 512
+# Character classes are sets of code points and of the names of these categories
+_CATEGORIES = {sre_parse.CATEGORY_DIGIT: 'd', sre_parse.CATEGORY_WORD: 'w', sre_parse.CATEGORY_SPACE: 's'}
+_CATEGORY_REGEXES = {'d': re.compile(r'\d'), 'w': re.compile(r'\w'), 's': re.compile(r'\s')}
+_DISJOINT_CATEGORIES = [{'d', 's'}, {'w', 's'}]
+
+
+def engine_arg(value):
+    """Return a --regex_engine value, checking that re2 is installed when it is asked for."""
+    if value not in ENGINES:
+        raise argparse.ArgumentTypeError('expected one of {}, got {}'.format(', '.join(ENGINES), value))
+    if value == 're2' and re2 is None:
+        raise argparse.ArgumentTypeError('re2 needs the google-re2 package, install it with pip install google-re2')
+    return value
+
+
+def add_arguments(parser):
+    """Add the --regex_engine and --regex_budget options to an argparse parser."""
+    parser.add_argument('--regex_engine', help='Engine running the rule regexes: re, auto (re2 for patterns that may'
+                                               ' backtrack exponentially) or re2. Defaults to re.',
+                        default='re', type=engine_arg)
+    parser.add_argument('--regex_budget', help='Seconds of searching allowed per rule regex before a warning is'
+                                               ' printed. Defaults to no budget.', type=float)
+
+
+def _fold(chars, flags):
+    """Return the set chars with the other case of each letter added when flags ignore case."""
+    if chars is None or not flags & re.IGNORECASE:
+        return chars
+    folded = set(chars)
+    for char in chars:
+        if isinstance(char, int):
+            folded.add(ord(chr(char).lower()))
+            folded.add(ord(chr(char).upper()))
+    return folded
+
+
+def _class_chars(items, flags):
+    """Return the set of characters a parsed character class matches, or None when it is too wide to list."""
+    chars = set()
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            chars.add(av)
+        elif op is sre_parse.RANGE and av[1] - av[0] <= _WIDE_RANGE:
+            chars.update(range(av[0], av[1] + 1))
+        elif op is sre_parse.CATEGORY and av in _CATEGORIES:
+            chars.add(_CATEGORIES[av])
+        else:
+            # Negated classes, negated categories and wide ranges
+            return None
+    return _fold(chars, flags)
+
+
+def _nullable(items):
+    """Return whether a parsed (sub)pattern can match the empty string."""
+    for op, av in items:
+        if op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.ANY, sre_parse.IN):
+            return False
+        if op is sre_parse.SUBPATTERN and not _nullable(av[-1]):
+            return False
+        if op is sre_parse.BRANCH and not any(_nullable(branch) for branch in av[1]):
+            return False
+        if (op in _BACKTRACKING_REPEATS or op is _POSSESSIVE_REPEAT) and av[0] > 0 and not _nullable(av[2]):
+            return False
+        if op is _ATOMIC_GROUP and not _nullable(av):
+            return False
+    return True
+
+
+def _chars(items, flags, first=False):
+    """Return the set of characters a parsed (sub)pattern can consume, or None when it can consume anything.
+
+    The set holds code points and the names d, w and s of the \\d, \\w and \\s categories.
+
+    With first set, only the characters it can start with.
+    """
+    chars = set()
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            item_chars = _fold({av}, flags)
+        elif op is sre_parse.IN:
+            item_chars = _class_chars(av, flags)
+        elif op in (sre_parse.ANY, sre_parse.NOT_LITERAL):
+            item_chars = None
+        elif op is sre_parse.SUBPATTERN:
+            item_chars = _chars(av[-1], flags, first)
+        elif op is sre_parse.BRANCH:
+            item_chars = set()
+            for branch in av[1]:
+                branch_chars = _chars(branch, flags, first)
+                if branch_chars is None:
+                    item_chars = None
+                    break
+                item_chars |= branch_chars
+        elif op in _BACKTRACKING_REPEATS or op is _POSSESSIVE_REPEAT:
+            item_chars = _chars(av[2], flags, first)
+        elif op is _ATOMIC_GROUP:
+            item_chars = _chars(av, flags, first)
+        elif op is sre_parse.AT or op in _ASSERTS:
+            # Zero width
+            continue
+        else:
+            # Backreferences and anything else not worth analyzing
+            return None
+        if item_chars is None:
+            return None
+        chars |= item_chars
+        if first and not _nullable([(op, av)]):
+            break
+    return chars
+
+
+def _disjoint(chars, other):
+    """Return whether no character is in both sets returned by _chars."""
+    if chars is None or other is None:
+        return False
+    codes = {char for char in chars if isinstance(char, int)}
+    other_codes = {char for char in other if isinstance(char, int)}
+    if not codes.isdisjoint(other_codes):
+        return False
+    for categories, other_codes in [[chars - codes, other_codes], [other - other_codes, codes]]:
+        for category in categories:
+            if any(_CATEGORY_REGEXES[category].match(chr(code)) for code in other_codes):
+                return False
+    for category in chars - codes:
+        for other_category in other - other_codes:
+            if {category, other_category} not in _DISJOINT_CATEGORIES:
+                return False
+    return True
+
+
+def _unwrap(items):
+    """Return the items of a parsed (sub)pattern that is nothing but a group, or the items themselves."""
+    while len(items) == 1 and items[0][0] is sre_parse.SUBPATTERN:
+        items = items[0][1][-1]
+    return items
+
+
+def _separated(body, inner, flags):
+    """Return whether every repetition of body must consume a character the inner repeat cannot match."""
+    inner_chars = _chars(inner, flags)
+    if inner_chars is None:
+        return False
+    for item in _unwrap(body):
+        if _nullable([item]):
+            continue
+        if _disjoint(_chars([item], flags), inner_chars):
+            return True
+    return False
+
+
+def _risk(items, flags, repeated):
+    """Return a description of the first construct of a parsed (sub)pattern that can backtrack exponentially, or None.
+
+    repeated is the list of bodies of the unbounded repeats the items are nested in.
+    """
+    for op, av in items:
+        if op in _BACKTRACKING_REPEATS:
+            body = av[2]
+            if av[1] == sre_parse.MAXREPEAT or av[1] > _LONG_REPEAT:
+                for outer in repeated:
+                    if not _separated(outer, body, flags):
+                        return 'a repeat nested inside another repeat can split the same text in many ways'
+                reason = _risk(body, flags, repeated + [body])
+            else:
+                reason = _risk(body, flags, repeated)
+        elif op is sre_parse.BRANCH:
+            if repeated:
+                starts = [_chars(branch, flags, first=True) for branch in av[1]]
+                for i, chars in enumerate(starts):
+                    if not all(_disjoint(chars, other) for other in starts[i + 1:]):
+                        return 'alternatives inside a repeat can start with the same character'
+            reason = None
+            for branch in av[1]:
+                reason = _risk(branch, flags, repeated)
+                if reason is not None:
+                    break
+        elif op is sre_parse.SUBPATTERN:
+            reason = _risk(av[-1], flags, repeated)
+        elif op in _ASSERTS:
+            reason = _risk(av[1], flags, [])
+        else:
+            # Literals, classes, anchors, and possessive repeats and atomic groups, which never backtrack
+            continue
+        if reason is not None:
+            return reason
+    return None
+
+
+def backtracking_risk(pattern, flags=0):
+    """Return why pattern could take time exponential in the length of the text it searches, or None when it cannot.
+
+    Patterns that do not parse return None, compiling them reports the error.
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except (re.error, OverflowError, RecursionError):
+        return None
+    return _risk(parsed, flags | parsed.state.flags, [])
+
+
+def _re2_unsupported(items):
+    """Return whether a parsed (sub)pattern uses something re2 does not support."""
+    for op, av in items:
+        if op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS) + _ASSERTS + _NO_BACKTRACKING:
+            return True
+        if op is sre_parse.AT and av is sre_parse.AT_END_STRING:
+            return True
+        for arg in (av if isinstance(av, (list, tuple)) else [av]):
+            if isinstance(arg, sre_parse.SubPattern) and _re2_unsupported(arg):
+                return True
+            if isinstance(arg, list):
+                for branch in arg:
+                    if isinstance(branch, sre_parse.SubPattern) and _re2_unsupported(branch):
+                        return True
+    return False
+
+
+def re2_supported(pattern, flags=0):
+    """Return whether re2 can run pattern with flags."""
+    if not isinstance(pattern, str) or flags & ~(re.IGNORECASE | re.MULTILINE | re.DOTALL | re.UNICODE):
+        return False
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except (re.error, OverflowError, RecursionError):
+        return False
+    if parsed.state.flags & (re.VERBOSE | re.LOCALE | re.ASCII):
+        return False
+    return not _re2_unsupported(parsed)
+
+
+class Re2Pattern:
+    """Pattern run by re2 that looks like a compiled Python regex.
+
+    pattern, flags, groups and groupindex are those of the Python regex, so code analyzing patterns sees the original.
+    """
+
+    engine = 're2'
+
+    def __init__(self, pattern, flags=0):
+        self.regex = re.compile(pattern, flags)
+        self.pattern = pattern
+        self.flags = self.regex.flags
+        self.groups = self.regex.groups
+        self.groupindex = self.regex.groupindex
+        inline = ''.join(letter for flag, letter in [(re.IGNORECASE, 'i'), (re.MULTILINE, 'm'), (re.DOTALL, 's')]
+                         if flags & flag)
+        self.re2 = re2.compile('(?{}){}'.format(inline, pattern) if inline else pattern)
+        self.search = self.re2.search
+        self.match = self.re2.match
+        self.fullmatch = self.re2.fullmatch
+        self.findall = self.re2.findall
+        self.finditer = self.re2.finditer
+        self.sub = self.re2.sub
+        self.subn = self.re2.subn
+        self.split = self.re2.split
+
+    def __reduce__(self):
+        return Re2Pattern, (self.pattern, self.flags)
+
+    def __repr__(self):
+        return 're2.compile({!r})'.format(self.pattern)
+
+
+class BudgetedPattern:
+    """Compiled regex that adds up the time its searches take, for report_budget to check against a budget.
+
+    Everything other than the search functions is passed through to the compiled regex. report is cleared in worker
+    processes, whose totals are reported by the parent instead.
+    """
+
+    def __init__(self, regex, budget):
+        self.regex = regex
+        self.budget = budget
+        self.report = True
+        self.reset()
+
+    def reset(self):
+        """Start adding up the time of the searches again."""
+        self.seconds = 0.0
+        self.slowest = 0.0
+        self.calls = 0
+
+    def __reduce__(self):
+        return BudgetedPattern, (self.regex, self.budget)
+
+    def __getattr__(self, name):
+        return getattr(self.regex, name)
+
+    def __str__(self):
+        return str(self.regex)
+
+    def _timed(self, func, args):
+        start = clock()
+        result = func(*args)
+        seconds = clock() - start
+        self.seconds += seconds
+        self.slowest = max(self.slowest, seconds)
+        self.calls += 1
+        return result
+
+    def search(self, *args):
+        return self._timed(self.regex.search, args)
+
+    def match(self, *args):
+        return self._timed(self.regex.match, args)
+
+    def fullmatch(self, *args):
+        return self._timed(self.regex.fullmatch, args)
+
+    def findall(self, *args):
+        return self._timed(self.regex.findall, args)
+
+
+def budgeted(rules):
+    """Return the BudgetedPatterns held by rules, looking inside lists, tuples and dicts and through the TimedPatterns
+    of stats, in the same order every time."""
+    found = []
+    if isinstance(rules, (list, tuple)):
+        for rule in rules:
+            found.extend(budgeted(rule))
+    elif isinstance(rules, dict):
+        for rule in rules.values():
+            found.extend(budgeted(rule))
+    elif not isinstance(rules, str):
+        while rules is not None and not isinstance(rules, BudgetedPattern):
+            rules = getattr(rules, 'regex', None)
+        if rules is not None:
+            found.append(rules)
+    return found
+
+
+def report_budget(rules):
+    """Print a warning for each rule regex in rules whose searches took longer than its budget, then start adding up
+    the time of its searches again."""
+    for pattern in budgeted(rules):
+        if not pattern.report:
+            continue
+        if pattern.seconds > pattern.budget:
+            print('WARN: Regex {} took {:.3f}s in {:d} searches, over its budget of {:g}s. The slowest search took'
+                  ' {:.3f}s.'.format(pattern.regex.pattern, pattern.seconds, pattern.calls, pattern.budget,
+                                     pattern.slowest), file=sys.stderr)
+        pattern.reset()
+
+
+def take_budget(rules):
+    """Return the [seconds, search count, slowest search] of each BudgetedPattern in rules, and reset them."""
+    totals = []
+    for pattern in budgeted(rules):
+        totals.append([pattern.seconds, pattern.calls, pattern.slowest])
+        pattern.reset()
+    return totals
+
+
+def add_budget(rules, totals):
+    """Add totals returned by take_budget for a copy of rules, such as a worker process's, to the patterns in rules."""
+    for pattern, (seconds, calls, slowest) in zip(budgeted(rules), totals):
+        pattern.seconds += seconds
+        pattern.calls += calls
+        pattern.slowest = max(pattern.slowest, slowest)
+
+
+def compile(pattern, flags=0, args=None):
+    """Return pattern compiled by the engine args.regex_engine, timed against args.regex_budget.
+
+    Prints a warning when the pattern could backtrack exponentially. Raises re.error like re.compile when the pattern
+    is invalid.
+    """
+    engine = getattr(args, 'regex_engine', 're') or 're'
+    budget = getattr(args, 'regex_budget', None)
+    regex = re.compile(pattern, flags)
+    risk = backtracking_risk(pattern, flags)
+    use_re2 = re2 is not None and engine != 're' and (engine == 're2' or risk is not None) and \
+        re2_supported(pattern, flags)
+    if risk is not None:
+        if use_re2:
+            action = 'running it with re2'
+        elif engine == 're':
+            action = 'use --regex_engine auto to run it with re2'
+        elif re2 is None:
+            action = 'install google-re2 to run it with re2'
+        else:
+            action = 're2 does not support it'
+        print('WARN: Regex {} may take time exponential in the length of a value, {}; {}.'
+              .format(pattern, risk, action), file=sys.stderr)
+    if use_re2:
+        regex = Re2Pattern(pattern, flags)
+    if budget is not None:
+        regex = BudgetedPattern(regex, budget)
+    return regex
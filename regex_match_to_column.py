@@ -15,10 +15,24 @@ input=Path to a csv file to read data from. The first row should contain column
 output=Path to write the output csv file. This file will be overwritten without warning if it exists.
 findall=Use the supplied regular expressions in findall mode, where it is used to find all non-overlapping matches,
         outputting a semicolon-separated list in the designated column.
+workers=Number of worker processes to split the input between. Defaults to 1.
+columnar=Process the input in batches of rows, running each regex once per distinct value in its column. The output is
+         the same, but files with many repeated values are processed much faster.
+batch_size=Number of rows per batch in columnar mode. Defaults to 10000.
+regex_engine=Engine running the filter regexes: re, auto or re2, see regex_engine.py. Defaults to re.
+regex_budget=Seconds of searching allowed per filter regex before a warning names it. Defaults to no budget.
+profile=Print rows and time per phase to stderr once the output is written.
+stats_json=Path to write rows and time per phase to as JSON.
 """
 import csv
 import argparse
-import re
+import functools
+
+import csv_io
+import regex_engine
+import stats
+from columnar import ColumnFunction, columnar_rows
+from parallel import run_chunked
 
 author = 'brian.k.smith@gmail.com'
 
@@ -29,64 +43,124 @@ parser.add_argument('--input', help='Path to csv input file. Defaults to stdin.'
 parser.add_argument('--output', help='Path to csv output file. This file will be overwritten if it exists. Defaults'
                                      ' to stdout.')
 parser.add_argument('--findall', help='Operate in findall mode', action='store_true')
+parser.add_argument('--workers', help='Number of worker processes to split the input between. Defaults to 1.',
+                    default=1, type=int)
+parser.add_argument('--columnar', help='Apply each regex once per distinct column value in batches of rows.',
+                    action='store_true')
+parser.add_argument('--batch_size', help='Number of rows per batch in columnar mode. Defaults to 10000.',
+                    default=10000, type=int)
+regex_engine.add_arguments(parser)
+stats.add_arguments(parser)
+
+
+def load_filters(filter_path, args=None):
+    """Return the filters in the filter file as a list of [column number, compiled regex, list of headers].
 
-args = parser.parse_args()
-
-# Take care of any default setup needed
-close_input = True
-if args.input is None:
-    close_input = False
-    args.input = 0
-close_output = True
-if args.output is None:
-    close_output = False
-    args.output = 1
-
-# Open required files
-# noinspection PyTypeChecker
-with open(args.input, newline='', encoding='UTF-8', closefd=close_input) as input_file, open(args.filter, newline='')\
-        as filter_file, open(args.output, mode='w', newline='', closefd=close_output) as output_file:
-    in_reader = csv.reader(input_file)
-    filter_reader = csv.reader(filter_file)
-    out_writer = csv.writer(output_file)
-    # Set up filters array
+    The regexes are compiled with the engine and budget chosen by args, see regex_engine.compile.
+    """
     filters = []
-    filter_headers = next(filter_reader)
-    for filter_row in filter_reader:
-        filters.append([int(filter_row[0]), re.compile(filter_row[1]), filter_row[2].split(' ')])
+    with open(filter_path, newline='') as filter_file:
+        filter_reader = csv.reader(filter_file)
+        filter_headers = next(filter_reader)
+        for filter_row in filter_reader:
+            filters.append([int(filter_row[0]), regex_engine.compile(filter_row[1], 0, args), filter_row[2].split(' ')])
+    return filters
+
+
+def load_rules(args):
+    """Return the compiled filters used by stage."""
+    return load_filters(args.filter, args)
+
+
+def filter_cells(filt, value, findall):
+    """Return the list of cells added for the headers of filt when its regex is applied to value."""
+    cells = []
+    if findall:
+        matches = filt[1].findall(value)
+        group = 0
+        for header in filt[2]:
+            group += 1
+            if matches is None:
+                cells.append("")
+            else:
+                if filt[1].groups == 1:
+                    cells.append(";".join(matches))
+                else:
+                    grp_matches = []
+                    for m in matches:
+                        grp_matches.append(m[group])
+                    cells.append(";".join(grp_matches))
+    else:
+        match = filt[1].match(value)
+        group = 0
+        for header in filt[2]:
+            group += 1
+            if match is None:
+                cells.append("")
+            else:
+                cells.append(match.group(group))
+    return cells
+
+
+def stage(rows, args, rules=None):
+    """Yield the header row and then each row with a column added per header of each filter.
+
+    rows is an iterator of csv rows whose first row contains the column headers. rules is the result of
+    load_rules(args), built here when not given.
+    """
+    rows = iter(rows)
+    filters = rules if rules is not None else load_rules(args)
     # Set up output file with input headers and headers added by each regex
-    output_headers = next(in_reader)
+    output_headers = next(rows, None)
+    if output_headers is None:
+        return
     for filt in filters:
         for header in filt[2]:
             output_headers.append(header)
-    out_writer.writerow(output_headers)
-    # Iterate through input
-    for row in in_reader:
-        out_row = row
-        # Perform each of the requested regex matches on this row
+    yield output_headers
+    if getattr(args, 'columnar', False):
+        columns = []
         for filt in filters:
-            if args.findall:
-                matches = filt[1].findall(row[filt[0]])
-                group = 0
-                for header in filt[2]:
-                    group += 1
-                    if matches is None:
-                        out_row.append("")
-                    else:
-                        if filt[1].groups == 1:
-                            out_row.append(";".join(matches))
-                        else:
-                            grp_matches = []
-                            for m in matches:
-                                grp_matches.append(m[group])
-                            out_row.append(";".join(grp_matches))
-            else:
-                match = filt[1].match(row[filt[0]])
-                group = 0
-                for header in filt[2]:
-                    group += 1
-                    if match is None:
-                        out_row.append("")
-                    else:
-                        out_row.append(match.group(group))
-        out_writer.writerow(out_row)
+            columns.append([filt[0], ColumnFunction(functools.partial(filter_cells, filt, findall=args.findall))])
+        yield from columnar_rows(rows, columns, args.batch_size)
+    else:
+        # Iterate through input
+        for row in rows:
+            out_row = row
+            # Perform each of the requested regex matches on this row
+            for filt in filters:
+                out_row.extend(filter_cells(filt, row[filt[0]], args.findall))
+            yield out_row
+    regex_engine.report_budget(filters)
+
+
+def main():
+    args = parser.parse_args()
+    stats.setup(parser, args, 'regex_match_to_column')
+
+    # Take care of any default setup needed
+    close_input = True
+    if args.input is None:
+        close_input = False
+        args.input = 0
+    close_output = True
+    if args.output is None:
+        close_output = False
+        args.output = 1
+
+    if args.workers > 1:
+        # noinspection PyTypeChecker
+        with csv_io.open_input(args.input, close_input, binary=True) as input_file,\
+                csv_io.open_output(args.output, close_output) as output_file:
+            run_chunked(stage, args, load_rules(args), input_file, output_file, args.workers)
+        return
+
+    # Open required files
+    # noinspection PyTypeChecker
+    with csv_io.open_input(args.input, close_input) as input_file,\
+            csv_io.open_output(args.output, close_output) as output_file:
+        stats.run_stage(stage, args, input_file, output_file)
+
+
+if __name__ == '__main__':
+    main()
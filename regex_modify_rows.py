@@ -10,12 +10,28 @@ filter=Path to a csv file containing columns: input column name, regex, operatio
 The script takes the following optional arguments:
 input=Path to a csv file containing the designated input columns.
 output=Path to write the output csv file. This file will be overwritten without warning if it exists.
+cache_size=Number of distinct values per input column whose matching filters are remembered in memory. 0 disables the
+           cache.
+cache_file=Path to a sqlite file where matching results are kept between runs. Results are discarded automatically when
+           the filter file changes.
+workers=Number of worker processes to split the input between. Defaults to 1.
+explain=Print the plan the filters are compiled into for the input's headers instead of processing the input.
+regex_engine=Engine running the filter regexes: re, auto or re2, see regex_engine.py. Defaults to re.
+regex_budget=Seconds of searching allowed per filter regex before a warning names it. Defaults to no budget.
+profile=Print rows, time per phase and the slowest filters to stderr once the output is written.
+stats_json=Path to write rows, time per phase and the hits and search time of every filter to as JSON.
 """
 import csv
 import argparse
-import re
 import sys
 
+import csv_io
+import regex_engine
+import stats
+from match_cache import MatchCache
+from parallel import run_chunked
+from rule_matcher import RuleMatcher
+
 author = 'brian.k.smith@gmail.com'
 
 parser = argparse.ArgumentParser(description='Modify rows where a column matches a regex in a variety of ways.',
@@ -38,86 +54,289 @@ parser.add_argument('--output', help='Path to csv output file. This file will be
                                      ' to stdout.')
 parser.add_argument('--verbose', help='Be chatty about what is happening on stderr', action='store_true')
 parser.add_argument('--warn_nomatch', help='Complain on stderr if no filter matched a row', action='store_true')
+parser.add_argument('--cache_size', help='Number of distinct values to remember matching filters for. 0 disables the'
+                                         ' cache. Defaults to 65536.', default=65536, type=int)
+parser.add_argument('--cache_file', help='Path to sqlite file used to remember matching filters between runs.')
+parser.add_argument('--workers', help='Number of worker processes to split the input between. Defaults to 1.',
+                    default=1, type=int)
+parser.add_argument('--explain', help='Print the plan the filters are compiled into instead of processing the input.',
+                    action='store_true')
+regex_engine.add_arguments(parser)
+stats.add_arguments(parser)
 
-args = parser.parse_args()
-
-# Take care of any default setup needed
-close_input = True
-if args.input is None:
-    close_input = False
-    args.input = 0
-close_output = True
-if args.output is None:
-    close_output = False
-    args.output = 1
-
-# Open required files
-# noinspection PyTypeChecker
-with open(args.input, newline='', encoding='UTF-8', closefd=close_input) as input_file, open(args.filter, newline='')\
-        as filter_file, open(args.output, mode='w', newline='', closefd=close_output) as output_file:
-    in_reader = csv.reader(input_file)
-    filter_reader = csv.DictReader(filter_file)
-    out_writer = csv.writer(output_file)
-    # Set up initial output file headers with input file headers
-    input_headers = next(in_reader)
-    output_headers = input_headers
-    # Set up filters array. 0: input column name, 1: input column number, 2: regex, 3: operation, 4: operation column
-    # name, 5: operation column number in output, 6: operation data
-    filters = []
-    filter_row_counter = 0
-    for filter_row in filter_reader:
+
+def load_rules(args):
+    """Return [filter rows, column matchers, cache], the compiled form of the filter file used by stage.
+
+    Each filter row is a list of 0: input column name, 1: regex, 2: operation, 3: operation column name, 4: operation
+    data. Each column matcher is a list of input column name and a function returning the filter rows matching a value.
+    """
+    filter_rows = []
+    for column, regex, operation, operation_column, data in csv_io.read_columns(
+            args.filter, ['input column name', 'regex', 'operation', 'operation column name', 'operation data']):
+        filter_rows.append([column, regex_engine.compile(regex, 0, args), operation, operation_column, data])
+    if getattr(args, 'stats', None) is not None:
+        for filter_row, pattern in zip(filter_rows, args.stats.add_rules([row[1] for row in filter_rows])):
+            filter_row[1] = pattern
+    # Group the filters by the column they examine so each column value is matched against all its filters at once
+    column_filters = {}
+    for filter_index, filter_row in enumerate(filter_rows):
+        column_filters.setdefault(filter_row[0], []).append(filter_index)
+    column_matchers = []
+    for column, filter_indexes in column_filters.items():
+        column_matchers.append([column,
+                                RuleMatcher([filter_rows[i][1] for i in filter_indexes], filter_indexes).matches])
+    cache = MatchCache(args.filter, args.cache_size, args.cache_file, getattr(args, 'regex_engine', 're'))
+    return [filter_rows, column_matchers, cache]
+
+
+class RulePlan:
+    """Execution plan of the filters for a file with the given headers.
+
+    Each column value is matched once against all the filters on that column. Rows matching a drop filter are dropped
+    before any other filter runs, repeating only the messages the filters before the drop would have printed. The
+    remaining filters run in file order as closures bound to their column numbers and data.
+    """
+
+    def __init__(self, filter_rows, column_matchers, output_headers, verbose=False):
         # Add any needed new column headers
-        if filter_row['operation'] == 'append':
-            output_headers.append(filter_row['operation column name'])
-        filters.append([filter_row['input column name'], output_headers.index(filter_row['input column name']),
-                        re.compile(filter_row['regex']), filter_row['operation'],
-                        filter_row['operation column name'], output_headers.index(filter_row['operation column name']),
-                        filter_row['operation data']])
-        filter_row_counter += 1
-    # Iterate through input
-    out_writer.writerow(output_headers)
-    row_count = 0
-    for row in in_reader:
-        row_count += 1
-        out_row = row
-        row_dict = dict(zip(input_headers, row))
-        # Perform each of the requested modification operations on this row
-        skip_row = False
-        match_count = 0
-        for filt in filters:
-            in_val = row_dict[filt[0]]
-            match = filt[2].search(in_val)
-            # Do the thing we were told to do when there was a match
-            if match:
-                match_count += 1
-                if filt[3] == 'drop':
-                    skip_row = True
-                    if args.verbose:
-                        print('Dropping row {:d} due to match of {} with {}. No other filters will be processed for'
-                              ' this row.'.format(row_count, filt[2].pattern, in_val), file=sys.stderr)
-                    break
-                elif filt[3] == 'warn':
-                    print('row {:d} matched {} with {}'.format(row_count, filt[2].pattern, in_val),
-                          file=sys.stderr)
-                elif filt[3] == 'modify':
-                    if args.verbose:
-                        print('Setting row {:d} column {} to {} due to match of {} with {}'
-                              .format(row_count, filt[4], filt[6], filt[2].pattern, in_val), file=sys.stderr)
-                    out_row[filt[5]] = filt[6]
-                elif filt[3] == 'append':
-                    if args.verbose:
-                        print('Appending row {:d} with {} due to match of {} with {}'
-                              .format(row_count, filt[6], filt[2].pattern, in_val), file=sys.stderr)
-                    out_row.append(filt[6])
-                else:
-                    print('ERROR! Operation {} is not supported.'
-                          .format(filt[3]), file=sys.stderr)
-                    sys.exit(1)
-            # Sometimes we need to do things to rows that don't match
+        for filter_row in filter_rows:
+            if filter_row[2] == 'append':
+                output_headers.append(filter_row[3])
+        self.headers = list(output_headers)
+        self.filter_rows = filter_rows
+        self.columns = [column_matcher[0] for column_matcher in column_matchers]
+        self.matchers = [column_matcher[1] for column_matcher in column_matchers]
+        slots = {column: slot for slot, column in enumerate(self.columns)}
+        self.drops = {}
+        # Messages printed by each matched filter, and the operations applied to rows that are kept
+        self.messages = []
+        self.actions = []
+        self.append_count = 0
+        for filter_index, filter_row in enumerate(filter_rows):
+            slot = slots[filter_row[0]]
+            message, action = self.bind(filter_row, slot, output_headers.index(filter_row[3]), verbose)
+            self.messages.append(message)
+            if filter_row[2] == 'drop':
+                self.drops[filter_index] = slot
             else:
-                if filt[3] == 'append':
-                    out_row.append('')
-        if not skip_row:
-            out_writer.writerow(out_row)
-        if args.warn_nomatch and match_count == 0:
-            print('No match at row {:d}: {} '.format(row_count, row), file=sys.stderr)
+                self.actions.append([filter_index, action, filter_row[2] == 'append'])
+                if filter_row[2] == 'append':
+                    self.append_count += 1
+        self._indexes = {}
+
+    @staticmethod
+    def bind(filter_row, slot, out_index, verbose):
+        """Return [message, action] functions of filter_row, called with (row number, column values[, row])."""
+        pattern = filter_row[1].pattern
+        operation = filter_row[2]
+        data = filter_row[4]
+
+        def no_message(row_count, values):
+            pass
+
+        if operation == 'drop':
+            def message(row_count, values):
+                print('Dropping row {:d} due to match of {} with {}. No other filters will be processed for this row.'
+                      .format(row_count, pattern, values[slot]), file=sys.stderr)
+            return [message if verbose else no_message, None]
+        if operation == 'warn':
+            def message(row_count, values):
+                print('row {:d} matched {} with {}'.format(row_count, pattern, values[slot]), file=sys.stderr)
+
+            def action(row_count, values, row):
+                message(row_count, values)
+            return [message, action]
+        if operation == 'modify':
+            def message(row_count, values):
+                print('Setting row {:d} column {} to {} due to match of {} with {}'
+                      .format(row_count, filter_row[3], data, pattern, values[slot]), file=sys.stderr)
+
+            def action(row_count, values, row):
+                row[out_index] = data
+            if verbose:
+                def action(row_count, values, row):
+                    message(row_count, values)
+                    row[out_index] = data
+            return [message if verbose else no_message, action]
+        if operation == 'append':
+            def message(row_count, values):
+                print('Appending row {:d} with {} due to match of {} with {}'
+                      .format(row_count, data, pattern, values[slot]), file=sys.stderr)
+
+            def action(row_count, values, row):
+                row.append(data)
+            if verbose:
+                def action(row_count, values, row):
+                    message(row_count, values)
+                    row.append(data)
+            return [message if verbose else no_message, action]
+
+        # Unsupported operations are only an error once they match a row
+        def message(row_count, values):
+            print('ERROR! Operation {} is not supported.'.format(operation), file=sys.stderr)
+            sys.exit(1)
+        return [message, lambda row_count, values, row: message(row_count, values)]
+
+    def value_indexes(self, width):
+        """Return the number of the column holding each matched column's value in rows of width columns.
+
+        Like a dict of the headers zipped with the row, the last column with a name wins. Raises KeyError when a
+        column is missing.
+        """
+        indexes = self._indexes.get(width)
+        if indexes is None:
+            headers = self.headers[:width]
+            indexes = []
+            for column in self.columns:
+                if column not in headers:
+                    raise KeyError(column)
+                indexes.append(len(headers) - 1 - headers[::-1].index(column))
+            self._indexes[width] = indexes
+        return indexes
+
+    def explain(self):
+        """Return the plan as lines of text."""
+        lines = ['Columns, each value matched once against all of its filters:']
+        for column, index in zip(self.columns, self.value_indexes(len(self.headers))):
+            rules = [str(i + 1) for i, filter_row in enumerate(self.filter_rows) if filter_row[0] == column]
+            lines.append('  {} (column {:d}): filters {}'.format(column, index, ', '.join(rules)))
+        lines.append('Drop filters, checked before any other filter runs:')
+        for filter_index in sorted(self.drops):
+            filter_row = self.filter_rows[filter_index]
+            lines.append('  {:d}: drop when {} matches {}'.format(filter_index + 1, filter_row[0],
+                                                                   filter_row[1].pattern))
+        lines.append('Filters applied in order to rows that are kept:')
+        for filter_index, action, is_append in self.actions:
+            filter_row = self.filter_rows[filter_index]
+            column = '{} (column {:d})'.format(filter_row[3], self.headers.index(filter_row[3]))
+            if filter_row[2] == 'warn':
+                operation = 'warn'
+            elif filter_row[2] == 'modify':
+                operation = 'set {} to {!r}'.format(column, filter_row[4])
+            elif is_append:
+                operation = 'append {} as {!r}, or an empty value without a match,'.format(column, filter_row[4])
+            else:
+                operation = 'fail on unsupported operation {}'.format(filter_row[2])
+            lines.append('  {:d}: {} when {} matches {}'.format(filter_index + 1, operation, filter_row[0],
+                                                                 filter_row[1].pattern))
+        return lines
+
+
+def stage(rows, args, rules=None):
+    """Yield the output header row and then each row that was not dropped, modified by the matching filters.
+
+    rows is an iterator of csv rows whose first row contains the column headers. rules is the result of
+    load_rules(args), built here when not given. Row numbers in messages start after args.row_offset, if it is set.
+    """
+    rows = iter(rows)
+    # Set up initial output file headers with input file headers
+    output_headers = next(rows, None)
+    if output_headers is None:
+        return
+    if rules is None:
+        rules = load_rules(args)
+    filter_rows, column_matchers, cache = rules
+    plan = RulePlan(filter_rows, column_matchers, output_headers, args.verbose)
+    matchers = list(zip(plan.columns, plan.matchers))
+    drops = frozenset(plan.drops)
+    messages = plan.messages
+    actions = plan.actions
+    no_match = [''] * plan.append_count
+    run_stats = getattr(args, 'stats', None)
+    lookup = cache.lookup if run_stats is None else run_stats.timed(cache.lookup)
+    try:
+        # Iterate through input
+        yield output_headers
+        row_count = getattr(args, 'row_offset', 0)
+        width = None
+        indexes = None
+        for row in rows:
+            row_count += 1
+            if len(row) != width:
+                width = len(row)
+                indexes = plan.value_indexes(width)
+            values = [row[i] for i in indexes]
+            # Find which filters match this row
+            matched = set()
+            for value, (column, matches) in zip(values, matchers):
+                matched.update(lookup(value, matches, column))
+            if run_stats is not None:
+                run_stats.hit(matched)
+            if not matched:
+                row.extend(no_match)
+                yield row
+                if args.warn_nomatch:
+                    print('No match at row {:d}: {} '.format(row_count, row), file=sys.stderr)
+                continue
+            if not drops.isdisjoint(matched):
+                dropped_by = min(drops.intersection(matched))
+                # Print what the filters before the drop would have printed, then skip the row
+                for filter_index in sorted(matched):
+                    if filter_index >= dropped_by:
+                        break
+                    messages[filter_index](row_count, values)
+                messages[dropped_by](row_count, values)
+                continue
+            # Perform each of the requested modification operations on this row
+            for filter_index, action, is_append in actions:
+                if filter_index in matched:
+                    action(row_count, values, row)
+                elif is_append:
+                    # Sometimes we need to do things to rows that don't match
+                    row.append('')
+            yield row
+        regex_engine.report_budget(filter_rows)
+    finally:
+        cache.close()
+
+
+def main():
+    args = parser.parse_args()
+    stats.setup(parser, args, 'regex_modify_rows')
+
+    # Take care of any default setup needed
+    close_input = True
+    if args.input is None:
+        close_input = False
+        args.input = 0
+    close_output = True
+    if args.output is None:
+        close_output = False
+        args.output = 1
+
+    if args.explain:
+        # noinspection PyTypeChecker
+        with csv_io.open_input(args.input, close_input) as input_file:
+            input_headers = next(csv.reader(input_file), None)
+        if input_headers is None:
+            print('ERROR: The input has no header row.', file=sys.stderr)
+            sys.exit(1)
+        filter_rows, column_matchers, cache = load_rules(args)
+        cache.close()
+        try:
+            print('\n'.join(RulePlan(filter_rows, column_matchers, input_headers).explain()))
+        except KeyError as error:
+            print('ERROR: Input column {} is not in the input headers.'.format(error), file=sys.stderr)
+            sys.exit(1)
+        except ValueError as error:
+            print('ERROR: Operation column {}'.format(error), file=sys.stderr)
+            sys.exit(1)
+        return
+
+    if args.workers > 1:
+        # noinspection PyTypeChecker
+        with csv_io.open_input(args.input, close_input, binary=True) as input_file,\
+                csv_io.open_output(args.output, close_output) as output_file:
+            run_chunked(stage, args, load_rules(args), input_file, output_file, args.workers)
+        return
+
+    # Open required files
+    # noinspection PyTypeChecker
+    with csv_io.open_input(args.input, close_input) as input_file,\
+            csv_io.open_output(args.output, close_output) as output_file:
+        stats.run_stage(stage, args, input_file, output_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,52 +2,165 @@
 """Write csv file where certain columns of input file are removed.
 
 The script takes one required argument:
-remove_cols=Columns (designated as zero-based integers) to remove from the input when producing the output.
+remove_cols=Columns to remove from the input when producing the output. Each column is given as a zero-based integer,
+            a range of integers such as 3-7 (inclusive, and 3- runs to the last column), or a header name from the
+            first row. Prefixing any of these with ! takes those columns back out of the ones listed before it, so
+            0-9 !4 means columns 0 to 9 except 4. When the first column given starts with !, the others are taken out
+            of all columns.
 
 The script takes the following optional arguments:
 input=Path to a csv file containing at minimum the columns payee, category, subcategory. The first row should contain
 column headers.
 output=Path to write the output csv file. This file will be overwritten without warning if it exists.
+inverse=Keep the specified columns instead of removing them.
+workers=Number of worker processes to split the input between. Defaults to 1.
+profile=Print rows and time per phase to stderr once the output is written.
+stats_json=Path to write rows and time per phase to as JSON.
 """
-import csv
 import argparse
 import re
+import sys
+from operator import itemgetter
+
+import csv_io
+import stats
+from parallel import run_chunked
 
 author = 'brian.k.smith@gmail.com'
 
 parser = argparse.ArgumentParser(description='Remove specified columns (as zero-based integers) from a csv file.')
-parser.add_argument('remove_cols', help='The columns to remove', nargs="+", type=int)
+parser.add_argument('remove_cols', help='The columns to remove, as integers, ranges like 3-7, header names, or any of'
+                                        ' these prefixed with ! to exclude them', nargs="+")
 parser.add_argument('--input', help='Path to csv input file with minimum columns: payee, category, subcategory.'
                                     ' Defaults to stdin.')
 parser.add_argument('--output', help='Path to csv output file. This file will be overwritten if it exists. Defaults'
                                      ' to stdout.')
 parser.add_argument('--inverse', help='Use the specified columns as a list to be included, not removed. All others'
                                       'will be removed.', action='store_true')
+parser.add_argument('--workers', help='Number of worker processes to split the input between. Defaults to 1.',
+                    default=1, type=int)
+stats.add_arguments(parser)
+
+
+def load_rules(args):
+    """Return the rules used by stage. Removing columns needs none beyond args."""
+    return None
+
+
+index_regex = re.compile(r'^-?\d+$')
+range_regex = re.compile(r'^(\d+)-(\d*)$')
+
 
-args = parser.parse_args()
-
-# Take care of any default setup needed
-close_input = True
-if args.input is None:
-    close_input = False
-    args.input = 0
-close_output = True
-if args.output is None:
-    close_output = False
-    args.output = 1
-
-# noinspection PyTypeChecker
-with open(args.input, newline='', encoding='UTF-8', closefd=close_input) as input_file,\
-        open(args.output, mode='w', newline='', closefd=close_output) as output_file:
-    in_reader = csv.reader(input_file)
-    out_writer = csv.writer(output_file)
-    for row in in_reader:
-        out_row = []
-        for i in range(0, len(row)):
-            if args.inverse:
-                if i in args.remove_cols:
-                    out_row.append(row[i])
+class Projector:
+    """Callable returning the columns of a row that are kept, using an itemgetter compiled once per row width.
+
+    specs are the column specifications described for remove_cols. header is the header row used to look up columns
+    given by name. With inverse the selected columns are kept instead of removed. Columns are always output in their
+    input order, and columns beyond the end of a row are ignored.
+    """
+
+    def __init__(self, specs, header=None, inverse=False):
+        self.inverse = inverse
+        self.specs = []
+        for spec in specs:
+            negate = spec.startswith('!')
+            if negate:
+                spec = spec[1:]
+            self.specs.append([negate, self.resolve(spec, header)])
+        self._getters = {}
+
+    @staticmethod
+    def resolve(spec, header):
+        """Return [first, last] column numbers of spec, last being None for ranges that run to the last column.
+
+        Raises ValueError for header names that are not in header.
+        """
+        if index_regex.match(spec):
+            return [int(spec), int(spec)]
+        match = range_regex.match(spec)
+        if match:
+            return [int(match.group(1)), int(match.group(2)) if match.group(2) else None]
+        if header is not None and spec in header:
+            return [header.index(spec), header.index(spec)]
+        raise ValueError('Column {} is not a number, a range, or a name in the header row.'.format(spec))
+
+    def kept(self, width):
+        """Return the column numbers kept from a row with width columns."""
+        selected = set(range(width)) if self.specs and self.specs[0][0] else set()
+        for negate, (first, last) in self.specs:
+            columns = range(max(first, 0), width if last is None else min(last + 1, width))
+            if negate:
+                selected.difference_update(columns)
             else:
-                if i not in args.remove_cols:
-                    out_row.append(row[i])
-        out_writer.writerow(out_row)
+                selected.update(columns)
+        if self.inverse:
+            return sorted(selected)
+        return [i for i in range(width) if i not in selected]
+
+    def getter(self, width):
+        """Return a function of a row with width columns that returns the list of kept values."""
+        kept = self.kept(width)
+        if not kept:
+            return lambda row: []
+        if len(kept) == 1:
+            return lambda row: [row[kept[0]]]
+        get = itemgetter(*kept)
+        return lambda row: list(get(row))
+
+    def __call__(self, row):
+        getter = self._getters.get(len(row))
+        if getter is None:
+            getter = self._getters[len(row)] = self.getter(len(row))
+        return getter(row)
+
+
+def stage(rows, args, rules=None):
+    """Yield each row with the columns in args.remove_cols removed (or, with args.inverse, with only those kept).
+
+    rows is an iterator of csv rows. The first row is used to look up columns given by name, and is otherwise treated
+    like every other row. rules is accepted for symmetry with the other stages and ignored.
+    Raises ValueError when a column name is not in the first row.
+    """
+    rows = iter(rows)
+    first_row = next(rows, None)
+    if first_row is None:
+        return
+    project = Projector(args.remove_cols, first_row, args.inverse)
+    yield project(first_row)
+    yield from map(project, rows)
+
+
+def main():
+    args = parser.parse_args()
+    stats.setup(parser, args, 'remove_columns')
+
+    # Take care of any default setup needed
+    close_input = True
+    if args.input is None:
+        close_input = False
+        args.input = 0
+    close_output = True
+    if args.output is None:
+        close_output = False
+        args.output = 1
+
+    try:
+        if args.workers > 1:
+            # noinspection PyTypeChecker
+            with csv_io.open_input(args.input, close_input, binary=True) as input_file,\
+                    csv_io.open_output(args.output, close_output) as output_file:
+                run_chunked(stage, args, load_rules(args), input_file, output_file, args.workers)
+            return
+
+        # Open required files
+        # noinspection PyTypeChecker
+        with csv_io.open_input(args.input, close_input) as input_file,\
+                csv_io.open_output(args.output, close_output) as output_file:
+            stats.run_stage(stage, args, input_file, output_file)
+    except ValueError as error:
+        print('ERROR: {}'.format(error), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
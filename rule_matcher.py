@@ -0,0 +1,217 @@
+"""Find every regular expression in a large rule set that matches a value without trying each one in turn.
+
+Rule files for the filtering scripts can hold thousands of patterns, and running all of them against every row makes
+the cost grow with rows x rules. A RuleMatcher looks at each pattern once when it is built:
+- Patterns that must contain a run of literal characters are indexed by their longest such run in an Aho-Corasick
+  automaton. One pass over a value finds every literal it contains, and only the patterns owning those literals are
+  tried.
+- Patterns without a usable literal are joined into one combined alternation. When the alternation does not match, none
+  of those patterns can, and they are all skipped together.
+- Patterns that cannot be safely combined (backreferences, named groups, inline global flags) are always tried, as
+  are patterns that could backtrack exponentially, which would stall the combined alternation however they are run.
+
+Candidates are always confirmed with the pattern's own search function, so the result is exactly the list of patterns
+whose search would have matched, in rule order.
+"""
+import re
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+from regex_engine import backtracking_risk
+
+author = 'brian.k.smith@gmail.com'
+
+_REPEATS = tuple(getattr(sre_parse, name) for name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+                 if hasattr(sre_parse, name))
+
+
+class AhoCorasick:
+    """Automaton that reports which of a set of literal strings occur in a text, in a single pass over the text."""
+
+    def __init__(self, words):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        for word_id, word in enumerate(words):
+            state = 0
+            for ch in word:
+                next_state = self.goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][ch] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                state = next_state
+            self.out[state] = self.out[state] + (word_id,)
+        # Breadth first walk to set failure links and merge outputs of shorter suffixes
+        queue = list(self.goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for ch, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(ch, 0)
+                if self.fail[next_state] == next_state:
+                    self.fail[next_state] = 0
+                self.out[next_state] = self.out[next_state] + self.out[self.fail[next_state]]
+
+    def find(self, text):
+        """Return the set of word ids that occur anywhere in text."""
+        goto = self.goto
+        fail = self.fail
+        out = self.out
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+def _literal_runs(items):
+    """Return the runs of literal characters that every match of a parsed (sub)pattern has to contain."""
+    runs = []
+    current = []
+    for op, av in items:
+        if op is sre_parse.LITERAL and av < 128:
+            current.append(chr(av))
+            continue
+        if current:
+            runs.append(''.join(current))
+            current = []
+        if op is sre_parse.SUBPATTERN:
+            # Groups that change flags locally could make the literal mean something else
+            if not av[1] and not av[2]:
+                runs.extend(_literal_runs(av[-1]))
+        elif op in _REPEATS:
+            if av[0] >= 1:
+                runs.extend(_literal_runs(av[2]))
+        # Anything else (alternation, character sets, lookarounds, ...) ends the run and contributes nothing
+    if current:
+        runs.append(''.join(current))
+    return runs
+
+
+def _uses_backrefs(items):
+    """Return True if a parsed (sub)pattern refers back to one of its own groups."""
+    for op, av in items:
+        if op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+            return True
+        for arg in (av if isinstance(av, (list, tuple)) else [av]):
+            if isinstance(arg, sre_parse.SubPattern) and _uses_backrefs(arg):
+                return True
+            if isinstance(arg, list):
+                for branch in arg:
+                    if isinstance(branch, sre_parse.SubPattern) and _uses_backrefs(branch):
+                        return True
+    return False
+
+
+class RuleMatcher:
+    """Report which of a list of compiled regular expressions find a match in a value.
+
+    patterns is a list of compiled patterns. matches(text) returns the indexes of the patterns whose search() finds a
+    match in text, in the order the patterns were supplied. When ids is given, the id at each matching pattern's
+    position is returned instead of its index.
+    """
+
+    def __init__(self, patterns, ids=None):
+        self.patterns = list(patterns)
+        self.ids = ids
+        self._always = []
+        exact_words = []
+        exact_owners = {}
+        folded_words = []
+        folded_owners = {}
+        residual = {}
+        self._folded_any = False
+        for index, pattern in enumerate(self.patterns):
+            kind, literal = self._classify(pattern)
+            if kind == 'literal':
+                if pattern.flags & re.IGNORECASE:
+                    self._folded_any = True
+                    words, owners = folded_words, folded_owners
+                    literal = literal.lower()
+                else:
+                    words, owners = exact_words, exact_owners
+                if literal not in owners:
+                    owners[literal] = []
+                    words.append(literal)
+                owners[literal].append(index)
+            elif kind == 'residual':
+                residual.setdefault(pattern.flags, []).append(index)
+            else:
+                self._always.append(index)
+        self._exact = AhoCorasick(exact_words) if exact_words else None
+        self._exact_owners = [exact_owners[word] for word in exact_words]
+        self._folded = AhoCorasick(folded_words) if folded_words else None
+        self._folded_owners = [folded_owners[word] for word in folded_words]
+        # One combined alternation per flag combination
+        self._residual = []
+        for flags, indexes in residual.items():
+            try:
+                combined = re.compile('|'.join('(?:{})'.format(self.patterns[i].pattern) for i in indexes), flags)
+                self._residual.append((combined, indexes))
+            except (re.error, OverflowError):
+                self._always.extend(indexes)
+        self._always.sort()
+        self._all = list(range(len(self.patterns)))
+
+    @staticmethod
+    def _classify(pattern):
+        """Decide how a compiled pattern can be prefiltered: ('literal', text), ('residual', None), ('always', None)."""
+        if not isinstance(pattern.pattern, str):
+            return 'always', None
+        try:
+            parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+        except (re.error, OverflowError, RecursionError):
+            return 'always', None
+        if parsed.state.groupdict or _uses_backrefs(parsed):
+            return 'always', None
+        runs = _literal_runs(parsed)
+        if runs:
+            return 'literal', max(runs, key=len)
+        # Inline global flags and verbose patterns cannot be wrapped into a combined alternation
+        inline_flags = sre_parse.parse(pattern.pattern, 0).state.flags != sre_parse.parse('', 0).state.flags
+        if inline_flags or pattern.flags & re.VERBOSE:
+            return 'always', None
+        # The combined alternation runs on re even when the pattern itself runs on re2
+        if backtracking_risk(pattern.pattern, pattern.flags) is not None:
+            return 'always', None
+        return 'residual', None
+
+    def candidates(self, text):
+        """Return the sorted indexes of the patterns that could match text."""
+        if self._folded_any and not text.isascii():
+            # Case-insensitive matching folds some non-ascii characters onto ascii letters
+            return self._all
+        hits = set(self._always)
+        if self._exact is not None:
+            for word_id in self._exact.find(text):
+                hits.update(self._exact_owners[word_id])
+        if self._folded is not None:
+            for word_id in self._folded.find(text.lower()):
+                hits.update(self._folded_owners[word_id])
+        for combined, indexes in self._residual:
+            if combined.search(text) is not None:
+                hits.update(indexes)
+        return sorted(hits)
+
+    def matches(self, text):
+        """Return the indexes (or ids) of all patterns whose search finds a match in text, in rule order."""
+        patterns = self.patterns
+        found = [index for index in self.candidates(text) if patterns[index].search(text) is not None]
+        if self.ids is not None:
+            return [self.ids[index] for index in found]
+        return found
@@ -4,6 +4,10 @@ and matching criteria in another input file.
 
 Sometimes you need to clarify the details of a particular transaction using data from another source.
 
+Amounts are parsed to whole cents with money.py, so the amounts of the split rows must add up to the original amount
+exactly. Amounts with more than two decimal places are reported as errors and the row is not split. The amounts of split
+rows are written as they are in the split file, without the $ sign.
+
 The script takes one required argument:
 filter=Path to a csv file containing the columns: matching column a, matching regex a, comparison column a, comparison
 column b, destination column(s) a, source column(s) b
@@ -12,12 +16,20 @@ split_source=Path to a csv file with data to use for performing split operation.
 The script takes the following optional arguments:
 input=Path to a csv file containing the designated input columns.
 output=Path to write the output csv file. This file will be overwritten without warning if it exists.
+regex_engine=Engine running the filter regexes: re, auto or re2, see regex_engine.py. Defaults to re.
+regex_budget=Seconds of searching allowed per filter regex before a warning names it. Defaults to no budget.
+profile=Print rows, time per phase and the slowest filters to stderr once the output is written.
+stats_json=Path to write rows, time per phase and the hits and search time of every filter to as JSON.
 """
 import csv
 import argparse
-import re
 import sys
-from copy import deepcopy
+
+import csv_io
+import money
+import regex_engine
+import stats
+from compact_index import CompactIndex
 
 author = 'brian.k.smith@gmail.com'
 
@@ -35,103 +47,149 @@ parser.add_argument('--input', help='Path to csv input file with column(s) to ex
                                     ' Defaults to stdin.')
 parser.add_argument('--output', help='Path to csv output file. This file will be overwritten if it exists. Defaults'
                                      ' to stdout.')
+regex_engine.add_arguments(parser)
+stats.add_arguments(parser)
+
 
-args = parser.parse_args()
-
-currency_regex = re.compile('\$?\s*(-?\d+\.\d+)')
-
-# Take care of any default setup needed
-close_input = True
-if args.input is None:
-    close_input = False
-    args.input = 0
-close_output = True
-if args.output is None:
-    close_output = False
-    args.output = 1
-
-# Open required files
-# noinspection PyTypeChecker
-with open(args.input, newline='', encoding='UTF-8', closefd=close_input) as input_file,\
-        open(args.split, newline='') as split_file,\
-        open(args.filter, newline='') as filter_file,\
-        open(args.output, mode='w', newline='', closefd=close_output) as output_file:
-    in_reader = csv.reader(input_file)
-    filter_reader = csv.reader(filter_file, )
-    split_reader = csv.reader(split_file)
-    out_writer = csv.writer(output_file)
-    # Set up filters map
+def load_filters(filter_path, args=None):
+    """Return the filters in the filter file as a list of dicts describing the columns of both inputs.
+
+    The regexes are compiled with the engine and budget chosen by args, see regex_engine.compile.
+    """
     filters = []
-    filter_headers = next(filter_reader)
-    for filter_row in filter_reader:
-        filt = {"a_match_col": int(filter_row[0]),
-                "a_match_regex": re.compile(filter_row[1]),
-                "a_comp_col": int(filter_row[2]),
-                "b_comp_col": int(filter_row[3]),
-                "a_dest_col": list(map(int, filter_row[4].split(';'))),
-                "b_source_col": list(map(int, filter_row[5].split(';'))),
-                "a_currency_col": int(filter_row[6])}
-        filters.append(filt)
-    # Set up split data map. Index by comparison column: list of lists containing the values from all of the
-    # file B source columns
-    split_data = {}
-    split_headers = next(split_reader)
-    for row in split_reader:
-        for filt in filters:
-            if row[filt["b_comp_col"]]:
-                if row[filt["b_comp_col"]] not in split_data:
-                    split_data[row[filt["b_comp_col"]]] = []
-                data_list = []
-                for col in filt["b_source_col"]:
-                    data_list.append(row[col])
-                split_data[row[filt["b_comp_col"]]].append(data_list)
+    with open(filter_path, newline='') as filter_file:
+        filter_reader = csv.reader(filter_file)
+        filter_headers = next(filter_reader)
+        for filter_row in filter_reader:
+            filt = {"a_match_col": int(filter_row[0]),
+                    "a_match_regex": regex_engine.compile(filter_row[1], 0, args),
+                    "a_comp_col": int(filter_row[2]),
+                    "b_comp_col": int(filter_row[3]),
+                    "a_dest_col": list(map(int, filter_row[4].split(';'))),
+                    "b_source_col": list(map(int, filter_row[5].split(';'))),
+                    "a_currency_col": int(filter_row[6])}
+            filters.append(filt)
+    return filters
+
+
+def load_split_data(split_path, filters):
+    """Index the rows of the split file separately for each filter, in the filter's "split_data" entry."""
+    # Set up split data map for each filter. Index by comparison column: every row's values from all of the file B
+    # source columns
+    for filt in filters:
+        filt["split_data"] = CompactIndex(len(filt["b_source_col"]), 'all')
+        filt["dest_cols"] = list(enumerate(filt["a_dest_col"]))
+    with open(split_path, newline='') as split_file:
+        split_reader = csv.reader(split_file)
+        split_headers = next(split_reader)
+        for row in split_reader:
+            for filt in filters:
+                key = row[filt["b_comp_col"]]
+                if key:
+                    filt["split_data"].add(key, [row[col] for col in filt["b_source_col"]])
+
+
+def load_rules(args):
+    """Return the filters used by stage, with the rows of the split file indexed."""
+    filters = load_filters(args.filter, args)
+    load_split_data(args.split, filters)
+    return filters
+
+
+def stage(rows, args, rules=None):
+    """Yield the header row and then each row, replaced by its split rows when a filter matches it.
+
+    rows is an iterator of csv rows whose first row contains the column headers. rules is the result of
+    load_rules(args), built here when not given.
+    """
+    rows = iter(rows)
+    filters = rules if rules is not None else load_rules(args)
+    run_stats = getattr(args, 'stats', None)
+    patterns = [filt["a_match_regex"] for filt in filters]
+    if run_stats is not None:
+        patterns = run_stats.add_rules(patterns)
+    searches = [pattern.search if run_stats is None else run_stats.timed(pattern.search) for pattern in patterns]
     # Set up output file with input headers
-    output_headers = next(in_reader)
-    out_writer.writerow(output_headers)
+    output_headers = next(rows, None)
+    if output_headers is None:
+        return
+    yield output_headers
     # Iterate through input
     row_count = 0
-    for row in in_reader:
+    for row in rows:
         row_count += 1
-        out_row = deepcopy(row)
+        # Rows are never modified in place, split rows are shallow copies with the destination columns replaced
+        out_row = row
         row_split = False
-        for filt in filters:
-            match = filt["a_match_regex"].search(row[filt["a_match_col"]])
+        for filter_index, filt in enumerate(filters):
+            match = searches[filter_index](row[filt["a_match_col"]])
             if match:
-                original_currency = float(row[filt["a_currency_col"]])
-                split_currency = 0.0
-                for key in split_data:
-                    if row[filt["a_comp_col"]] == key:
-                        for d_list in split_data[key]:
-                            split_row = deepcopy(out_row)
-                            col_count = 0
-                            while col_count < len(filt["a_dest_col"]):
-                                dest_col = filt["a_dest_col"][col_count]
-                                if dest_col == filt["a_currency_col"]:
-                                    match = currency_regex.match(d_list[col_count])
-                                    split_string = match.group(1)
-                                    split_row[dest_col] = split_string
-                                    split_currency += float(split_string)
-                                else:
-                                    split_row[dest_col] = d_list[col_count]
-                                col_count += 1
-                            out_writer.writerow(split_row)
-                            row_split = True
-                if row_split and abs(original_currency - split_currency) > 0.001:
+                if run_stats is not None:
+                    run_stats.hit([filter_index])
+                split_rows = []
+                try:
+                    # In cents, so the split rows must add up exactly
+                    split_currency = 0
+                    for d_list in filt["split_data"].get(row[filt["a_comp_col"]], ()):
+                        split_row = list(out_row)
+                        for col_count, dest_col in filt["dest_cols"]:
+                            if dest_col == filt["a_currency_col"]:
+                                split_string = d_list[col_count].strip()
+                                if split_string.startswith("$"):
+                                    split_string = split_string[1:].lstrip()
+                                split_currency += money.parse(split_string, exact=True)
+                                split_row[dest_col] = split_string
+                            else:
+                                split_row[dest_col] = d_list[col_count]
+                        split_rows.append(split_row)
+                    if split_rows or row_split:
+                        original_currency = money.parse(row[filt["a_currency_col"]], exact=True)
+                except ValueError as error:
+                    print("ERROR: Row {:d} ({}) is not split, its amounts are not in cents: {}."
+                          .format(row_count, ",".join(row), error), file=sys.stderr)
+                    continue
+                for split_row in split_rows:
+                    yield split_row
+                    row_split = True
+                if row_split and original_currency != split_currency:
                     if args.add_imbalance:
-                        imba_row = deepcopy(out_row)
-                        col_count = 0
-                        while col_count < len(filt["a_dest_col"]):
-                            dest_col = filt["a_dest_col"][col_count]
+                        imba_row = list(out_row)
+                        for col_count, dest_col in filt["dest_cols"]:
                             if dest_col == filt["a_currency_col"]:
-                                imba = original_currency - split_currency
-                                split_row[dest_col] = "{:0.2f}".format(imba)
+                                imba_row[dest_col] = money.format(original_currency - split_currency)
                             else:
-                                split_row[dest_col] = "IMBALANCE"
-                            col_count += 1
-                        out_writer.writerow(split_row)
+                                imba_row[dest_col] = "IMBALANCE"
+                        yield imba_row
                     else:
-                        print("ERROR: Sum of currency in split rows (${:.2f}) does not equal starting currency"
-                              "(${:.2f}) at row {:d} ({})!"
-                              .format(split_currency, original_currency, row_count, ",".join(row)), file=sys.stderr)
+                        print("ERROR: Sum of currency in split rows (${}) does not equal starting currency"
+                              "(${}) at row {:d} ({})!"
+                              .format(money.format(split_currency), money.format(original_currency), row_count,
+                                      ",".join(row)), file=sys.stderr)
         if not row_split:
-            out_writer.writerow(out_row)
+            yield out_row
+    regex_engine.report_budget(patterns)
+
+
+def main():
+    args = parser.parse_args()
+    stats.setup(parser, args, 'split_rows')
+
+    # Take care of any default setup needed
+    close_input = True
+    if args.input is None:
+        close_input = False
+        args.input = 0
+    close_output = True
+    if args.output is None:
+        close_output = False
+        args.output = 1
+
+    # Open required files
+    # noinspection PyTypeChecker
+    with csv_io.open_input(args.input, close_input) as input_file,\
+            csv_io.open_output(args.output, close_output) as output_file:
+        stats.run_stage(stage, args, input_file, output_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Keep the output of each pipeline stage so a re-run only recomputes the stages after the first one that changed.
+
+Every stage's output is stored under a key that hashes the key of the stage before it (the first stage uses a hash of
+the pipeline's input files), the stage's name and arguments, the contents of the files named by its positional
+arguments (its rule or filter files), and the source code of the tools. Changing a rule file therefore changes the key
+of its stage and of every stage after it, while the stages before it keep theirs. A run starts from the output of the
+last stage whose key is in the cache.
+
+Outputs are csv files in a cache directory named after their key. Reading an entry touches it, and once the directory
+holds more than max_bytes the least recently used entries are removed. Entries are only added once a stage's output
+is complete, so an interrupted run never leaves a partial entry behind.
+
+Anything a stage printed or wrote besides its output when it ran, such as warnings about rows without a match or
+filter.py's --unmatched_report, is not repeated when its output comes from the cache.
+"""
+import csv
+import glob
+import hashlib
+import json
+import os
+import tempfile
+
+import csv_io
+from match_cache import file_hash
+
+author = 'brian.k.smith@gmail.com'
+
+# Bumped whenever the way keys are computed or entries are stored changes
+CACHE_VERSION = 1
+
+
+def default_directory():
+    """Return the cache directory used when the pipeline does not name one."""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'pyaccounting', 'stages')
+
+
+def code_hash():
+    """Return a hash of the source of every module next to this one, so editing a tool invalidates its outputs."""
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+        digest.update(os.path.basename(path).encode('UTF-8'))
+        digest.update(file_hash(path).encode('UTF-8'))
+    return digest.hexdigest()
+
+
+def input_key(paths, header_row_count=1):
+    """Return the key of the rows read from the csv files at paths."""
+    return _key([CACHE_VERSION, code_hash(), header_row_count, [file_hash(path) for path in paths]])
+
+
+def positional_files(parser, args):
+    """Return the paths of the existing files named by the positional arguments in args, which parser parsed.
+
+    For the csv tools these are the rule, filter and split files a stage reads.
+    """
+    paths = []
+    # noinspection PyProtectedMember
+    for action in parser._actions:
+        if action.option_strings:
+            continue
+        values = getattr(args, action.dest, None)
+        for value in values if isinstance(values, list) else [values]:
+            if isinstance(value, str) and os.path.isfile(value):
+                paths.append(value)
+    return paths
+
+
+def stage_key(previous_key, name, argv, parser, args):
+    """Return the key of the output of a stage given the key of its input.
+
+    argv is the stage's command line and args the arguments parser parsed from it. The contents of the files named by
+    positional arguments are part of the key; options, such as a --cache_file the stage writes to, are only keyed by
+    their value.
+    """
+    files = [[path, file_hash(path)] for path in positional_files(parser, args)]
+    return _key([previous_key, name, argv, files])
+
+
+def _key(parts):
+    return hashlib.sha256(json.dumps(parts).encode('UTF-8')).hexdigest()
+
+
+class StageCache:
+    """Directory of stage outputs, keyed by content and bounded to max_bytes by least recent use."""
+
+    def __init__(self, directory=None, max_bytes=1 << 30):
+        self.directory = default_directory() if directory is None else directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.csv')
+
+    def __contains__(self, key):
+        return os.path.isfile(self.path(key))
+
+    def open(self, key):
+        """Return the output stored under key opened for reading, marking it as recently used."""
+        path = self.path(key)
+        os.utime(path)
+        return csv_io.open_input(path, encoding=None)
+
+    def recording(self, key, rows):
+        """Yield rows, storing them under key once the last one has been read."""
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with csv_io.open_output(fd) as cache_file:
+                writer = csv.writer(cache_file)
+                for row in rows:
+                    writer.writerow(row)
+                    yield row
+            os.replace(temp_path, self.path(key))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the directory holds at most max_bytes."""
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, '*.csv')):
+            try:
+                info = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append([info.st_mtime, info.st_size, path])
+        total = sum(entry[1] for entry in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
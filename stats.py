@@ -0,0 +1,198 @@
+"""Record where the csv tools spend their time, to find the rule or stage that makes a run slow.
+
+A Stats object counts the rows going into and out of one stage and splits the stage's time into phases:
+parse=Time spent reading and parsing the csv input.
+match=Time spent finding the rules that match each row, including the match cache.
+transform=Time spent in the stage itself, other than matching.
+write=Time spent formatting and writing the csv output.
+
+Stages with regex rules also record, for each rule, the number of rows it matched, the number of times its regex was
+searched (rows answered from the match cache are not searched again), and the time those searches took.
+
+Scripts take two options to turn this on:
+profile=Print the statistics to stderr once the output is written.
+stats_json=Path to write the statistics to as JSON.
+Both need the stage to run in a single process, so they cannot be combined with --workers.
+"""
+import csv
+import json
+import sys
+import time
+from collections import OrderedDict
+
+author = 'brian.k.smith@gmail.com'
+
+clock = time.perf_counter
+
+
+def add_arguments(parser):
+    """Add the --profile and --stats_json options to an argparse parser."""
+    parser.add_argument('--profile', help='Print rows, time per phase and time per rule to stderr.',
+                        action='store_true')
+    parser.add_argument('--stats_json', help='Path to write rows, time per phase and time per rule to as JSON.')
+
+
+def setup(parser, args, name):
+    """Set args.stats to a Stats named name when --profile or --stats_json was given, otherwise to None.
+
+    Exits through parser.error when profiling is combined with more than one worker.
+    """
+    args.stats = None
+    if getattr(args, 'profile', False) or getattr(args, 'stats_json', None):
+        if getattr(args, 'workers', 1) > 1:
+            parser.error('--profile and --stats_json need a single process, they cannot be used with --workers')
+        args.stats = Stats(name)
+    return args.stats
+
+
+class TimedPattern:
+    """Compiled regex that adds the count and time of its searches to a rule's statistics.
+
+    Everything other than search is passed through to the compiled regex, so a TimedPattern can stand in for it.
+    """
+
+    def __init__(self, regex, rule):
+        self.regex = regex
+        self.rule = rule
+
+    def __getattr__(self, name):
+        return getattr(self.regex, name)
+
+    def __str__(self):
+        return str(self.regex)
+
+    def search(self, *args):
+        start = clock()
+        result = self.regex.search(*args)
+        self.rule['seconds'] += clock() - start
+        self.rule['searches'] += 1
+        return result
+
+
+class Stats:
+    """Rows, time per phase and time per rule of one stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows_in = 0
+        self.rows_out = 0
+        self.seconds = OrderedDict([('parse', 0.0), ('match', 0.0), ('transform', 0.0), ('write', 0.0)])
+        self.rules = []
+        # Time spent waiting for input rows and for the stage's output rows
+        self._waiting = 0.0
+        self._running = 0.0
+
+    def add_rules(self, patterns, labels=None):
+        """Return patterns wrapped in TimedPatterns recording into this stage's rule statistics.
+
+        labels name each rule in the report, defaulting to the regex itself.
+        """
+        timed = []
+        for index, pattern in enumerate(patterns):
+            rule = OrderedDict([('rule', len(self.rules) + 1),
+                                ('regex', labels[index] if labels is not None else pattern.pattern),
+                                ('hits', 0), ('searches', 0), ('seconds', 0.0)])
+            self.rules.append(rule)
+            timed.append(TimedPattern(pattern, rule))
+        return timed
+
+    def hit(self, indexes):
+        """Count a row matched by each of the rules at indexes."""
+        for index in indexes:
+            self.rules[index]['hits'] += 1
+
+    def timed(self, func, phase='match'):
+        """Return a function calling func and adding the time it took to phase."""
+        seconds = self.seconds
+
+        def timed_func(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                seconds[phase] += clock() - start
+        return timed_func
+
+    def count_in(self, rows):
+        """Yield rows, counting the rows after the header and the time spent waiting for each."""
+        rows = iter(rows)
+        while True:
+            start = clock()
+            row = next(rows, None)
+            self._waiting += clock() - start
+            if row is None:
+                break
+            self.rows_in += 1
+            yield row
+        self.rows_in = max(self.rows_in - 1, 0)
+
+    def count_out(self, rows):
+        """Yield the stage's output rows, counting the rows after the header and the time spent producing each."""
+        rows = iter(rows)
+        while True:
+            start = clock()
+            row = next(rows, None)
+            self._running += clock() - start
+            if row is None:
+                break
+            self.rows_out += 1
+            yield row
+        self.rows_out = max(self.rows_out - 1, 0)
+
+    def finish(self, total=None, parse=True):
+        """Split the stage's time into phases once it has run.
+
+        total is the time the whole run took, the time not spent in the stage is counted as writing. With parse False
+        the time spent waiting for input was spent in an earlier stage and is left out.
+        """
+        if parse:
+            self.seconds['parse'] = self._waiting
+        self.seconds['transform'] = max(self._running - self._waiting - self.seconds['match'], 0.0)
+        if total is not None:
+            self.seconds['write'] = max(total - self._running, 0.0)
+
+    def as_dict(self):
+        return OrderedDict([('stage', self.name), ('rows_in', self.rows_in), ('rows_out', self.rows_out),
+                            ('seconds', OrderedDict((phase, round(seconds, 6))
+                                                    for phase, seconds in self.seconds.items())),
+                            ('rules', [OrderedDict(rule, seconds=round(rule['seconds'], 6)) for rule in self.rules])])
+
+    def report(self, top=10):
+        """Return lines describing the stage, with the top rules by search time."""
+        lines = ['{}: {:d} rows in, {:d} rows out'.format(self.name, self.rows_in, self.rows_out)]
+        lines.append('  ' + ', '.join('{} {:.3f}s'.format(phase, seconds) for phase, seconds in self.seconds.items()))
+        if self.rules:
+            slowest = sorted(self.rules, key=lambda rule: rule['seconds'], reverse=True)[:top]
+            lines.append('  {:>6} {:>10} {:>10} {:>10}  {}'.format('rule', 'hits', 'searches', 'seconds', 'regex'))
+            for rule in slowest:
+                lines.append('  {:>6d} {:>10d} {:>10d} {:>10.3f}  {}'.format(rule['rule'], rule['hits'],
+                                                                           rule['searches'], rule['seconds'],
+                                                                           rule['regex']))
+        return lines
+
+
+def emit(args, stats_list, total):
+    """Print and/or write the statistics of stats_list, as requested by args.profile and args.stats_json."""
+    if getattr(args, 'profile', False):
+        for stats in stats_list:
+            print('\n'.join(stats.report()), file=sys.stderr)
+        print('total {:.3f}s'.format(total), file=sys.stderr)
+    if getattr(args, 'stats_json', None):
+        with open(args.stats_json, mode='w') as stats_file:
+            json.dump(OrderedDict([('total_seconds', round(total, 6)),
+                                   ('stages', [stats.as_dict() for stats in stats_list])]), stats_file, indent=2)
+
+
+def run_stage(stage, args, input_file, output_file):
+    """Write the rows stage produces from the csv input_file to output_file, profiling it when args.stats is set."""
+    out_writer = csv.writer(output_file)
+    stats = getattr(args, 'stats', None)
+    if stats is None:
+        out_writer.writerows(stage(csv.reader(input_file), args))
+        return
+    start = clock()
+    out_writer.writerows(stats.count_out(stage(stats.count_in(csv.reader(input_file)), args)))
+    output_file.flush()
+    total = clock() - start
+    stats.finish(total)
+    emit(args, [stats], total)
@@ -0,0 +1,121 @@
+"""Share one pooled HTTP session between Stripe API calls and cache the responses that can no longer change.
+
+The stripe library opens a new HTTP session, and so a new TLS connection, for every call unless it is given a client to
+reuse. use_pooled_session installs one with keep-alive connections for all calls in the process.
+
+Pages of balance transactions are cached on disk, keyed by the API base, version, account and request parameters, once
+every transaction on the page has settled (status available) and the page is for a payout or for a created range that
+ended more than an hour ago. Such pages look the same on every later request, so re-running a script over the same
+month is answered from the cache. Entries expire after a time to live in case Stripe does change them.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import requests
+import stripe
+from stripe.http_client import RequestsClient
+from stripe.util import convert_to_stripe_object
+
+author = 'brian.k.smith@gmail.com'
+
+
+def use_pooled_session(pool_size=10):
+    """Make every Stripe API call in this process share a session keeping up to pool_size connections alive."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    stripe.default_http_client = RequestsClient(session=session)
+
+
+def settled(params, body):
+    """Return whether a page of balance transactions listed with params will never change."""
+    if not all(trans.get('status') == 'available' for trans in body.get('data', [])):
+        return False
+    if 'payout' in params:
+        return True
+    created = params.get('created')
+    if not isinstance(created, dict):
+        return False
+    end = created.get('lt', created.get('lte'))
+    return end is not None and end < time.time() - 3600
+
+
+class ResponseCache:
+    """sqlite file of Stripe API responses with a time to live, safe to share between threads.
+
+    hits and misses count the lookups that were and were not answered from the cache.
+    """
+
+    def __init__(self, path, ttl=30 * 86400):
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, stored_at REAL, body TEXT)')
+        self._db.execute('DELETE FROM responses WHERE stored_at < ?', (time.time() - ttl,))
+        self._db.commit()
+
+    @staticmethod
+    def key(url, params):
+        """Return the cache key of a request to url with params for the configured Stripe account."""
+        account = hashlib.sha256((stripe.api_key or '').encode('UTF-8')).hexdigest()
+        request = json.dumps([stripe.api_base, stripe.api_version, account, url, params], sort_keys=True)
+        return hashlib.sha256(request.encode('UTF-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached response body stored under key, or None."""
+        with self._lock:
+            row = self._db.execute('SELECT body FROM responses WHERE key = ? AND stored_at >= ?',
+                                   (key, time.time() - self.ttl)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, body):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO responses (key, stored_at, body) VALUES (?, ?, ?)',
+                             (key, time.time(), json.dumps(body)))
+            self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def report(self):
+        """Return a line describing how many lookups the cache answered."""
+        return 'Stripe cache: {:d} hits, {:d} misses.'.format(self.hits, self.misses)
+
+
+def list_balance_transactions(cache=None, **params):
+    """Return a page of balance transactions listed with params, from cache when it holds the page."""
+    if cache is None:
+        return stripe.BalanceTransaction.list(**params)
+    key = cache.key(stripe.BalanceTransaction.class_url(), params)
+    body = cache.get(key)
+    if body is not None:
+        page = convert_to_stripe_object(body, stripe.api_key)
+        page._retrieve_params = params
+        return page
+    page = stripe.BalanceTransaction.list(**params)
+    if page.last_response is not None and settled(params, page.last_response.data):
+        cache.put(key, page.last_response.data)
+    return page
+
+
+def auto_paging(list_page, **params):
+    """Yield every item of a Stripe list, calling list_page with params and a starting_after cursor for each page."""
+    while True:
+        page = list_page(**params)
+        item = None
+        for item in page.data:
+            yield item
+        if not page.has_more or item is None:
+            return
+        params['starting_after'] = item.id
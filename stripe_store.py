@@ -0,0 +1,120 @@
+"""Keep a local sqlite copy of Stripe balance transactions that is brought up to date incrementally.
+
+Stripe lists balance transactions newest first. A sync walks the pages of one created range with starting_after
+cursors and commits each page together with the cursor, so an interrupted sync picks up where it stopped the next time
+it runs. Once a range is complete, the newest stored transaction becomes the high-water mark and later syncs only ask
+for transactions created since then. Transactions that were still pending are asked for again until they settle.
+Transactions older than anything synced so far are fetched as a separate backfill range when first needed.
+"""
+import sqlite3
+
+author = 'brian.k.smith@gmail.com'
+
+COLUMNS = ["id", "amount", "available_on", "created", "currency", "description", "fee", "net", "source", "status",
+           "type"]
+
+
+class TransactionStore:
+    """sqlite file holding balance transactions and the state of their sync."""
+
+    page_size = 100
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS transactions (id TEXT PRIMARY KEY, amount INTEGER,'
+                         ' available_on INTEGER, created INTEGER, currency TEXT, description TEXT, fee INTEGER,'
+                         ' net INTEGER, source TEXT, status TEXT, type TEXT)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS transactions_created ON transactions (created)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value)')
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def state(self, key):
+        """Return the sync state value stored under key, or None."""
+        row = self._db.execute('SELECT value FROM sync_state WHERE key = ?', (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def _set_state(self, values):
+        for key, value in values.items():
+            if value is None:
+                self._db.execute('DELETE FROM sync_state WHERE key = ?', (key,))
+            else:
+                self._db.execute('INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)', (key, value))
+
+    def high_water_mark(self):
+        """Return [created, id] of the newest stored transaction, or None when the store is empty."""
+        row = self._db.execute('SELECT created, id FROM transactions ORDER BY created DESC, id DESC LIMIT 1').fetchone()
+        return None if row is None else list(row)
+
+    def sync_range(self, list_page, lower, upper=None):
+        """Fetch every transaction created at or after lower and before upper (when given) into the store.
+
+        list_page is called with the keyword arguments of stripe.BalanceTransaction.list and returns a page with data
+        and has_more attributes. The range and the cursor are saved after every page.
+        Returns the number of transactions fetched.
+        """
+        if self.state('run_lower') != lower or self.state('run_upper') != upper:
+            with self._db:
+                self._set_state({'run_lower': lower, 'run_upper': upper, 'run_cursor': None})
+        cursor = self.state('run_cursor')
+        created = {'gte': lower}
+        if upper is not None:
+            created['lt'] = upper
+        fetched = 0
+        while True:
+            params = {'limit': self.page_size, 'created': created}
+            if cursor is not None:
+                params['starting_after'] = cursor
+            page = list_page(**params)
+            rows = [[trans[column] for column in COLUMNS] for trans in page.data]
+            if rows:
+                cursor = rows[-1][0]
+            # The page and the cursor that follows it are committed together
+            with self._db:
+                self._db.executemany('INSERT OR REPLACE INTO transactions ({}) VALUES ({})'
+                                     .format(', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))), rows)
+                self._set_state({'run_cursor': cursor})
+            fetched += len(rows)
+            if not page.has_more or not rows:
+                break
+        synced_from = self.state('synced_from')
+        high_water = self.high_water_mark()
+        with self._db:
+            self._set_state({'run_lower': None, 'run_upper': None, 'run_cursor': None,
+                             'synced_from': lower if synced_from is None else min(lower, synced_from),
+                             'high_water_created': None if high_water is None else high_water[0],
+                             'high_water_id': None if high_water is None else high_water[1]})
+        return fetched
+
+    def sync(self, list_page, start):
+        """Bring the store up to date with every transaction created at or after the start timestamp.
+
+        An interrupted sync is finished first. Returns the number of transactions fetched.
+        """
+        fetched = 0
+        if self.state('run_lower') is not None:
+            fetched += self.sync_range(list_page, self.state('run_lower'), self.state('run_upper'))
+        synced_from = self.state('synced_from')
+        if synced_from is None:
+            return fetched + self.sync_range(list_page, start)
+        if start < synced_from:
+            fetched += self.sync_range(list_page, start, synced_from)
+        # Ask again from the high-water mark, or from the oldest transaction that may still change
+        lower = self.state('high_water_created')
+        if lower is None:
+            lower = self.state('synced_from')
+        pending = self._db.execute("SELECT MIN(created) FROM transactions WHERE status = 'pending'").fetchone()[0]
+        if pending is not None:
+            lower = min(lower, pending)
+        return fetched + self.sync_range(list_page, lower)
+
+    def transactions(self, start, end):
+        """Return the stored transactions created between the start and end timestamps, inclusive, newest first.
+
+        Each transaction is a list of the values of COLUMNS, with amounts in cents.
+        """
+        return self._db.execute('SELECT {} FROM transactions WHERE created >= ? AND created <= ?'
+                                ' ORDER BY created DESC, id DESC'.format(', '.join(COLUMNS)), (start, end))
@@ -1,7 +1,7 @@
 #!/usr/bin/python3
 """Retrieve all Stripe transactions after a start datetime (default: start of prior month) and before an end datetime (default: current) and write them to a csv file.
 
-The script takes two required arguments:
+The script takes two arguments, required unless --export is given:
 api_key=The Stripe API key to use in this script.
 api_version=The Stripe API version to use in this script.
 
@@ -9,23 +9,49 @@ The script takes the following optional arguments:
 start_date=YYYYMMDDHHmm
 end_date=YYYYMMDDHHmm
 output=Path to write the output csv file. This file will be overwritten without warning if it exists.
+store=Path to a sqlite file keeping a local copy of the transactions. Only transactions that are new since the last run
+      (or were still pending) are downloaded into it, and the output is then written from it. An interrupted download
+      resumes where it stopped on the next run.
+export=Write the output from the store without contacting Stripe at all. The api_key and api_version are not used and
+       can be left out, unless start_date or end_date follow them, in which case any placeholder such as '' will do.
+api_base=Base URL of the Stripe API, e.g. to use a local stand-in such as benchmarks/stripe_stub.py.
+cache_file=Path to a sqlite file caching the Stripe responses that can no longer change, such as pages of settled
+           transactions in a date range that has ended, so re-runs do not download them again.
+cache_ttl=Days a cached response is used for. Defaults to 30.
 """
 import stripe
 import csv
 import argparse
 import arrow
+import sys
+from functools import partial
+
+import csv_io
+import money
+from stripe_client import ResponseCache, auto_paging, list_balance_transactions, use_pooled_session
+from stripe_store import COLUMNS, TransactionStore
 
 author = 'brian.k.smith@gmail.com'
 
 parser = argparse.ArgumentParser(description='Retrieve Stripe transactions.')
-parser.add_argument('api_key', help='The Stripe API key to use to retrieve the desired information')
-parser.add_argument('api_version', help='The Stripe API version to use to retrieve the desired information')
+parser.add_argument('api_key', help='The Stripe API key to use to retrieve the desired information. Not needed with'
+                                    ' --export.', nargs='?')
+parser.add_argument('api_version', help='The Stripe API version to use to retrieve the desired information. Not'
+                                        ' needed with --export.', nargs='?')
 parser.add_argument('start_date', help='The starting time for the desired data.', nargs='?')
 parser.add_argument('end_date', help='The ending time for the desired data.', nargs='?')
 parser.add_argument('--output', help='Path to csv output file. This file will be overwritten if it exists. Defaults'
                                      ' to stdout.')
+parser.add_argument('--store', help='Path to sqlite file keeping a local copy of the transactions.')
+parser.add_argument('--export', help='Write the output from --store without contacting Stripe.', action='store_true')
+parser.add_argument('--api_base', help='Base URL of the Stripe API. Defaults to the real one.')
+parser.add_argument('--cache_file', help='Path to sqlite file caching Stripe responses that can no longer change.')
+parser.add_argument('--cache_ttl', help='Days a cached response is used for. Defaults to 30.', default=30.0,
+                    type=float)
 
 args = parser.parse_args()
+if not args.export and (args.api_key is None or args.api_version is None):
+    parser.error('api_key and api_version are required unless --export is given')
 
 # Take care of any default setup needed
 if args.start_date is None:
@@ -41,20 +67,52 @@ if args.output is None:
     close_output = False
     args.output = 1
 
+if args.export and args.store is None:
+    print("ERROR: --export needs --store.", file=sys.stderr)
+    sys.exit(1)
+
 stripe.api_key = args.api_key
 stripe.api_version = args.api_version
+if args.api_base:
+    stripe.api_base = args.api_base
+use_pooled_session()
+cache = None
+if args.cache_file:
+    cache = ResponseCache(args.cache_file, args.cache_ttl * 86400)
+list_page = partial(list_balance_transactions, cache)
+
+
+def transaction_row(trans):
+    """Return the output row for a balance transaction with attributes named as in COLUMNS.
+
+    Stripe gives amounts in cents, which are formatted exactly instead of through a float.
+    """
+    return [trans.id, "${:>6}".format(money.format(trans.amount)), trans.available_on, trans.created, trans.currency,
+            trans.description, "${:>6}".format(money.format(trans.fee)), "${:>6}".format(money.format(trans.net)),
+            trans.source, trans.status, trans.type]
+
+
+store = None
+if args.store is not None:
+    store = TransactionStore(args.store)
+    if not args.export:
+        store.sync(list_page, args.start_date.timestamp)
+    transactions = (stripe.StripeObject.construct_from(dict(zip(COLUMNS, values)), args.api_key)
+                    for values in store.transactions(args.start_date.timestamp, args.end_date.timestamp))
+else:
+    transactions = auto_paging(list_page, limit=100,
+                               created={"gte": args.start_date.timestamp, "lte": args.end_date.timestamp})
 
 # Open required files
 # noinspection PyTypeChecker
-with open(args.output, mode='w', newline='', closefd=close_output) as output_file:
-    transactions = stripe.BalanceTransaction.list(created=
-                                                  {"gte": args.start_date.timestamp, "lte": args.end_date.timestamp})
-
+with csv_io.open_output(args.output, close_output) as output_file:
     out_writer = csv.writer(output_file)
     # Set up output file with headers
-    out_writer.writerow(["id", "amount", "available_on", "created", "currency", "description", "fee", "net", "source",
-                         "status", "type"])
-    for trans in transactions.auto_paging_iter():
-        out_writer.writerow([trans.id, "${:6.2f}".format(trans.amount / 100), trans.available_on, trans.created,
-                             trans.currency, trans.description, "${:6.2f}".format(trans.fee / 100),
-                             "${:6.2f}".format(trans.net / 100), trans.source, trans.status, trans.type])
+    out_writer.writerow(COLUMNS)
+    for trans in transactions:
+        out_writer.writerow(transaction_row(trans))
+if store is not None:
+    store.close()
+if cache is not None:
+    print(cache.report(), file=sys.stderr)
+    cache.close()
@@ -9,14 +9,29 @@ column=The column in the input file where the transfer ids are located.
 The script takes the following optional arguments:
 input=Path to a csv file containing the designated input columns.
 output=Path to write the output csv file. This file will be overwritten without warning if it exists.
+concurrency=Number of transfers to look up at the same time. Rows are still written in input order. Defaults to 1.
+max_retries=Number of times to retry a request that Stripe rejected for exceeding the rate limit. Defaults to 5.
+backoff=Seconds to wait before the first retry. Each further retry waits up to twice as long. Defaults to 0.5.
+api_base=Base URL of the Stripe API, e.g. to use a local stand-in such as benchmarks/stripe_stub.py.
+cache_file=Path to a sqlite file caching the Stripe responses that can no longer change, such as the transactions of
+           settled payouts, so re-runs do not download them again.
+cache_ttl=Days a cached response is used for. Defaults to 30.
 """
 import stripe
 import csv
 import argparse
+import random
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from copy import deepcopy
 
+import csv_io
+from stripe_client import ResponseCache, auto_paging, list_balance_transactions, use_pooled_session
+
 author = 'brian.k.smith@gmail.com'
 
 parser = argparse.ArgumentParser(description='Retrieve transactions included in stripe transfers at column.')
@@ -27,6 +42,15 @@ parser.add_argument('--input', help='Path to csv input file with column(s) to ex
                                     ' Defaults to stdin.')
 parser.add_argument('--output', help='Path to csv output file. This file will be overwritten if it exists. Defaults'
                                      ' to stdout.')
+parser.add_argument('--concurrency', help='Number of transfers to look up at the same time. Defaults to 1.', default=1,
+                    type=int)
+parser.add_argument('--max_retries', help='Times to retry a rate limited request. Defaults to 5.', default=5, type=int)
+parser.add_argument('--backoff', help='Seconds to wait before the first retry of a rate limited request. Defaults to'
+                                      ' 0.5.', default=0.5, type=float)
+parser.add_argument('--api_base', help='Base URL of the Stripe API. Defaults to the real one.')
+parser.add_argument('--cache_file', help='Path to sqlite file caching Stripe responses that can no longer change.')
+parser.add_argument('--cache_ttl', help='Days a cached response is used for. Defaults to 30.', default=30.0,
+                    type=float)
 
 args = parser.parse_args()
 
@@ -42,25 +66,82 @@ if args.output is None:
 
 stripe.api_key = args.api_key
 stripe.api_version = args.api_version
+if args.api_base:
+    stripe.api_base = args.api_base
+use_pooled_session(max(args.concurrency, 1))
+cache = None
+if args.cache_file:
+    cache = ResponseCache(args.cache_file, args.cache_ttl * 86400)
+
+# When any lookup is rate limited, every lookup waits until this time before its next request
+throttle = {'until': 0.0}
+throttle_lock = threading.Lock()
+
+
+def list_transactions(**params):
+    """Return a page of balance transactions, waiting and retrying when Stripe answers with a rate limit error."""
+    attempt = 0
+    while True:
+        with throttle_lock:
+            wait = throttle['until'] - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        try:
+            return list_balance_transactions(cache, limit=100, **params)
+        except stripe.error.RateLimitError as error:
+            if attempt >= args.max_retries:
+                raise
+            retry_after = error.headers.get('Retry-After') if error.headers else None
+            if retry_after:
+                delay = float(retry_after)
+            else:
+                # Exponential backoff with jitter, so concurrent lookups do not retry in lockstep
+                delay = args.backoff * (2 ** attempt) * random.uniform(0.5, 1)
+            with throttle_lock:
+                throttle['until'] = max(throttle['until'], time.monotonic() + delay)
+            attempt += 1
+
+
+def transfer_sources(transfer_id):
+    """Return the source of every transaction in the transfer, or None when Stripe does not know the transfer."""
+    try:
+        return [trans.source for trans in auto_paging(list_transactions, payout=transfer_id)]
+    except stripe.error.InvalidRequestError:
+        return None
+
 
 # Open required files
 # noinspection PyTypeChecker
-with open(args.input, newline='', encoding='UTF-8', closefd=close_input) as input_file,\
-        open(args.output, mode='w', newline='', closefd=close_output) as output_file:
+with csv_io.open_input(args.input, close_input) as input_file,\
+        csv_io.open_output(args.output, close_output) as output_file:
     in_reader = csv.reader(input_file)
     out_writer = csv.writer(output_file)
     # Set up output file with input headers
     output_headers = next(in_reader)
     output_headers.append("transaction_ids")
     out_writer.writerow(output_headers)
-    # Iterate through input
-    for row in in_reader:
-        transfer_id = row[int(args.column)]
-        try:
-            transactions = stripe.BalanceTransaction.list(payout=transfer_id)
-            for trans in transactions.auto_paging_iter():
-                out_row = deepcopy(row)
-                out_row.append(trans.source)
-                out_writer.writerow(out_row)
-        except stripe.error.InvalidRequestError:
-            print("WARN: Could not find details for transfer {}.".format(transfer_id),file=sys.stderr)
+
+    def write_transfer(row, transfer_id, sources):
+        if sources is None:
+            print("WARN: Could not find details for transfer {}.".format(transfer_id), file=sys.stderr)
+            return
+        for source in sources:
+            out_row = deepcopy(row)
+            out_row.append(source)
+            out_writer.writerow(out_row)
+
+    # Iterate through input, looking up several transfers at once but writing them in input order
+    with ThreadPoolExecutor(max(args.concurrency, 1)) as executor:
+        pending = deque()
+        for row in in_reader:
+            transfer_id = row[int(args.column)]
+            pending.append([row, transfer_id, executor.submit(transfer_sources, transfer_id)])
+            if len(pending) >= args.concurrency * 4:
+                row, transfer_id, future = pending.popleft()
+                write_transfer(row, transfer_id, future.result())
+        while pending:
+            row, transfer_id, future = pending.popleft()
+            write_transfer(row, transfer_id, future.result())
+if cache is not None:
+    print(cache.report(), file=sys.stderr)
+    cache.close()
@@ -0,0 +1,96 @@
+"""Write transactions into a throwaway GnuCash sqlite book with BookWriter, then import them again.
+
+Run with python -m unittest discover tests from the repository root. Skipped when piecash is not installed.
+"""
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import piecash
+    import gnucash_book
+except ImportError:
+    piecash = None
+
+author = 'brian.k.smith@gmail.com'
+
+ROWS = [[datetime.date(2018, 1, 5), 'Shop', 'Expenses:Groceries', Decimal('-12.30')],
+        # The same transaction twice on one day, both have to be written
+        [datetime.date(2018, 1, 5), 'Shop', 'Expenses:Groceries', Decimal('-12.30')],
+        [datetime.date(2018, 1, 6), 'Paycheck', 'Income:Salary', Decimal('1500.00')]]
+
+
+@unittest.skipIf(piecash is None, 'needs piecash')
+class BookWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.gnucash')
+        book = piecash.create_book(sqlite_file=self.path, currency='USD')
+        usd = book.default_currency
+        assets = piecash.Account('Assets', 'ASSET', usd, parent=book.root_account)
+        piecash.Account('Checking', 'BANK', usd, parent=assets)
+        expenses = piecash.Account('Expenses', 'EXPENSE', usd, parent=book.root_account)
+        piecash.Account('Groceries', 'EXPENSE', usd, parent=expenses)
+        income = piecash.Account('Income', 'INCOME', usd, parent=book.root_account)
+        piecash.Account('Salary', 'INCOME', usd, parent=income)
+        book.save()
+        book.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, rows):
+        """Write rows into the book, returning the writer."""
+        book = gnucash_book.open_book(self.path)
+        try:
+            writer = gnucash_book.BookWriter(book, 'Assets:Checking', batch_size=2)
+            for row in rows:
+                writer.add(*row)
+            writer.flush()
+        finally:
+            book.close()
+        return writer
+
+    def splits(self):
+        """Return the [day, description, account, value] of every split of the book, sorted."""
+        book = piecash.open_book(self.path, readonly=True, open_if_lock=True)
+        try:
+            return sorted([gnucash_book.post_day(split.transaction.post_date), split.transaction.description,
+                           split.account.fullname, split.value] for split in book.splits)
+        finally:
+            book.close()
+
+    def test_write_and_skip(self):
+        writer = self.write(ROWS)
+        self.assertEqual([writer.written, writer.skipped], [3, 0])
+        expected = sorted([[day, description, 'Assets:Checking', amount] for day, description, _, amount in ROWS] +
+                          [[day, description, other, -amount] for day, description, other, amount in ROWS])
+        self.assertEqual(self.splits(), expected)
+        # Importing the same rows again skips every one of them
+        writer = self.write(ROWS)
+        self.assertEqual([writer.written, writer.skipped], [0, 3])
+        self.assertEqual(self.splits(), expected)
+        # One more of the duplicated transaction is written, the others are skipped
+        writer = self.write(ROWS + [ROWS[0]])
+        self.assertEqual([writer.written, writer.skipped], [1, 3])
+        self.assertEqual(len(self.splits()), len(expected) + 2)
+
+    def test_unknown_account(self):
+        book = gnucash_book.open_book(self.path)
+        try:
+            writer = gnucash_book.BookWriter(book, 'Assets:Checking')
+            with self.assertRaises(KeyError):
+                writer.add(datetime.date(2018, 1, 5), 'Shop', 'Expenses:Nope', Decimal('1.00'))
+        finally:
+            book.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""Check how money.py reads and writes amounts.
+
+Run with python -m unittest discover tests from the repository root.
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import money
+
+author = 'brian.k.smith@gmail.com'
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_amounts(self):
+        for text, units in [
+                # Two decimals, read by the fast path
+                ['12.34', 1234], ['-12.34', -1234], ['$12.34', 1234], ['$-12.34', -1234], [' 12.34', 1234],
+                # Read by the slow path
+                ['-$12.34', -1234], ['+$.34', 34], ['$ 1.25', 125], ['- $ 40', -4000], ['12.', 1200], ['.5', 50],
+                ['7', 700], [' 3.1 ', 310], ['-0.00', 0]]:
+            with self.subTest(text):
+                self.assertEqual(money.parse(text), units)
+
+    def test_not_amounts(self):
+        for text in ['1_000.00', '1,000.00', '1e3', '', '.', '$', '-', '12.3.4', '--1', '1 2', 'NaN']:
+            with self.subTest(text):
+                self.assertRaises(ValueError, money.parse, text)
+
+    def test_round_half_to_even(self):
+        for text, units in [['0.125', 12], ['0.135', 14], ['0.1251', 13], ['0.12500', 12], ['-0.125', -12],
+                            ['2.675', 268], ['0.004', 0], ['9.995', 1000]]:
+            with self.subTest(text):
+                self.assertEqual(money.parse(text), units)
+
+    def test_exact(self):
+        self.assertEqual(money.parse('1.5', exact=True), 150)
+        self.assertEqual(money.parse('$-1.50', exact=True), -150)
+        for text in ['1.005', '0.125', '1.000']:
+            with self.subTest(text):
+                self.assertRaises(ValueError, money.parse, text, exact=True)
+
+    def test_places(self):
+        self.assertEqual(money.parse('12', places=0), 12)
+        self.assertEqual(money.parse('1.2345', places=3), 1234)
+
+
+class FormatTest(unittest.TestCase):
+
+    def test_format(self):
+        for units, text in [[0, '0.00'], [5, '0.05'], [-5, '-0.05'], [-99, '-0.99'], [-100, '-1.00'],
+                            [1234, '12.34'], [-123456789, '-1234567.89']]:
+            with self.subTest(units):
+                self.assertEqual(money.format(units), text)
+        self.assertEqual(money.format(-5, places=0), '-5')
+        self.assertEqual(money.format(-5, places=3), '-0.005')
+
+    def test_round_trip(self):
+        for units in range(-1001, 1002, 7):
+            self.assertEqual(money.parse(money.format(units)), units)
+
+    def test_is_formatted(self):
+        for text, formatted in [['12.34', True], ['-12.34', True], ['0.00', True], ['-0.00', False],
+                                ['012.34', False], ['$1.00', False], ['1.0', False], ['+1.00', False],
+                                [' 1.00', False], ['1e3', False]]:
+            with self.subTest(text):
+                self.assertEqual(money.is_formatted(text), formatted)
+
+
+class LikeDecimalTest(unittest.TestCase):
+
+    def test_parse_like_decimal(self):
+        for text, units in [['12.34', 1234], ['$-12.34', -1234], ['1e3', 100000], ['1E-2', 1], ['0.125', 12],
+                            ['2.5e-2', 2]]:
+            with self.subTest(text):
+                self.assertEqual(money.parse_like_decimal(text), units)
+        self.assertRaises(ArithmeticError, money.parse_like_decimal, '1,000.00')
+
+    def test_format_like_decimal(self):
+        for text, negate, formatted in [['12.34', False, '12.34'], ['12.34', True, '-12.34'],
+                                        ['-12.34', True, '12.34'], ['-0.00', False, '-0.00'],
+                                        ['-0.00', True, '0.00'], ['0.00', True, '-0.00'], ['1e3', False, '1000.00'],
+                                        ['1.005', False, '1.00'], ['12.3', True, '-12.30'], ['$12.34', True, '-12.34'],
+                                        ['-$.5', False, '-0.50']]:
+            with self.subTest(text=text, negate=negate):
+                self.assertEqual(money.format_like_decimal(text, negate), formatted)
+        self.assertRaises(ValueError, money.format_like_decimal, '1,000.00')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""Check that parallel.py splits csv input only between records, and that --workers gives the output of one process.
+
+Run with python -m unittest discover tests from the repository root.
+"""
+import contextlib
+import csv
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parallel
+import regex_modify_rows
+
+author = 'brian.k.smith@gmail.com'
+
+# Inputs, and the records csv.reader reads from them
+CASES = [
+    ['embedded line break', b'a,"note line1\nline2",x\nb,c,d\n', [b'a,"note line1\nline2",x\n', b'b,c,d\n']],
+    ['doubled quotes', b'a,"say ""hi""",x\n"""",b\n', [b'a,"say ""hi""",x\n', b'"""",b\n']],
+    ['doubled quotes across lines', b'a,"x""\n""y",z\nb\n', [b'a,"x""\n""y",z\n', b'b\n']],
+    ['stray quote', b'12" PIZZA,x\nb,c\n', [b'12" PIZZA,x\n', b'b,c\n']],
+    ['stray quote before a quoted field', b'12" PIZZA,"note line1\nline2",x\nnext,row,y\n',
+     [b'12" PIZZA,"note line1\nline2",x\n', b'next,row,y\n']],
+    ['quoted field reopened', b'a,"x\ny" ,"z\nw",v\nb\n', [b'a,"x\ny" ,"z\nw",v\n', b'b\n']],
+    ['crlf', b'a,"x\r\ny"\r\nb\r\n', [b'a,"x\r\ny"\r\n', b'b\r\n']],
+    ['no final line break', b'a,b\n"c', [b'a,b\n', b'"c']],
+]
+
+
+class SplitRecordsTest(unittest.TestCase):
+
+    def test_split_records(self):
+        for name, data, records in CASES:
+            with self.subTest(name):
+                chunks = list(parallel.split_records(io.BytesIO(data), 1))
+                self.assertEqual([chunk[1] for chunk in chunks], records)
+                self.assertEqual([chunk[0] for chunk in chunks], list(range(len(records))))
+                rows = list(csv.reader(io.StringIO(data.decode('UTF-8'), newline='')))
+                self.assertEqual(len(rows), len(records))
+
+    def test_read_record(self):
+        for name, data, records in CASES:
+            with self.subTest(name):
+                input_file = io.BytesIO(data)
+                self.assertEqual([parallel.read_record(input_file) for record in records], records)
+                self.assertEqual(parallel.read_record(input_file), b'')
+
+    def test_chunks_of_whole_records(self):
+        data = b''.join(case[1] if case[1].endswith(b'\n') else case[1] + b'\n' for case in CASES)
+        chunks = list(parallel.split_records(io.BytesIO(data), 64))
+        self.assertEqual(b''.join(chunk[1] for chunk in chunks), data)
+        rows = []
+        for row_offset, chunk in chunks:
+            self.assertEqual(row_offset, len(rows))
+            rows.extend(csv.reader(io.StringIO(chunk.decode('UTF-8'), newline='')))
+        self.assertEqual(rows, list(csv.reader(io.StringIO(data.decode('UTF-8'), newline=''))))
+
+
+class WorkersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filter_path = os.path.join(self.directory, 'modify.csv')
+        with open(self.filter_path, mode='w', newline='') as filter_file:
+            csv.writer(filter_file).writerows([
+                ['input column name', 'regex', 'operation', 'operation column name', 'operation data'],
+                ['payee', 'PIZZA', 'warn', 'payee', ''],
+                ['memo', 'line2', 'modify', 'category', 'Multi'],
+                ['payee', '^DROP', 'drop', 'payee', '']])
+        lines = [b'payee,memo,category\n']
+        for i in range(300):
+            lines.append([b'SHOP %d,plain,\n' % i, b'12" PIZZA %d,"note line1\nline2",\n' % i,
+                          b'DROP %d,"say ""hi""",x\n' % i][i % 3])
+        self.data = b''.join(lines)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_stage(self, workers):
+        """Return [output, stderr] of regex_modify_rows over the data, in one process or chunked over workers."""
+        args = regex_modify_rows.parser.parse_args([self.filter_path, '--workers', str(workers)])
+        args.stats = None
+        rules = regex_modify_rows.load_rules(args)
+        output = io.StringIO(newline='')
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            if workers > 1:
+                parallel.run_chunked(regex_modify_rows.stage, args, rules, io.BytesIO(self.data), output, workers,
+                                     chunk_bytes=256)
+            else:
+                rows = csv.reader(io.StringIO(self.data.decode('UTF-8'), newline=''))
+                csv.writer(output).writerows(regex_modify_rows.stage(rows, args, rules))
+        return [output.getvalue(), stderr.getvalue()]
+
+    def test_workers_match_one_process(self):
+        serial = self.run_stage(1)
+        # Row numbers in the warnings depend on the row offset of every chunk
+        self.assertIn('row 299 matched PIZZA', serial[1])
+        self.assertEqual(self.run_stage(3), serial)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+"""Run a two stage pipeline twice against a throwaway cache directory, and check what the cache keeps.
+
+Run with python -m unittest discover tests from the repository root.
+"""
+import contextlib
+import csv
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyaccounting
+import stage_cache
+
+author = 'brian.k.smith@gmail.com'
+
+RULE_HEADER = ['input column name', 'regex', 'operation', 'operation column name', 'operation data']
+
+
+class PipelineCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.write('input.csv', [['payee', 'category']] + [['SHOP {:d}'.format(i), ''] for i in range(50)])
+        self.write('first.csv', [RULE_HEADER, ['payee', '1$', 'modify', 'category', 'Ones']])
+        self.write('second.csv', [RULE_HEADER, ['payee', '^SHOP 2', 'modify', 'payee', 'Twenties']])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write(self, name, rows):
+        with open(self.path(name), mode='w', newline='') as output_file:
+            csv.writer(output_file).writerows(rows)
+
+    def run_pipeline(self, output, *options):
+        """Run the pipeline into output with the run command's options and return what it printed to stderr."""
+        config = {'input': self.path('input.csv'), 'output': self.path(output), 'cache_dir': self.path('cache'),
+                  'stages': [{'regex_modify_rows': self.path('first.csv')},
+                             {'regex_modify_rows': self.path('second.csv')}]}
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            pyaccounting.run_pipeline(config, pyaccounting.parser.parse_args(['run', 'pipeline.yaml'] + list(options)))
+        return stderr.getvalue()
+
+    def read(self, name):
+        with open(self.path(name), newline='') as input_file:
+            return list(csv.reader(input_file))
+
+    def test_reuse_and_rerun(self):
+        self.assertNotIn('Pipeline cache', self.run_pipeline('out1.csv'))
+        self.assertEqual(len(os.listdir(self.path('cache'))), 2)
+        self.assertIn('reused the output of 2 of 2 stages', self.run_pipeline('out2.csv'))
+        self.assertEqual(self.read('out2.csv'), self.read('out1.csv'))
+        self.assertEqual(self.read('out1.csv')[22], ['Twenties', 'Ones'])
+
+        self.write('second.csv', [RULE_HEADER, ['payee', '^SHOP 3', 'modify', 'payee', 'Thirties']])
+        self.assertIn('reused the output of 1 of 2 stages', self.run_pipeline('out3.csv'))
+        self.assertEqual(len(os.listdir(self.path('cache'))), 3)
+        self.assertNotIn('Pipeline cache', self.run_pipeline('uncached.csv', '--no_cache'))
+        self.assertEqual(self.read('out3.csv'), self.read('uncached.csv'))
+        self.assertEqual(self.read('out3.csv')[32], ['Thirties', 'Ones'])
+
+    def test_evict(self):
+        cache = stage_cache.StageCache(self.path('cache'), 250)
+        # Three entries of 100 bytes, used at times 1000, 2000 and 3000
+        for used, key in enumerate(['old', 'middle', 'new'], 1):
+            with open(cache.path(key), mode='w') as entry_file:
+                entry_file.write('x' * 100)
+            os.utime(cache.path(key), (used * 1000, used * 1000))
+        cache.evict()
+        self.assertEqual(['old' in cache, 'middle' in cache, 'new' in cache], [False, True, True])
+        # Reading an entry makes it the most recently used
+        cache.open('middle').close()
+        cache.max_bytes = 100
+        cache.evict()
+        self.assertEqual(['middle' in cache, 'new' in cache], [True, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
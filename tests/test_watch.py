@@ -0,0 +1,71 @@
+"""Run pyaccounting.py's watch command once over an inbox holding a file the stages can process and one they fail on.
+
+Run with python -m unittest discover tests from the repository root.
+"""
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyaccounting
+
+author = 'brian.k.smith@gmail.com'
+
+
+class WatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.inbox = os.path.join(self.directory, 'in')
+        self.outbox = os.path.join(self.directory, 'out')
+        os.makedirs(self.inbox)
+        self.write('in/good.csv', 'date,payee\n2018-01-05,Shop\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write(self, name, text):
+        with open(self.path(name), mode='w', newline='') as output_file:
+            output_file.write(text)
+
+    def watch(self, stages):
+        """Run the watch command once with stages and return what it printed to stderr."""
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            pyaccounting.watch_pipeline({'inbox': self.inbox, 'outbox': self.outbox, 'stages': stages}, once=True)
+        return stderr.getvalue()
+
+    def check_moved(self, stderr):
+        self.assertEqual(sorted(os.listdir(self.outbox)), ['good.csv'])
+        self.assertEqual(sorted(os.listdir(self.path('in/processed'))), ['good.csv'])
+        self.assertEqual(sorted(os.listdir(self.path('in/failed'))), ['bad.csv'])
+        self.assertEqual(sorted(os.listdir(self.inbox)), ['failed', 'processed'])
+        self.assertIn('ERROR: Could not process bad.csv', stderr)
+        self.assertIn('Processed 1 files, 1 failed', stderr)
+
+    def test_stage_raises(self):
+        # arrow raises its ParserError, a RuntimeError, for a date it cannot read
+        self.write('dates.csv', 'input column,input format,output format,output header\n0,YYYY-MM-DD,MM/DD/YYYY,when\n')
+        self.write('in/bad.csv', 'date,payee\nnot a date,Shop\n')
+        self.check_moved(self.watch([{'time_format': self.path('dates.csv')}]))
+        with open(self.path('out/good.csv'), newline='') as output_file:
+            self.assertEqual(output_file.read(), 'date,payee,when\r\n2018-01-05,Shop,01/05/2018\r\n')
+
+    def test_stage_exits(self):
+        # regex_modify_rows exits once a row matches a filter with an unsupported operation
+        self.write('modify.csv', 'input column name,regex,operation,operation column name,operation data\n'
+                                 'payee,^BAD,explode,payee,\n')
+        self.write('in/bad.csv', 'date,payee\n2018-01-05,BAD\n')
+        self.check_moved(self.watch([{'regex_modify_rows': self.path('modify.csv')}]))
+
+
+if __name__ == '__main__':
+    unittest.main()
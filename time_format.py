@@ -10,10 +10,21 @@ filter=Path to a csv file containing the columns input column, date/time/datetim
 The script takes the following optional arguments:
 input=Path to a csv file containing the designated input column.
 output=Path to write the output csv file. This file will be overwritten without warning if it exists.
+workers=Number of worker processes to split the input between. Defaults to 1.
+columnar=Process the input in batches of rows, converting each distinct date/time in a column only once. The output is
+         the same, but files with many repeated dates are processed much faster.
+batch_size=Number of rows per batch in columnar mode. Defaults to 10000.
+profile=Print rows and time per phase to stderr once the output is written.
+stats_json=Path to write rows and time per phase to as JSON.
 """
 import csv
 import argparse
-import arrow
+
+import csv_io
+import stats
+from columnar import ColumnFunction, columnar_rows
+from date_convert import convert
+from parallel import run_chunked
 
 author = 'brian.k.smith@gmail.com'
 
@@ -24,41 +35,92 @@ parser.add_argument('--input', help='Path to csv input file with a date, time, o
                                     ' Defaults to stdin.')
 parser.add_argument('--output', help='Path to csv output file. This file will be overwritten if it exists. Defaults'
                                      ' to stdout.')
+parser.add_argument('--workers', help='Number of worker processes to split the input between. Defaults to 1.',
+                    default=1, type=int)
+parser.add_argument('--columnar', help='Convert each distinct date/time once per batch of rows.', action='store_true')
+parser.add_argument('--batch_size', help='Number of rows per batch in columnar mode. Defaults to 10000.',
+                    default=10000, type=int)
+stats.add_arguments(parser)
+
 
-args = parser.parse_args()
-
-# Take care of any default setup needed
-close_input = True
-if args.input is None:
-    close_input = False
-    args.input = 0
-close_output = True
-if args.output is None:
-    close_output = False
-    args.output = 1
-
-# Open required files
-# noinspection PyTypeChecker
-with open(args.input, newline='', encoding='UTF-8', closefd=close_input) as input_file, open(args.filter, newline='')\
-        as filter_file, open(args.output, mode='w', newline='', closefd=close_output) as output_file:
-    in_reader = csv.reader(input_file)
-    filter_reader = csv.reader(filter_file)
-    out_writer = csv.writer(output_file)
-    # Set up filters array
+def load_filters(filter_path):
+    """Return the filters in the filter file as a list of [column number, input format, output format, header]."""
     filters = []
-    filter_headers = next(filter_reader)
-    for filter_row in filter_reader:
-        filters.append([int(filter_row[0]), filter_row[1], filter_row[2], filter_row[3]])
-    # Set up output file with input headers and headers added by each regex
-    output_headers = next(in_reader)
+    with open(filter_path, newline='') as filter_file:
+        filter_reader = csv.reader(filter_file)
+        filter_headers = next(filter_reader)
+        for filter_row in filter_reader:
+            filters.append([int(filter_row[0]), filter_row[1], filter_row[2], filter_row[3]])
+    return filters
+
+
+def load_rules(args):
+    """Return the filters used by stage."""
+    return load_filters(args.filter)
+
+
+def format_cell(filt, value):
+    """Return value, a date/time in the input format of filt, in the output format of filt."""
+    return convert(value, filt[1], filt[2])
+
+
+def stage(rows, args, rules=None):
+    """Yield the header row and then each row with a reformatted date/time column added per filter.
+
+    rows is an iterator of csv rows whose first row contains the column headers. rules is the result of
+    load_rules(args), built here when not given.
+    """
+    rows = iter(rows)
+    filters = rules if rules is not None else load_rules(args)
+    # Set up output file with input headers and headers added by each filter
+    output_headers = next(rows, None)
+    if output_headers is None:
+        return
     for filt in filters:
         output_headers.append(filt[3])
-    out_writer.writerow(output_headers)
+    yield output_headers
+    if getattr(args, 'columnar', False):
+        columns = []
+        for filt in filters:
+            columns.append([filt[0], ColumnFunction(lambda value, filt=filt: [format_cell(filt, value)])])
+        yield from columnar_rows(rows, columns, args.batch_size)
+        return
     # Iterate through input
-    for row in in_reader:
+    for row in rows:
         out_row = row
         # Perform each of the requested datetime operations on this row
         for filt in filters:
-            in_datetime = arrow.get(row[filt[0]], filt[1])
-            out_row.append(in_datetime.format(filt[2]))
-        out_writer.writerow(out_row)
+            out_row.append(format_cell(filt, row[filt[0]]))
+        yield out_row
+
+
+def main():
+    args = parser.parse_args()
+    stats.setup(parser, args, 'time_format')
+
+    # Take care of any default setup needed
+    close_input = True
+    if args.input is None:
+        close_input = False
+        args.input = 0
+    close_output = True
+    if args.output is None:
+        close_output = False
+        args.output = 1
+
+    if args.workers > 1:
+        # noinspection PyTypeChecker
+        with csv_io.open_input(args.input, close_input, binary=True) as input_file,\
+                csv_io.open_output(args.output, close_output) as output_file:
+            run_chunked(stage, args, load_rules(args), input_file, output_file, args.workers)
+        return
+
+    # Open required files
+    # noinspection PyTypeChecker
+    with csv_io.open_input(args.input, close_input) as input_file,\
+            csv_io.open_output(args.output, close_output) as output_file:
+        stats.run_stage(stage, args, input_file, output_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Summarize the rows no rule matched in a fixed amount of memory, keeping the payees that occur most often.
+
+Printing every unmatched row does not scale: an export of millions of rows with poor rule coverage holds millions of
+entries and prints a report nobody can read. Instead, payees are normalized so that the store, terminal and
+transaction numbers banks add to them do not make every row unique, and counted with the Space-Saving algorithm
+(Metwally, Agrawal and El Abbadi, 2005).
+
+Space-Saving keeps at most capacity payees. When a new payee arrives and the summary is full, it replaces the payee
+with the lowest count and takes over that count, which is remembered as the new payee's overcount. Every payee that
+occurs more than rows / capacity times is guaranteed to be in the summary, and its count is never too low and at most
+overcount too high. The amount, dates and example of a payee cover the rows counted since it last entered the summary.
+"""
+import heapq
+import re
+
+import money
+
+author = 'brian.k.smith@gmail.com'
+
+HEADERS = ['payee', 'count', 'overcount', 'amount', 'first_date', 'last_date', 'example']
+
+_noise_regex = re.compile(r'[\d#*\s]+')
+
+
+def normalize_payee(payee):
+    """Return payee in upper case without digits, # and *, and with single spaces.
+
+    UBER TRIP #80376 and Uber Trip #95036 both become UBER TRIP.
+    """
+    key = _noise_regex.sub(' ', payee.upper()).strip()
+    return key if key else payee.strip().upper()
+
+
+class UnmatchedReport:
+    """Space-Saving summary of the normalized payees of unmatched rows.
+
+    Rows are added with append([payee, date, amount]), like the list of unmatched rows filter.py used to keep.
+    Each payee is held as [count, overcount, amount in cents, first date, last date, example payee].
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.rows = 0
+        self.payees = {}
+        # [count, payee] for every payee, a count is only updated when it reaches the top, so it may be too low
+        self._heap = []
+
+    def __len__(self):
+        return len(self.payees)
+
+    def _evict(self):
+        """Remove the payee with the lowest count and return its count."""
+        heap = self._heap
+        payees = self.payees
+        while True:
+            count, key = heap[0]
+            actual = payees[key][0]
+            if actual == count:
+                break
+            heapq.heapreplace(heap, [actual, key])
+        heapq.heappop(heap)
+        del payees[key]
+        return count
+
+    def append(self, entry):
+        """Count an unmatched row given as [payee, date, amount]."""
+        payee, date, amount = entry
+        self.rows += 1
+        key = normalize_payee(payee)
+        item = self.payees.get(key)
+        if item is None:
+            overcount = self._evict() if len(self.payees) >= self.capacity else 0
+            item = self.payees[key] = [overcount, overcount, 0, date, date, payee]
+            heapq.heappush(self._heap, [overcount + 1, key])
+        item[0] += 1
+        item[4] = date
+        try:
+            item[2] += money.parse(amount)
+        except ValueError:
+            pass
+
+    def min_count(self):
+        """Return the count any payee missing from the summary may have had: 0 until the summary is full."""
+        if len(self.payees) < self.capacity:
+            return 0
+        return min(item[0] for item in self.payees.values())
+
+    def merge(self, other):
+        """Add the rows summarized by other, which were read after the rows of this summary.
+
+        A payee missing from one summary may have occurred up to that summary's min_count times, so that much is added
+        to its count and overcount, which keeps the guarantees of a single summary.
+        """
+        own_min = self.min_count()
+        other_min = other.min_count()
+        merged = {}
+        for key in set(self.payees) | set(other.payees):
+            own = self.payees.get(key)
+            theirs = other.payees.get(key)
+            if own is None:
+                merged[key] = [theirs[0] + own_min, theirs[1] + own_min] + theirs[2:]
+            elif theirs is None:
+                merged[key] = [own[0] + other_min, own[1] + other_min] + own[2:]
+            else:
+                merged[key] = [own[0] + theirs[0], own[1] + theirs[1], own[2] + theirs[2], own[3], theirs[4], own[5]]
+        kept = heapq.nlargest(self.capacity, merged.items(), key=lambda item: item[1][0])
+        self.payees = dict(kept)
+        self._heap = [[item[0], key] for key, item in kept]
+        heapq.heapify(self._heap)
+        self.rows += other.rows
+        return self
+
+    def top(self, k):
+        """Return the report rows of the k payees with the highest counts, highest first."""
+        ranked = sorted(self.payees.items(), key=lambda item: (-item[1][0], item[0]))[:k]
+        return [[key, item[0], item[1], money.format(item[2]), item[3], item[4], item[5]] for key, item in ranked]
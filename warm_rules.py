@@ -0,0 +1,70 @@
+"""Keep the compiled rules of a stage in memory between files, loading them again only when their files change.
+
+A script run once per file spends most of its time on a small file starting Python, importing modules and reading and
+compiling its rule file. A long running process loads the rules once with the stage's load_rules(args) and passes them
+to its stage function for every file instead.
+
+Before every file the modification time and size of each file the rules came from are checked, which costs a stat call
+per file. Only when one changed are the files hashed, and only when a hash changed are the rules loaded again, so
+touching a rule file or saving it unchanged keeps the loaded rules.
+"""
+import csv
+import os
+import re
+import sys
+
+from match_cache import file_hash
+
+author = 'brian.k.smith@gmail.com'
+
+
+class WarmRules:
+    """Rules of the stage named name, made by load(args) from the files at paths.
+
+    loads counts the times the rules were loaded, including the first.
+    """
+
+    def __init__(self, name, load, args, paths):
+        self.name = name
+        self.load = load
+        self.args = args
+        self.paths = paths
+        self.loads = 0
+        self.rules = None
+        self._seen = None
+        self._hashes = None
+        self.get()
+
+    def _stat(self):
+        """Return the modification time and size of each file the rules come from."""
+        seen = []
+        for path in self.paths:
+            info = os.stat(path)
+            seen.append([info.st_mtime_ns, info.st_size])
+        return seen
+
+    def get(self):
+        """Return the rules, loading them again first when the contents of one of their files changed.
+
+        When the rules were loaded before and loading them again fails, for instance because a rule file is being
+        edited, a warning is printed and the rules loaded before are returned. The first load raises the error.
+        """
+        # Stat before hashing, so a file changing while it is hashed is hashed again next time
+        seen = self._stat()
+        if seen == self._seen:
+            return self.rules
+        hashes = [file_hash(path) for path in self.paths]
+        if hashes != self._hashes:
+            try:
+                self.rules = self.load(self.args)
+            except (ValueError, IndexError, KeyError, OSError, csv.Error, re.error) as error:
+                if self.rules is None:
+                    raise
+                print('WARN: Could not load the rules of stage {} again, keeping the rules loaded before: {}'
+                      .format(self.name, error), file=sys.stderr)
+                self._seen = seen
+                return self.rules
+            self.loads += 1
+            self._hashes = hashes
+        self._seen = seen
+        return self.rules